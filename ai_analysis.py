@@ -1,5 +1,5 @@
 from google import genai
-import pandas as pd
+import hashlib
 import os
 from dotenv import load_dotenv
 
@@ -45,9 +45,56 @@ def format_ai_error(e):
         
     return f"오류가 발생했습니다: {err_msg}"
 
-def analyze_stock_data(file_path):
+def generate_text(client, model_id, prompt, label, on_chunk=None):
     """
-    엑셀 데이터를 읽어서 Gemini AI에게 분석을 요청합니다.
+    Gemini 응답 텍스트를 반환합니다. 429(요청 제한)는 대기 후 최대 3번까지 재시도
+    on_chunk를 넘기면 스트리밍 생성(generate_content_stream)으로 받으며 조각이 올 때마다 on_chunk(text)를 호출하고
+    끝나면 모은 전체 텍스트를 반환합니다. (이미 일부를 보낸 뒤의 오류는 재시도하지 않음)
+    """
+    import time
+    max_retries = 3
+    for attempt in range(max_retries):
+        parts = []
+        try:
+            if on_chunk is None:
+                response = client.models.generate_content(
+                    model=model_id,
+                    contents=prompt
+                )
+                return response.text
+            for chunk in client.models.generate_content_stream(model=model_id, contents=prompt):
+                if chunk.text:
+                    parts.append(chunk.text)
+                    on_chunk(chunk.text)
+            return ''.join(parts)
+        except Exception as e:
+            err_msg = str(e)
+            if ("429" in err_msg or "RESOURCE_EXHAUSTED" in err_msg) and attempt < max_retries - 1 and not parts:
+                wait_time = (attempt + 1) * 5
+                print(f"{label} 제한 발생 (시도 {attempt+1}/{max_retries}). {wait_time}초 후 재시도합니다...")
+                time.sleep(wait_time)
+                continue
+            raise e
+
+# 결과 분석 프롬프트 버전 (프롬프트나 모델을 바꾸면 올려서 이전 리포트 캐시를 쓰지 않게 함)
+STOCK_PROMPT_VERSION = '1'
+STOCK_MODEL_ID = 'gemini-2.5-flash'  # 2.0-flash 무료 티어 비활성화로 변경
+STOCK_SUMMARY_ROWS = 30
+
+def load_stock_summary(file_path):
+    """AI에게 넘기는 결과 데이터 (상위 30개 종목 표)"""
+    from result_store import read_frame
+    return read_frame(file_path).head(STOCK_SUMMARY_ROWS).to_string(index=False)
+
+def stock_report_key(data_summary):
+    """리포트 캐시 키: 분석 데이터와 프롬프트 버전/모델의 해시"""
+    return hashlib.sha256(f"{STOCK_PROMPT_VERSION}|{STOCK_MODEL_ID}|{data_summary}".encode('utf-8')).hexdigest()
+
+def analyze_stock_data(file_path, data_summary=None, on_chunk=None):
+    """
+    수집 결과(열 형식 사본 또는 엑셀)를 읽어서 Gemini AI에게 분석을 요청합니다.
+    data_summary: 이미 읽어 둔 load_stock_summary 결과 (캐시 키 계산에 쓴 것과 같은 데이터)
+    on_chunk: 스트리밍으로 받을 때 응답 조각마다 호출할 함수 (반환값은 동일하게 전체 텍스트)
     """
     if not os.path.exists(file_path):
         return "파일을 찾을 수 없습니다."
@@ -56,12 +103,12 @@ def analyze_stock_data(file_path):
         return "Gemini API 키가 설정되지 않았습니다. .env 파일에 GEMINI_API_KEY를 입력해주세요."
 
     try:
-        # 엑셀 데이터 로드
-        df = pd.read_excel(file_path)
-        data_summary = df.head(30).to_string(index=False)
+        # 결과 데이터 로드
+        if data_summary is None:
+            data_summary = load_stock_summary(file_path)
         
         client = genai.Client(api_key=GEMINI_API_KEY)
-        model_id = 'gemini-2.5-flash'  # 2.0-flash 무료 티어 비활성화로 변경
+        model_id = STOCK_MODEL_ID
         
         prompt = f"""
         당신은 전문적인 주식 퀀트 투자 분석가이자 시장 전략 시스템입니다. 
@@ -95,30 +142,15 @@ def analyze_stock_data(file_path):
            - 향후 시장 대응을 위한 구체적인 전략을 제안해 주세요.
         """
 
-        import time
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = client.models.generate_content(
-                    model=model_id,
-                    contents=prompt
-                )
-                return response.text
-            except Exception as e:
-                err_msg = str(e)
-                if ("429" in err_msg or "RESOURCE_EXHAUSTED" in err_msg) and attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 5
-                    print(f"AI 분석 제한 발생 (시도 {attempt+1}/{max_retries}). {wait_time}초 후 재시도합니다...")
-                    time.sleep(wait_time)
-                    continue
-                raise e
+        return generate_text(client, model_id, prompt, 'AI 분석', on_chunk)
 
     except Exception as e:
         return format_ai_error(e)
 
-def analyze_portfolio(portfolio_data):
+def analyze_portfolio(portfolio_data, on_chunk=None):
     """
     사용자의 포트폴리오 데이터를 분석하여 투자 의견을 생성합니다.
+    on_chunk: 스트리밍으로 받을 때 응답 조각마다 호출할 함수
     """
     if not GEMINI_API_KEY:
         raise AIAnalysisError("Gemini API 키가 설정되지 않았습니다.")
@@ -170,7 +202,12 @@ def analyze_portfolio(portfolio_data):
             price_pos = s.get('price_position_52w', s.get('rsi_pos', 0))
             ma5_diff = s.get('ma5_diff', 0)
             ma20_diff = s.get('ma20_diff', 0)
-            data_str += f"  기술적 지표: 52주 위치 {price_pos}%, MA5 이격도 {ma5_diff}%, MA20 이격도 {ma20_diff}%\n"
+            ma60_diff = s.get('ma60_diff', 0)
+            ma120_diff = s.get('ma120_diff', 0)
+            data_str += f"  기술적 지표: 52주 위치 {price_pos}%, RSI(14) {s.get('rsi', 0)}\n"
+            data_str += f"  이동평균 이격도: MA5 {ma5_diff}%, MA20 {ma20_diff}%, MA60 {ma60_diff}%, MA120 {ma120_diff}%\n"
+            if s.get('bb_upper'):
+                data_str += f"  볼린저밴드(20,2) %B {s.get('bb_pct_b', 0)}%, ATR(14) {s.get('atr_pct', 0)}%, 거래량(20일 평균 대비) {s.get('volume_ratio', 0)}배\n"
 
             # 시가총액
             market_cap_rank = s.get('market_cap_rank', '')
@@ -182,7 +219,9 @@ def analyze_portfolio(portfolio_data):
             i_5d = s.get('inst_5d_net', 0)
             f_20d = s.get('foreign_20d_net', 0)
             i_20d = s.get('inst_20d_net', 0)
-            data_str += f"  수급: 외인(5일) {f_5d:,}, 기관(5일) {i_5d:,} / 외인(20일) {f_20d:,}, 기관(20일) {i_20d:,}\n"
+            f_60d = s.get('foreign_60d_net', 0)
+            i_60d = s.get('inst_60d_net', 0)
+            data_str += f"  수급: 외인(5일) {f_5d:,}, 기관(5일) {i_5d:,} / 외인(20일) {f_20d:,}, 기관(20일) {i_20d:,} / 외인(60일) {f_60d:,}, 기관(60일) {i_60d:,}\n"
 
             # 최신 뉴스
             news_list = s.get('news', [])
@@ -221,23 +260,7 @@ def analyze_portfolio(portfolio_data):
         - **주의**: '몇 초 후에 실행하라'와 같은 비현실적인 시간 기반 조언은 배제하고, 가격대나 지표 기반의 전략을 제시해 주세요.
         """
 
-        import time
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = client.models.generate_content(
-                    model=model_id,
-                    contents=prompt
-                )
-                return response.text
-            except Exception as e:
-                err_msg = str(e)
-                if ("429" in err_msg or "RESOURCE_EXHAUSTED" in err_msg) and attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 5
-                    print(f"포트폴리오 AI 분석 제한 발생 (시도 {attempt+1}/{max_retries}). {wait_time}초 후 재시도합니다...")
-                    time.sleep(wait_time)
-                    continue
-                raise e
+        return generate_text(client, model_id, prompt, '포트폴리오 AI 분석', on_chunk)
 
     except Exception as e:
         raise AIAnalysisError(format_ai_error(e))
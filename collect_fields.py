@@ -0,0 +1,171 @@
+# 수집 필드 카탈로그
+# 필드 -> 데이터 소스 매핑. data_collect.process_stock은 선택된 필드로 어떤 소스를
+# 호출할지 계획하고, 웹 UI의 필드 선택 목록도 이 카탈로그로 그립니다.
+
+# 데이터 소스
+NAVER_MAIN = 'naver_main'          # 네이버 종목 메인 (시세/투자지표/컨센서스, 항상 수집)
+NAVER_INVESTOR = 'naver_investor'  # 네이버 외국인/기관 매매 동향
+DART_FINSTATE = 'dart_finstate'    # DART 재무제표
+DART_AUDIT = 'dart_audit'          # DART 감사보고서 (감사/내부통제 의견)
+
+ALL_SOURCES = {NAVER_MAIN, NAVER_INVESTOR, DART_FINSTATE, DART_AUDIT}
+
+SOURCE_LABELS = {
+    NAVER_MAIN: '네이버 금융',
+    NAVER_INVESTOR: '네이버 투자자별 매매',
+    DART_FINSTATE: 'DART 재무제표 (느림)',
+    DART_AUDIT: 'DART 감사보고서 (느림)',
+}
+
+# 화면 그룹별 필드: (필드명, 표시 이름, 필요한 소스)
+# 소스가 여러 개면 첫 소스가 기준: 필드를 고르면 첫 소스를 항상 수집하고, 그 소스에 값이 없는 종목만
+# 다음 소스로 계산 (예: ROE는 DART 영업이익/자본총계, DART 값이 없는 종목만 네이버 EPS/BPS)
+# 다른 필드 선택에 따라 같은 컬럼의 계산 기준이 바뀌지 않게 함 (지표 시계열/스크리닝에서 비교 가능)
+FIELD_GROUPS = [
+    {
+        'name': '필수 항목',
+        'hidden': True,
+        'fields': [
+            ('종목코드', '종목코드', ()),
+            ('종목명', '종목명', ()),
+            ('업종', '업종', (NAVER_MAIN,)),
+            ('데이터기준', '데이터기준', ()),
+        ],
+    },
+    {
+        'name': '투자 지표',
+        'fields': [
+            ('PBR', 'PBR', (NAVER_MAIN,)),
+            ('PER', 'PER', (NAVER_MAIN,)),
+            ('ROE', 'ROE', (DART_FINSTATE, NAVER_MAIN)),
+            ('EPS', 'EPS', (NAVER_MAIN,)),
+            ('BPS', 'BPS', (NAVER_MAIN,)),
+            ('배당수익률', '배당수익률', (NAVER_MAIN,)),
+            ('업종평균PBR', '업종평균 PBR', (NAVER_MAIN,)),
+            ('업종평균PER', '업종평균 PER', (NAVER_MAIN,)),
+            ('영업이익률', '영업이익률', (NAVER_MAIN,)),
+            ('순이익률', '순이익률', (NAVER_MAIN,)),
+            ('EV/EBITDA', 'EV/EBITDA', (DART_FINSTATE,)),
+            ('PEG', 'PEG', (DART_FINSTATE,)),
+            ('FCF수익률(%)', 'FCF 수익률(%)', (DART_FINSTATE,)),
+            ('순현금비율(%)', '순현금/시가총액(%)', (DART_FINSTATE,)),
+        ],
+    },
+    {
+        'name': '재무 정보',
+        'fields': [
+            ('매출액', '매출액', (DART_FINSTATE,)),
+            ('영업이익', '영업이익', (DART_FINSTATE,)),
+            ('당기순이익', '당기순이익', (DART_FINSTATE,)),
+            ('이익잉여금', '이익잉여금', (DART_FINSTATE,)),
+            ('현금및현금성자산', '현금및현금성자산', (DART_FINSTATE,)),
+            ('부채총계', '부채총계', (DART_FINSTATE,)),
+            ('시가총액', '시가총액(억)', (NAVER_MAIN,)),
+            ('52주최고가', '52주 최고가', (NAVER_MAIN,)),
+            ('52주최저가', '52주 최저가', (NAVER_MAIN,)),
+            ('EBITDA', 'EBITDA', (DART_FINSTATE,)),
+            ('FCF', 'FCF', (DART_FINSTATE,)),
+            ('부채비율', '부채비율', (NAVER_MAIN, DART_FINSTATE)),
+            ('유동비율', '유동비율', (DART_FINSTATE,)),
+        ],
+    },
+    {
+        'name': '성장성 지표 (YoY)',
+        'fields': [
+            ('매출액증가율(%)', '매출액 증가율(%)', (DART_FINSTATE,)),
+            ('영업이익증가율(%)', '영업이익 증가율(%)', (DART_FINSTATE,)),
+            ('순이익증가율(%)', '순이익 증가율(%)', (DART_FINSTATE,)),
+            ('전년동기매출액', '전년동기 매출액', (DART_FINSTATE,)),
+            ('전년동기영업이익', '전년동기 영업이익', (DART_FINSTATE,)),
+            ('전년동기순이익', '전년동기 순이익', (DART_FINSTATE,)),
+        ],
+    },
+    {
+        'name': '컨센서스 및 수급',
+        'fields': [
+            ('목표주가', '목표주가', (NAVER_MAIN,)),
+            ('내년예상영업이익', '내년 예상 영업이익', (NAVER_MAIN,)),
+            ('외국인순매수', '외국인 순매수 (20일)', (NAVER_INVESTOR,)),
+            ('기관순매수', '기관 순매수 (20일)', (NAVER_INVESTOR,)),
+            ('외국인보유율', '외국인 보유율', (NAVER_INVESTOR,)),
+        ],
+    },
+    {
+        'name': '감사 의견',
+        'fields': [
+            ('회계감사의견', '회계감사 의견', (DART_AUDIT,)),
+            ('내부통제의견', '내부통제 의견', (DART_AUDIT,)),
+        ],
+    },
+]
+
+# 화면에서 고르지 않지만 결과에 포함되는 보조 필드
+EXTRA_FIELDS = [
+    ('전전년동기매출액', (DART_FINSTATE,)),
+    ('작년매출액증가율(%)', (DART_FINSTATE,)),
+    ('전전년동기영업이익', (DART_FINSTATE,)),
+    ('작년영업이익증가율(%)', (DART_FINSTATE,)),
+    ('전전년동기순이익', (DART_FINSTATE,)),
+    ('작년순이익증가율(%)', (DART_FINSTATE,)),
+    ('현재가', (NAVER_MAIN,)),
+    ('매입단가', ()),
+    ('보유수량', ()),
+    ('평가손익', (NAVER_MAIN,)),
+    ('수익률(%)', (NAVER_MAIN,)),
+]
+
+# 다른 결과 컬럼으로 매번 다시 계산하는 파생 필드 -> 계산에 필요한 컬럼 (derived_metrics.valuation_metrics)
+# 선택하면 입력 컬럼도 결과에 포함되고, 증분 수집에서는 입력 컬럼을 재사용한 뒤 현재 시가총액으로 다시 계산
+DERIVED_INPUTS = {
+    'EV/EBITDA': ('시가총액', '부채총계', '현금및현금성자산', 'EBITDA'),
+    'PEG': ('PER', '순이익증가율(%)'),
+    'FCF수익률(%)': ('시가총액', 'FCF'),
+    '순현금비율(%)': ('시가총액', '현금및현금성자산', '부채총계'),
+}
+
+FIELD_SOURCES = {key: sources for group in FIELD_GROUPS for key, _, sources in group['fields']}
+FIELD_SOURCES.update(dict(EXTRA_FIELDS))
+
+# 고르면 DART를 호출하는 필드 (첫 소스가 DART, UI에서 느린 항목으로 표시)
+DART_ONLY_FIELDS = {key for key, sources in FIELD_SOURCES.items()
+                    if sources and sources[0] in (DART_FINSTATE, DART_AUDIT)}
+
+
+def plan_sources(selected_fields=None):
+    """
+    선택된 필드를 계산하는 데 필요한 데이터 소스 집합 (필드 미지정 시 전체)
+    필드마다 첫(기준) 소스는 항상 포함합니다. 네이버 메인은 시세/종목 정보 때문에 항상 수집
+    """
+    if not selected_fields:
+        return set(ALL_SOURCES)
+    plan = {NAVER_MAIN}
+    for field in selected_fields:
+        sources = FIELD_SOURCES.get(field)
+        if sources is None:
+            # 카탈로그에 없는 필드는 안전하게 전체 수집
+            return set(ALL_SOURCES)
+        if sources:
+            plan.add(sources[0])
+    return plan
+
+
+def is_field_available(field, plan):
+    """계획된 소스만으로 해당 필드 값을 만들 수 있는지 여부"""
+    sources = FIELD_SOURCES.get(field, ())
+    return not sources or any(s in plan for s in sources)
+
+
+def with_derived_inputs(fields):
+    """선택 필드에 파생 필드 계산에 필요한 입력 컬럼을 덧붙인 목록 (순서 유지)"""
+    fields = list(fields)
+    for field in list(fields):
+        fields += [f for f in DERIVED_INPUTS.get(field, ()) if f not in fields]
+    return fields
+
+
+def slow_fields(selected_fields=None):
+    """DART에서 가져오는 느린 필드 목록 (증분 수집 시 이전 결과에서 재사용, 파생 필드는 입력 컬럼으로 대신)"""
+    keys = with_derived_inputs(selected_fields or list(FIELD_SOURCES))
+    fields = [k for k in keys if k not in DERIVED_INPUTS
+              and FIELD_SOURCES.get(k) and FIELD_SOURCES[k][0] in (DART_FINSTATE, DART_AUDIT)]
+    return fields + ['데이터기준']
@@ -4,7 +4,6 @@ import os
 import time
 import requests
 import json
-import re
 import argparse
 import pandas as pd
 from datetime import datetime, timedelta
@@ -13,7 +12,13 @@ import OpenDartReader
 from openpyxl import load_workbook
 from openpyxl.utils import get_column_letter
 import warnings
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+from result_writer import ResultWriter, load_run_journal, append_run_journal, result_columns
+from naver_extract import NaverMainPage
+from history_store import get_investor_flows
+from collect_fields import plan_sources, is_field_available, slow_fields, FIELD_SOURCES, NAVER_INVESTOR, DART_FINSTATE, DART_AUDIT, SOURCE_LABELS
+import derived_metrics
 import threading
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -61,8 +66,35 @@ def save_cache_data(ticker, year, data):
             json.dump(data, f, ensure_ascii=False, indent=4)
     except: pass
 
+def parse_ticker_meta(ticker_info):
+    """'code:매입단가:수량' 형식의 종목 정보를 (종목코드, 매입단가, 보유수량)으로 분리합니다."""
+    ticker_meta = str(ticker_info[0]).split(':')
+    purchase_price = 0
+    quantity = 0
+    if len(ticker_meta) >= 2:
+        try: purchase_price = float(ticker_meta[1])
+        except: pass
+    if len(ticker_meta) >= 3:
+        try: quantity = int(ticker_meta[2])
+        except: pass
+    return ticker_meta[0], purchase_price, quantity
+
+def load_base_rows(base_path):
+    """증분 수집 기준이 되는 이전 결과 파일(parquet/xlsx/csv)을 읽어옵니다. (종목코드 -> 결과 dict)"""
+    try:
+        from result_store import read_frame
+        df = read_frame(base_path)
+    except Exception as e:
+        print(f"이전 결과 파일을 읽지 못해 전체 수집합니다: {e}")
+        return {}
+    if '종목코드' not in df.columns:
+        return {}
+    df['종목코드'] = df['종목코드'].str.zfill(6)
+    df = df.astype(object).where(df.notna(), None)
+    return {r['종목코드']: r for r in df.to_dict('records')}
+
 def get_top_tickers_from_naver(session, market='KOSPI', count=100):
-    """네이버 금융에서 시가총액 상위 종목 리스트를 가져옵니다."""
+    """네이버 금융에서 시가총액 상위 종목 리스트를 가져옵니다. (종목코드, 종목명, 시가총액(억)) 튜플 리스트"""
     markets_to_fetch = ['KOSPI', 'KOSDAQ'] if market.upper() == 'ALL' else [market.upper()]
     all_tickers = []
     
@@ -86,7 +118,14 @@ def get_top_tickers_from_naver(session, market='KOSPI', count=100):
             for a in table.find_all('a', {'class': 'tltle'}):
                 code = a.get('href').split('code=')[1]
                 name = a.text.strip()
-                market_tickers.append((code, name))
+                # 시가총액 컬럼 (우선순위 스케줄링용)
+                market_cap = 0
+                try:
+                    tds = a.find_parent('tr').find_all('td')
+                    if len(tds) > 6:
+                        market_cap = int(tds[6].text.strip().replace(',', ''))
+                except: pass
+                market_tickers.append((code, name, market_cap))
                 found = True
                 if len(market_tickers) >= target_count: break
             
@@ -97,216 +136,57 @@ def get_top_tickers_from_naver(session, market='KOSPI', count=100):
     
     return all_tickers[:count] if count > 0 else all_tickers
 
-def get_naver_financials(session, ticker):
-    """네이버 금융에서 상세 데이터를 크롤링합니다."""
-    try:
-        url = f"https://finance.naver.com/item/main.naver?code={ticker}"
-        res = session.get(url)
-        soup = BeautifulSoup(res.text, 'html.parser')
-        
-        market_cap = 0
-        price = 0
-        try:
-            market_cap_area = soup.select_one('#_market_sum')
-            if market_cap_area:
-                market_cap = int(market_cap_area.text.strip().replace(',', '').replace('조', '0000').replace('억', ''))
-            
-            price_area = soup.select_one('.no_today .no_up .blind, .no_today .no_down .blind, .no_today .no_steady .blind')
-            if price_area:
-                price = int(price_area.text.strip().replace(',', ''))
-        except: pass
-
-        sector = 'N/A'
-        try:
-            h4_sector = soup.select_one('.section.trade_compare h4 em a')
-            if h4_sector:
-                sector = h4_sector.text.strip()
-        except: pass
-
-        high_52w = 0
-        low_52w = 0
-        try:
-            tab_con1 = soup.select_one('#tab_con1')
-            if tab_con1:
-                for tr in tab_con1.select('tr'):
-                    if '52주최고' in tr.text:
-                        tds = tr.select('td')
-                        if len(tds) >= 1:
-                            parts = tds[0].text.split('l')
-                            if len(parts) == 2:
-                                high_52w = int(parts[0].strip().replace(',', ''))
-                                low_52w = int(parts[1].strip().replace(',', ''))
-        except: pass
+def _run_inline(func, *args):
+    """파싱 함수를 현재 스레드에서 바로 실행 (프로세스 풀 미사용 시 기본값)"""
+    return func(*args)
 
-        per = 0.0
-        pbr = 0.0
-        eps = 0
-        bps = 0
-        div_yield = 0.0
-        avg_per = 0.0
-        avg_pbr = 0.0
-        
-        aside = soup.find('div', {'class': 'aside_invest_info'})
-        if aside:
-            for th in aside.find_all('th'):
-                th_text = th.text.strip()
-                td = th.find_next('td')
-                if not td: continue
-                val_text = td.text.strip()
-                nums = re.findall(r'[-+]?\d*\.\d+|\d+', val_text.replace(',', ''))
-                
-                if 'PER' in th_text and '동일업종' not in th_text:
-                    if len(nums) >= 1: per = float(nums[0])
-                if 'EPS' in th_text:
-                    if len(nums) >= 2: eps = int(nums[1])
-                    elif len(nums) == 1 and 'PER' not in th_text: eps = int(nums[0])
-                if 'PBR' in th_text:
-                    if len(nums) >= 1: pbr = float(nums[0])
-                if 'BPS' in th_text:
-                    if len(nums) >= 2: bps = int(nums[1])
-                    elif len(nums) == 1 and 'PBR' not in th_text: bps = int(nums[0])
-                if '배당수익률' in th_text:
-                    if nums: div_yield = float(nums[0])
-                if '동일업종 PER' in th_text:
-                    if nums: avg_per = float(nums[0])
-                if '동일업종 PBR' in th_text:
-                    if nums: avg_pbr = float(nums[0])
-                elif '업종 PBR' in th_text:
-                    if nums: avg_pbr = float(nums[0])
-
-        target_price_val = 0
-        next_op = 0
-        debt_ratio = 0.0
-        op_margin = 0.0
-        net_margin = 0.0
-        
-        try:
-            for th in soup.find_all('th'):
-                if '목표주가' in th.text:
-                    td = th.find_next_sibling('td')
-                    if td:
-                        ems = td.find_all('em')
-                        for em in ems:
-                            val_str = em.text.replace(',', '').strip()
-                            if val_str.isdigit() and int(val_str) > 100:
-                                target_price_val = int(val_str)
-                                break
-                    if target_price_val > 0: break
-        except: pass
+def fetch_naver_page(session, url):
+    """네이버 페이지 원본 바이트와 인코딩을 가져옵니다. (I/O 단계)"""
+    res = session.get(url)
+    return res.content, res.encoding
 
-        table = soup.select_one('.cop_analysis')
-        if table:
-            years = [th.text.strip() for th in table.select('thead tr:nth-of-type(2) th')]
-            rows = table.select('tbody tr')
-            for row in rows:
-                th = row.select_one('th')
-                if not th: continue
-                th_text = th.text.strip()
-                if '영업이익' in th_text and '률' not in th_text:
-                    cols = row.select('td')
-                    for i, y in enumerate(years):
-                        if '(E)' in y or 'E' in y:
-                            val_str = cols[i].text.strip().replace(',', '')
-                            if val_str and val_str != '-':
-                                try:
-                                    next_op = int(val_str)
-                                    break
-                                except: pass
-                elif '부채비율' in th_text:
-                    cols = row.select('td')
-                    for i in range(len(cols)-1, -1, -1):
-                        val_str = cols[i].text.strip().replace(',', '')
-                        if val_str and val_str != '-' and val_str != '':
-                            try:
-                                debt_ratio = float(val_str)
-                                break
-                            except: pass
-                elif '영업이익률' in th_text:
-                    cols = row.select('td')
-                    # 최근 실적(마지막에서 두번째 또는 세번째) 가져오기
-                    for i in range(len(cols)-1, -1, -1):
-                        if '(E)' not in years[i]:
-                            val_str = cols[i].text.strip().replace(',', '')
-                            if val_str and val_str != '-':
-                                try:
-                                    op_margin = float(val_str)
-                                    break
-                                except: pass
-                elif '순이익률' in th_text:
-                    cols = row.select('td')
-                    for i in range(len(cols)-1, -1, -1):
-                        if '(E)' not in years[i]:
-                            val_str = cols[i].text.strip().replace(',', '')
-                            if val_str and val_str != '-':
-                                try:
-                                    net_margin = float(val_str)
-                                    break
-                                except: pass
+def get_naver_financials(session, ticker, run_parse=_run_inline):
+    """네이버 금융에서 상세 데이터를 크롤링합니다. run_parse로 파싱을 프로세스 풀에 넘길 수 있음"""
+    try:
+        content, encoding = fetch_naver_page(session, f"https://finance.naver.com/item/main.naver?code={ticker}")
+        return run_parse(parse_naver_financials, content, encoding, ticker)
+    except Exception as e:
+        print(f"[Naver] {ticker} 데이터 크롤링 실패: {e}")
+        return None
 
+def parse_naver_financials(content, encoding, ticker):
+    """네이버 종목 메인 페이지 HTML에서 투자 지표를 추출합니다. (CPU 단계, 프로세스 풀에서 실행 가능)"""
+    try:
+        page = NaverMainPage(content, encoding, ticker)
         return {
-            'price': price,
-            'market_cap': market_cap,
-            'sector': sector,
-            'high_52w': high_52w,
-            'low_52w': low_52w,
-            'per': per,
-            'pbr': pbr,
-            'eps': eps,
-            'bps': bps,
-            'div_yield': div_yield,
-            'avg_per': avg_per,
-            'avg_pbr': avg_pbr,
-            'target_price': target_price_val,
-            'next_op': next_op,
-            'debt_ratio': debt_ratio,
-            'op_margin': op_margin,
-            'net_margin': net_margin
+            'price': page.get('current_price', 0),
+            'market_cap': page.get('market_cap_eok', 0),
+            'sector': page.get('sector', 'N/A'),
+            'high_52w': page.get('high_52w', 0),
+            'low_52w': page.get('low_52w', 0),
+            'per': page.get('per', 0.0),
+            'pbr': page.get('pbr', 0.0),
+            'eps': page.get('eps', 0),
+            'bps': page.get('bps', 0),
+            'div_yield': page.get('dividend_yield', 0.0),
+            'avg_per': page.get('sector_per', 0.0),
+            'avg_pbr': page.get('sector_pbr', 0.0),
+            'target_price': page.get('target_price', 0),
+            'next_op': page.get('next_op', 0),
+            'debt_ratio': page.get('debt_ratio_last', 0.0),
+            'op_margin': page.get('op_margin', 0.0),
+            'net_margin': page.get('net_margin', 0.0)
         }
     except Exception as e:
         print(f"[Naver] {ticker} 데이터 크롤링 실패: {e}")
         return None
 
 def get_naver_investor_data(session, ticker):
-    """네이버 금융에서 외국인/기관 순매수 데이터를 크롤링합니다."""
+    """외국인/기관 20일 순매수와 외국인 보유율. 수급 이력 저장소(history_store)에서 새 거래일만 받아 합산합니다."""
     try:
-        url = f"https://finance.naver.com/item/frgn.naver?code={ticker}"
-        res = session.get(url)
-        soup = BeautifulSoup(res.content.decode('euc-kr', 'replace'), 'html.parser')
-        
-        tables = soup.find_all('table', {'class': 'type2'})
-        table = None
-        for t in tables:
-            if len(t.select('tr[onmouseover]')) > 10:
-                table = t
-                break
-        
-        if not table: return 0, 0, 0.0
-        
-        rows = table.select('tr[onmouseover]')[:20]
-        net_buy_foreign = 0
-        net_buy_inst = 0
-        foreign_ratio = 0.0
-        
-        # 첫 번째 행에서 외국인 보유비율 가져오기
-        try:
-            first_row_cols = rows[0].select('td')
-            if len(first_row_cols) >= 9:
-                fr_text = first_row_cols[8].text.strip().replace('%', '')
-                if fr_text: foreign_ratio = float(fr_text)
-        except: pass
-
-        for row in rows:
-            cols = row.select('td')
-            if len(cols) < 9: continue
-            try:
-                i_nums = re.findall(r'[-+]?\d+', cols[5].text.replace(',', ''))
-                f_nums = re.findall(r'[-+]?\d+', cols[6].text.replace(',', ''))
-                if i_nums: net_buy_inst += int(i_nums[0])
-                if f_nums: net_buy_foreign += int(f_nums[0])
-            except: pass
-            
-        return int(net_buy_foreign), int(net_buy_inst), foreign_ratio
-    except:
+        flow = get_investor_flows([ticker], session)[ticker]
+        return flow['foreign_20d_net'], flow['inst_20d_net'], flow['foreign_ratio']
+    except Exception:
         return 0, 0, 0.0
 
 def get_dart_financials(dart, ticker, year):
@@ -336,6 +216,21 @@ def get_dart_financials(dart, ticker, year):
     return 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, "N/A", 0, 0, 0, 0, 0, 0
 
 
+def get_changed_report_codes(dart, since):
+    """since 이후 정기보고서(사업/반기/분기)를 새로 공시한 종목코드 집합. 조회 실패 시 None"""
+    try:
+        # 회사 지정 없이 조회하면 DART는 최대 3개월 범위만 허용
+        if (datetime.now() - since).days > 90:
+            return None
+        df = dart.list(start=since.strftime('%Y-%m-%d'), end=datetime.now().strftime('%Y-%m-%d'), kind='A', final=False)
+        if df is None or df.empty:
+            return set()
+        return {str(c).zfill(6) for c in df['stock_code'].dropna() if str(c).strip()}
+    except Exception as e:
+        print(f"DART 공시 목록 조회 실패: {e}")
+        return None
+
+
 def parse_finstate_df(df, report_nm, ticker):
     """추출된 DataFrame에서 실시간 수치와 전년 동기 수치를 함께 파싱합니다."""
     try:
@@ -492,7 +387,20 @@ def get_audit_opinions(session, corp_code, year, api_key):
             
     return audit_opinion, internal_control, "N/A"
 
-def main(stock_count=100, selected_fields=None, market='KOSPI', output_path=None, tickers=None):
+def main(stock_count=100, selected_fields=None, market='KOSPI', output_path=None, tickers=None, journal_path=None, resume=False,
+         deadline=None, priority=None, formats=None, base_path=None, base_date=None, parse_workers=None):
+    """
+    종목 데이터 수집 메인 루프
+    - base_path: 증분 수집 기준인 이전 결과 파일. base_date 이후 정기보고서가 없는 종목은
+      시세/수급만 새로 받고 DART 필드는 이전 결과를 재사용 (새로 편입된 종목은 전체 수집)
+    - parse_workers: HTML 파싱 프로세스 수 (0이면 수집 스레드에서 직접 파싱, None이면 종목 수에 따라 자동)
+    - 완료된 종목은 원래 순서대로 결과 파일에 바로 기록 (formats: 추가 출력 형식 'csv', 'parquet')
+    - deadline: 수집 제한 시간(초). 지정 시 마감 전에 끝날 수 있는 종목만 새로 시작하고, 완료된 종목만 저장
+    - priority: 먼저 수집할 종목코드 목록 (보유 종목 등). 나머지는 시가총액 큰 순서로 수집
+    """
+    started_at = time.monotonic()
+    deadline_at = started_at + deadline if deadline else None
+    summary = None
     try:
         if tickers:
             print("=" * 80)
@@ -525,7 +433,10 @@ def main(stock_count=100, selected_fields=None, market='KOSPI', output_path=None
             return original_get(*args, **kwargs)
         session.get = timeout_get
 
-        dart = OpenDartReader(API_KEY)
+        # 선택된 필드로 호출할 데이터 소스 계획 (DART가 필요 없으면 초기화도 생략)
+        plan = plan_sources(selected_fields)
+        print(f"수집 소스: {', '.join(SOURCE_LABELS[s] for s in sorted(plan))}")
+        dart = OpenDartReader(API_KEY) if plan & {DART_FINSTATE, DART_AUDIT} else None
         
         if tickers:
             # 지정된 티커 리스트가 있는 경우 (종목명은 네이버에서 가져옴)
@@ -544,46 +455,111 @@ def main(stock_count=100, selected_fields=None, market='KOSPI', output_path=None
         
         now = datetime.now()
         # 단순히 2년을 빼는 게 아니라, 직전 연도를 기준으로 잡고 내부 로직에서 최신 보고서를 탐색하도록 변경
-        current_year = now.year - 1 
-            
-        results = []
+        current_year = now.year - 1
+
+        output_file = output_path if output_path else os.path.join(os.path.dirname(os.path.abspath(__file__)), "result.xlsx")
+        if not journal_path:
+            journal_path = os.path.splitext(output_file)[0] + '.journal.jsonl'
+
+        # 증분 수집: 이전 결과 이후 보고서가 바뀌지 않은 종목은 DART 조회 생략
+        base_rows = {}
+        changed_codes = set()
+        required_fields = slow_fields(selected_fields)
+        reuse_fields = slow_fields()
+        if base_path and plan & {DART_FINSTATE, DART_AUDIT}:
+            base_rows = load_base_rows(base_path)
+            if base_rows:
+                since = datetime.fromisoformat(base_date[:10]) if base_date else datetime.fromtimestamp(os.path.getmtime(base_path))
+                changed_codes = get_changed_report_codes(dart, since)
+                if changed_codes is None:
+                    print("보고서 변경 여부를 확인할 수 없어 전체 수집합니다.")
+                    base_rows = {}
+                else:
+                    reusable = sum(1 for t in tickers_with_names
+                                   if str(t[0]).split(':')[0] in base_rows and str(t[0]).split(':')[0] not in changed_codes)
+                    print(f"증분 수집: {reusable}개 종목은 이전 결과({since.strftime('%Y-%m-%d')})의 재무 데이터를 재사용합니다.")
+
+        # 이어서 수집하는 경우 저널에 기록된 종목은 건너뜀
+        journal_rows = load_run_journal(journal_path) if resume else {}
+        pending = [(i, t) for i, t in enumerate(tickers_with_names) if str(t[0]).split(':')[0] not in journal_rows]
+        if journal_rows:
+            print(f"이전 실행에서 완료된 {len(tickers_with_names) - len(pending)}개 종목은 건너뜁니다.")
+        journal_file = open(journal_path, 'a' if resume else 'w', encoding='utf-8')
+
+        # 수집 순서: 우선 종목(보유 종목) -> 시가총액 큰 순 (결과 파일은 원래 순서 유지)
+        priority_codes = {str(c).split(':')[0] for c in (priority or [])}
+        pending.sort(key=lambda p: (str(p[1][0]).split(':')[0] not in priority_codes, -(p[1][2] if len(p[1]) > 2 else 0)))
+
+        # 결과 파일 스트리밍 기록 (저널에서 복원한 종목은 먼저 등록)
+        has_my_fields = any(parse_ticker_meta(t)[1] > 0 for t in tickers_with_names)
+        writer = ResultWriter(output_file, formats, lambda row: result_columns(row, selected_fields, has_my_fields))
+        for i, t in enumerate(tickers_with_names):
+            code = str(t[0]).split(':')[0]
+            if code in journal_rows:
+                writer.add(i, journal_rows[code])
+
         total = len(tickers_with_names)
-        processed_count = 0
+        processed_count = total - len(pending)
         lock = threading.Lock()
-
-        def process_stock(ticker_info):
+        stop_event = threading.Event()
+        durations = []
+
+        # 수집 파이프라인: 스레드는 페이지를 받아오고(I/O), HTML 파싱은 프로세스 풀에서 실행(CPU)
+        # 종목 수가 적으면 프로세스 기동 비용이 더 크므로 스레드에서 직접 파싱
+        if parse_workers is None:
+            parse_workers = max(0, min(8, (os.cpu_count() or 1) - 1)) if len(pending) >= 100 else 0
+        parse_pool = None
+        run_parse = _run_inline
+        if parse_workers > 0:
+            # 스레드가 도는 프로세스에서 fork하지 않도록 spawn 방식 사용
+            parse_pool = ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context('spawn'))
+            run_parse = lambda func, *args: parse_pool.submit(func, *args).result()
+            print(f"HTML 파싱 프로세스 {parse_workers}개 사용")
+
+        def process_stock(ticker_info, index=None):
             nonlocal processed_count
             
             # ticker_info가 'code:price:qty' 형식인 경우 파싱
-            ticker_meta = str(ticker_info[0]).split(':')
-            ticker = ticker_meta[0]
+            ticker, purchase_price, quantity = parse_ticker_meta(ticker_info)
             name = ticker_info[1]
-            
-            purchase_price = 0
-            quantity = 0
-            if len(ticker_meta) >= 2:
-                try: purchase_price = float(ticker_meta[1])
-                except: pass
-            if len(ticker_meta) >= 3:
-                try: quantity = int(ticker_meta[2])
-                except: pass
-            
+
+            if stop_event.is_set():
+                return None
+            ticker_started = time.monotonic()
+
+            # 증분 수집 대상이면 이 종목은 DART 소스를 호출하지 않음
+            base_row = base_rows.get(ticker) if ticker not in changed_codes else None
+            if base_row is not None and any(k not in base_row for k in required_fields):
+                base_row = None
+            ticker_plan = plan - {DART_FINSTATE, DART_AUDIT} if base_row is not None else plan
             try:
-                naver_data = get_naver_financials(session, ticker)
+                naver_data = get_naver_financials(session, ticker, run_parse)
                 if not naver_data:
                     with lock:
                         processed_count += 1
                     return None
 
-                net_buy_foreign_vol, net_buy_inst_vol, foreign_ratio = get_naver_investor_data(session, ticker)
+                if NAVER_INVESTOR in ticker_plan:
+                    net_buy_foreign_vol, net_buy_inst_vol, foreign_ratio = get_naver_investor_data(session, ticker)
+                else:
+                    net_buy_foreign_vol, net_buy_inst_vol, foreign_ratio = 0, 0, 0.0
                 price = naver_data.get('price', 0)
                 net_buy_foreign = net_buy_foreign_vol * price
                 net_buy_inst = net_buy_inst_vol * price
 
+                # 마감 시간이 지났으면 느린 DART 조회는 시작하지 않음
+                if stop_event.is_set():
+                    return None
+
                 # DART 데이터 캐시 확인
-                cached = get_cached_data(ticker, current_year)
+                cached = get_cached_data(ticker, current_year) if DART_FINSTATE in ticker_plan else None
+                if DART_FINSTATE not in ticker_plan:
+                    # 재무제표 필드를 고르지 않은 경우 DART 호출 생략
+                    revenue = op = re_val = cash = liabilities = equity = ocf = capex = da = net_income = cur_assets = cur_liab = 0
+                    prev_rev = prev_op = prev_ni = prev2_rev = prev2_op = prev2_ni = 0
+                    report_nm = "N/A"
                 # 캐시가 있고, 리포트명이 정상이며, 전년 데이터가 포함되어 있는지 확인
-                if cached and cached.get('report_nm') != "N/A" and 'prev_rev' in cached:
+                elif cached and cached.get('report_nm') != "N/A" and 'prev_rev' in cached:
                     revenue, op, re_val, cash, liabilities, equity, ocf, capex, da, net_income, cur_assets, cur_liab, report_nm, prev_rev, prev_op, prev_ni, prev2_rev, prev2_op, prev2_ni = (
                         cached['revenue'], cached['op'], cached['re_val'], cached['cash'],
                         cached['liabilities'], cached['equity'], cached['ocf'], cached['capex'], cached['da'],
@@ -606,42 +582,26 @@ def main(stock_count=100, selected_fields=None, market='KOSPI', output_path=None
                     })
                 
                 # 감사 의견 가져오기 (고유번호 필요)
-                corp_code = dart.find_corp_code(ticker)
-                if not corp_code: corp_code = ticker
-                audit_op, internal_op, audit_report_nm = get_audit_opinions(session, corp_code, current_year, API_KEY)
+                audit_op, internal_op, audit_report_nm = None, None, "N/A"
+                if DART_AUDIT in ticker_plan:
+                    corp_code = dart.find_corp_code(ticker)
+                    if not corp_code: corp_code = ticker
+                    audit_op, internal_op, audit_report_nm = get_audit_opinions(session, corp_code, current_year, API_KEY)
 
-                # 데이터 기준 정보 (재무제표 보고서 우선, 없으면 감사의견 보고서)
+                # 데이터 기준 정보 (재무제표 보고서 우선, 없으면 감사의견 보고서, DART를 안 쓰면 네이버 수집일)
                 data_basis = report_nm if report_nm != "N/A" else audit_report_nm
-
-                fcf = ocf - capex
-                ebitda = op + da
-                current_ratio = round((cur_assets / cur_liab) * 100, 2) if cur_liab > 0 else 0.0
-                
-                # ROE 계산 개선: 자본총계(equity) 기준 우선, 없으면 네이버 데이터 활용
-                roe = 0.0
-                if equity > 0 and op > 0:
-                    # 단순 영업이익/자본총계 (DART 기준)
-                    roe = round((op / equity) * 100, 2)
-                elif naver_data.get('per', 0) > 0:
-                    # 네이버 ROE 활용 (eps/bps)
-                    if naver_data.get('bps', 0) > 0:
-                        roe = round((naver_data.get('eps', 0) / naver_data.get('bps', 0)) * 100, 2)
-
-                # 성장성 지표 계산
-                # 1. 당기 성장률 (YoY): (당기 - 전년) / 전년
-                rev_growth = round(((revenue - prev_rev) / abs(prev_rev) * 100), 2) if prev_rev != 0 else 0.0
-                op_growth = round(((op - prev_op) / abs(prev_op) * 100), 2) if prev_op != 0 else 0.0
-                ni_growth = round(((net_income - prev_ni) / abs(prev_ni) * 100), 2) if prev_ni != 0 else 0.0
-
-                # 2. 전년 성장률 (Prev YoY): (전년 - 전전년) / 전전년
-                # 성장 추세(가속/둔화)를 판단하기 위함
-                prev2_rev = cached.get('prev2_rev', 0) if cached else 0
-                prev2_op = cached.get('prev2_op', 0) if cached else 0
-                prev2_ni = cached.get('prev2_ni', 0) if cached else 0
-
-                prev_rev_growth = round(((prev_rev - prev2_rev) / abs(prev2_rev) * 100), 2) if prev2_rev != 0 else 0.0
-                prev_op_growth = round(((prev_op - prev2_op) / abs(prev2_op) * 100), 2) if prev2_op != 0 else 0.0
-                prev_ni_growth = round(((prev_ni - prev2_ni) / abs(prev2_ni) * 100), 2) if prev2_ni != 0 else 0.0
+                if not ticker_plan & {DART_FINSTATE, DART_AUDIT}:
+                    data_basis = f"네이버 금융 ({now.strftime('%Y-%m-%d')})"
+
+                # FCF, EBITDA, 유동비율, ROE, 부채비율, 성장률 (derived_metrics.financial_metrics)
+                derived = derived_metrics.one_row(derived_metrics.financial_metrics, {
+                    'revenue': revenue, 'op': op, 'net_income': net_income,
+                    'prev_rev': prev_rev, 'prev_op': prev_op, 'prev_ni': prev_ni,
+                    'prev2_rev': prev2_rev, 'prev2_op': prev2_op, 'prev2_ni': prev2_ni,
+                    'ocf': ocf, 'capex': capex, 'da': da, 'cur_assets': cur_assets, 'cur_liab': cur_liab,
+                    'equity': equity, 'liabilities': liabilities, 'per': naver_data.get('per'),
+                    'eps': naver_data.get('eps'), 'bps': naver_data.get('bps'), 'debt_ratio': naver_data.get('debt_ratio'),
+                })
 
                 res_dict = {
                     '종목코드': ticker,
@@ -654,7 +614,7 @@ def main(stock_count=100, selected_fields=None, market='KOSPI', output_path=None
                     '업종평균PBR': naver_data.get('avg_pbr'),
                     'PER': naver_data.get('per'),
                     '업종평균PER': naver_data.get('avg_per'),
-                    'ROE': roe,
+                    'ROE': derived['ROE'],
                     'EPS': naver_data.get('eps'),
                     'BPS': naver_data.get('bps'),
                     '배당수익률': naver_data.get('div_yield'),
@@ -663,22 +623,22 @@ def main(stock_count=100, selected_fields=None, market='KOSPI', output_path=None
                     '매출액': revenue,
                     '전년동기매출액': prev_rev,
                     '전전년동기매출액': prev2_rev,
-                    '매출액증가율(%)': rev_growth,
-                    '작년매출액증가율(%)': prev_rev_growth, # 추세 확인용
+                    '매출액증가율(%)': derived['매출액증가율(%)'],
+                    '작년매출액증가율(%)': derived['작년매출액증가율(%)'], # 추세 확인용
                     
                     # 영업이익 관련
                     '영업이익': op,
                     '전년동기영업이익': prev_op,
                     '전전년동기영업이익': prev2_op,
-                    '영업이익증가율(%)': op_growth,
-                    '작년영업이익증가율(%)': prev_op_growth, # 추세 확인용
+                    '영업이익증가율(%)': derived['영업이익증가율(%)'],
+                    '작년영업이익증가율(%)': derived['작년영업이익증가율(%)'], # 추세 확인용
  
                     # 순이익 관련
                     '당기순이익': net_income,
                     '전년동기순이익': prev_ni,
                     '전전년동기순이익': prev2_ni,
-                    '순이익증가율(%)': ni_growth,
-                    '작년순이익증가율(%)': prev_ni_growth, # 추세 확인용
+                    '순이익증가율(%)': derived['순이익증가율(%)'],
+                    '작년순이익증가율(%)': derived['작년순이익증가율(%)'], # 추세 확인용
  
                     '영업이익률': naver_data.get('op_margin'),
                     '순이익률': naver_data.get('net_margin'),
@@ -686,10 +646,12 @@ def main(stock_count=100, selected_fields=None, market='KOSPI', output_path=None
                     '현금및현금성자산': cash,
                     '52주최고가': naver_data.get('high_52w'),
                     '52주최저가': naver_data.get('low_52w'),
-                    '부채비율': naver_data.get('debt_ratio') if naver_data.get('debt_ratio') > 0 else (round(liabilities/equity*100, 2) if equity > 0 else 0),
-                    '유동비율': current_ratio,
-                    'FCF': fcf,
-                    'EBITDA': ebitda,
+                    '시가총액': naver_data.get('market_cap'),
+                    '부채총계': derived['부채총계'],
+                    '부채비율': derived['부채비율'],
+                    '유동비율': derived['유동비율'],
+                    'FCF': derived['FCF'],
+                    'EBITDA': derived['EBITDA'],
                     '외국인보유율': foreign_ratio,
                     '외국인순매수': net_buy_foreign,
                     '기관순매수': net_buy_inst,
@@ -697,6 +659,24 @@ def main(stock_count=100, selected_fields=None, market='KOSPI', output_path=None
                     '목표주가': naver_data.get('target_price')
                 }
 
+                # 계획에서 빠진 소스의 필드는 결과에서 제외
+                res_dict = {k: v for k, v in res_dict.items() if is_field_available(k, plan)}
+
+                if base_row is not None:
+                    # 재무/감사 필드는 이전 결과 값 사용
+                    for k in reuse_fields:
+                        if k in res_dict and k in base_row:
+                            res_dict[k] = base_row.get(k)
+                    # 네이버 값이 비어 DART로 보완하던 필드(부채비율 등)도 이전 값 사용
+                    for k, sources in FIELD_SOURCES.items():
+                        if len(sources) > 1 and k in res_dict and not res_dict[k]:
+                            res_dict[k] = base_row.get(k, res_dict[k])
+
+                # 가치평가 지표는 현재 시가총액으로 (재사용한 재무 값 기준으로도) 다시 계산
+                valuation = derived_metrics.one_row(derived_metrics.valuation_metrics,
+                                                    {k: res_dict.get(k) for k in derived_metrics.VALUATION_INPUTS})
+                res_dict.update({k: v for k, v in valuation.items() if is_field_available(k, plan)})
+
                 # 내 종목 분석인 경우 수익률 계산 추가
                 if purchase_price > 0:
                     res_dict['현재가'] = price
@@ -706,9 +686,15 @@ def main(stock_count=100, selected_fields=None, market='KOSPI', output_path=None
                     res_dict['수익률(%)'] = round(((price - purchase_price) / purchase_price) * 100, 2)
                 
                 with lock:
+                    durations.append(time.monotonic() - ticker_started)
+                    # 마감 이후 끝난 종목은 결과에 포함되지 않으므로 기록하지 않음
+                    if stop_event.is_set():
+                        return None
                     processed_count += 1
+                    # 완료 즉시 저널에 기록 (중단/오류 시에도 작업 보존)
+                    append_run_journal(journal_file, ticker, res_dict, index)
                     print(f"진행률: [{processed_count}/{total}] {processed_count*100//total}% 완료 ({name})", flush=True)
-                
+
                 return res_dict
             except Exception as e:
                 print(f"\n[{name}] 처리 중 오류: {e}")
@@ -717,37 +703,72 @@ def main(stock_count=100, selected_fields=None, market='KOSPI', output_path=None
                 return None
 
         # ThreadPoolExecutor를 사용하여 병렬 처리 (최대 8개 스레드)
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            thread_results = list(executor.map(process_stock, tickers_with_names))
-
-        # None 결과 제외
-        results = [r for r in thread_results if r is not None]
-
-        df = pd.DataFrame(results)
-        if selected_fields:
-            # 내 종목 분석인 경우 필수 필드 추가
-            if any('현재가' in r for r in results):
-                my_fields = ['현재가', '매입단가', '보유수량', '평가손익', '수익률(%)']
-                for f in my_fields:
-                    if f not in selected_fields:
-                        selected_fields.insert(2, f) # 종목명 뒤에 삽입
-
-            # 전년 동기 데이터가 컬럼에 있다면 자동으로 선택 필드에 추가
-            yoy_fields = ['전년동기매출액', '매출액증가율(%)', '전년동기영업이익', '영업이익증가율(%)', '전년동기순이익', '순이익증가율(%)']
-            for f in yoy_fields:
-                if f in df.columns and f not in selected_fields:
-                    selected_fields.append(f)
-            
-            df = df[[f for f in selected_fields if f in df.columns]]
+        # 마감 시간이 있으면 평균 처리 시간으로 마감 전에 끝날 수 있는 종목만 새로 시작
+        max_workers = 8
+        deadline_hit = False
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            queue = list(pending)
+            in_flight = {}
+            while queue or in_flight:
+                while queue and len(in_flight) < max_workers:
+                    if deadline_at:
+                        with lock:
+                            avg = sum(durations) / len(durations) if durations else 0
+                        if time.monotonic() + avg > deadline_at:
+                            print(f"\n마감 시간이 다가와 남은 {len(queue)}개 종목은 수집하지 않습니다.", flush=True)
+                            queue = []
+                            deadline_hit = True
+                            break
+                    index, ticker_info = queue.pop(0)
+                    in_flight[executor.submit(process_stock, ticker_info, index)] = index
+                if not in_flight:
+                    break
+
+                timeout = max(0, deadline_at - time.monotonic()) if deadline_at else None
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for f in done:
+                    writer.add(in_flight.pop(f), f.result())
+                if not done:
+                    # 마감 시간 도달: 진행 중인 종목은 버리고 완료된 결과만 저장
+                    with lock:
+                        stop_event.set()
+                    deadline_hit = True
+                    print(f"\n마감 시간 도달: 진행 중인 {len(in_flight)}개 종목은 결과에서 제외합니다.", flush=True)
+                    break
+        finally:
+            executor.shutdown(wait=not stop_event.is_set(), cancel_futures=True)
+            if parse_pool:
+                parse_pool.shutdown(wait=not stop_event.is_set(), cancel_futures=True)
+            with lock:
+                journal_file.close()
+
+        saved_count = writer.close()
+
+        # 수집 완전성 정보 (마감 시간으로 일부만 수집된 경우 complete=False)
+        complete = not deadline_hit
+        summary = {
+            'complete': complete,
+            'collected': saved_count,
+            'total': total,
+            'deadline': deadline,
+            'elapsed': round(time.monotonic() - started_at, 1),
+        }
+        with open(os.path.splitext(output_file)[0] + '.meta.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False)
+
+        # 정상 완료 시 저널은 더 이상 필요 없음 (부분 수집이면 이어하기를 위해 보존)
+        if complete and os.path.exists(journal_path):
+            os.remove(journal_path)
 
-        output_file = output_path if output_path else os.path.join(os.path.dirname(os.path.abspath(__file__)), "result.xlsx")
-        df.to_excel(output_file, index=False)
-        
         print(f"\n\nData saved: {output_file}")
-        print(f"Total stocks: {len(df)}")
+        print(f"Total stocks: {saved_count}")
+        if not complete:
+            print(f"부분 수집: {saved_count}/{total}개 종목 ({summary['elapsed']}초)")
 
     except Exception as e:
         print(f"\n메인 루프 오류 발생: {e}")
+    return summary
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -756,8 +777,24 @@ if __name__ == "__main__":
     parser.add_argument('--fields', type=str, default='')
     parser.add_argument('--output', type=str, default='')
     parser.add_argument('--tickers', type=str, default='')
+    parser.add_argument('--journal', type=str, default='')
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--deadline', type=int, default=0)
+    parser.add_argument('--priority', type=str, default='')
+    parser.add_argument('--formats', type=str, default='')
+    parser.add_argument('--base', type=str, default='')
+    parser.add_argument('--base-date', type=str, default='')
+    parser.add_argument('--parse-workers', type=int, default=-1)
     args = parser.parse_args()
-    
+
     fields = args.fields.split(',') if args.fields else None
     tickers = args.tickers.split(',') if args.tickers else None
-    main(args.count, fields, args.market, args.output, tickers)
+    priority = args.priority.split(',') if args.priority else None
+    formats = args.formats.split(',') if args.formats else None
+    summary = main(args.count, fields, args.market, args.output, tickers, args.journal, args.resume,
+                   args.deadline or None, priority, formats, args.base or None, args.base_date or None,
+                   args.parse_workers if args.parse_workers >= 0 else None)
+    if summary and not summary['complete']:
+        # 마감으로 버려진 스레드가 네트워크 재시도를 마칠 때까지 기다리지 않고 종료
+        sys.stdout.flush()
+        os._exit(0)
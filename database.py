@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+trade.db 연결 관리
+
+- WAL 모드: 백그라운드 쓰기(마스터 갱신, 이력 저장) 중에도 화면 조회가 막히지 않음
+- 스레드별 연결 재사용: 같은 스레드에서는 하나의 연결을 계속 사용 (닫지 않음)
+  연결 풀이 아니므로 스레드가 끝나면 연결도 정리됩니다. werkzeug 개발 서버(threaded)는 요청마다 새 스레드를
+  만들기 때문에 요청 간에는 재사용되지 않고, 한 요청이나 백그라운드 작업 스레드 안에서만 재사용됩니다.
+- 잠금 대기: 다른 쓰기가 끝날 때까지 BUSY_TIMEOUT초 기다린 뒤 실패
+"""
+import os
+import sqlite3
+import threading
+
+DB_FILE = os.path.join(os.path.dirname(__file__), 'trade.db')
+
+# 잠긴 DB를 기다리는 최대 시간 (초)
+BUSY_TIMEOUT = 30
+
+# WAL에서는 synchronous=NORMAL로도 커밋된 데이터가 손상되지 않음
+PRAGMAS = (
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),        # 약 16MB
+    ('mmap_size', 256 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+
+_local = threading.local()
+_wal_files = set()
+_wal_lock = threading.Lock()
+
+
+def _enable_wal(conn, db_file):
+    """journal_mode는 파일에 저장되므로 프로세스당 파일마다 한 번만 설정"""
+    if db_file in _wal_files:
+        return
+    with _wal_lock:
+        if db_file in _wal_files:
+            return
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError as e:
+            # 다른 프로세스가 쓰는 중이면 다음 연결에서 다시 시도
+            print(f"WAL 모드 설정 실패: {e}")
+            return
+        _wal_files.add(db_file)
+
+
+def connect(db_file=DB_FILE):
+    """튜닝된 새 연결 (행은 sqlite3.Row). 직접 닫아야 합니다."""
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT)
+    _enable_wal(conn, db_file)
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def get_connection(db_file=DB_FILE):
+    """
+    현재 스레드가 재사용하는 연결. 호출한 쪽에서 닫지 않습니다.
+    같은 스레드의 다른 코드와 연결(과 진행 중인 트랜잭션)을 공유하므로 쓰기는 각자 커밋하고,
+    남은 트랜잭션 정리는 요청/작업이 끝날 때 release()에서만 합니다.
+    """
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_file)
+    if conn is not None:
+        try:
+            conn.total_changes
+            return conn
+        except sqlite3.ProgrammingError:
+            # 실수로 닫힌 연결이면 새로 연결
+            pass
+    conn = conns[db_file] = connect(db_file)
+    return conn
+
+
+def release(conn):
+    """요청/작업이 끝났을 때 호출. 남은 트랜잭션만 정리하고 연결은 유지"""
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
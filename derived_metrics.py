@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+수집 결과 파생 지표 계산 (배열 단위)
+
+종목별로 모은 원본 값(재무제표 항목, 네이버 지표)에서 파생 지표를 {이름: 배열} 입력에 대해 numpy 식으로 계산합니다.
+수집 중에는 종목이 끝날 때마다 결과를 바로 기록하므로 한 종목의 값을 길이 1 배열로 바꿔 호출합니다. (one_row)
+- financial_metrics: 원본 값 -> FCF, EBITDA, 유동비율, ROE, 부채비율, 성장률
+- valuation_metrics: 결과 컬럼 -> EV/EBITDA, PEG, FCF수익률, 순현금비율
+  (시가총액이 바뀌므로 증분 수집에서 이전 결과의 재무 값을 재사용한 뒤에도 다시 계산)
+분모가 0이거나 값이 없어 계산할 수 없으면 0으로 둡니다. 비율은 소수 둘째 자리까지 반올림합니다.
+지표를 추가하려면 컬럼 식 하나와 collect_fields 카탈로그 항목을 추가합니다.
+"""
+import numpy as np
+
+# 시가총액(억원) -> 원 (재무제표 금액 단위)
+EOK = 100_000_000
+
+# valuation_metrics가 읽는 결과 컬럼
+VALUATION_INPUTS = ('시가총액', '현금및현금성자산', '부채총계', 'EBITDA', 'FCF', 'PER', '순이익증가율(%)')
+
+# 결과에 정수로 기록할 금액 컬럼
+INTEGER_COLUMNS = {'FCF', 'EBITDA', '부채총계'}
+
+# 성장률 컬럼: (결과 컬럼, 당기, 비교 기간)
+GROWTH_COLUMNS = (
+    ('매출액증가율(%)', 'revenue', 'prev_rev'),
+    ('영업이익증가율(%)', 'op', 'prev_op'),
+    ('순이익증가율(%)', 'net_income', 'prev_ni'),
+    ('작년매출액증가율(%)', 'prev_rev', 'prev2_rev'),
+    ('작년영업이익증가율(%)', 'prev_op', 'prev2_op'),
+    ('작년순이익증가율(%)', 'prev_ni', 'prev2_ni'),
+)
+
+
+def _values(frame, key):
+    return np.asarray(frame[key], dtype=float)
+
+
+def _ratio(numerator, denominator, valid, scale=100.0):
+    """valid인 행만 numerator / denominator * scale, 나머지와 계산 불가(NaN)는 0"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(valid, numerator / np.where(valid, denominator, 1.0) * scale, 0.0)
+    return np.round(np.where(np.isfinite(result), result, 0.0), 2)
+
+
+def financial_metrics(raw):
+    """
+    원본 값 -> 재무 파생 컬럼
+    raw 키: revenue, op, net_income, prev_rev, prev_op, prev_ni, prev2_rev, prev2_op, prev2_ni,
+            ocf, capex, da, cur_assets, cur_liab, equity, liabilities, per, eps, bps, debt_ratio(네이버)
+    """
+    op = _values(raw, 'op')
+    equity = _values(raw, 'equity')
+    liabilities = _values(raw, 'liabilities')
+    eps, bps, per = _values(raw, 'eps'), _values(raw, 'bps'), _values(raw, 'per')
+    naver_debt_ratio = np.nan_to_num(_values(raw, 'debt_ratio'))
+
+    out = {
+        'FCF': _values(raw, 'ocf') - _values(raw, 'capex'),
+        'EBITDA': op + _values(raw, 'da'),
+        '부채총계': liabilities,
+    }
+    cur_liab = _values(raw, 'cur_liab')
+    out['유동비율'] = _ratio(_values(raw, 'cur_assets'), cur_liab, cur_liab > 0)
+
+    # ROE: 영업이익/자본총계 (DART) 우선, 없으면 네이버 EPS/BPS
+    dart_roe = (equity > 0) & (op > 0)
+    out['ROE'] = np.where(dart_roe, _ratio(op, equity, dart_roe),
+                          _ratio(eps, bps, (per > 0) & (bps > 0)))
+
+    # 부채비율: 네이버 값 우선, 없으면 부채총계/자본총계
+    out['부채비율'] = np.where(naver_debt_ratio > 0, naver_debt_ratio, _ratio(liabilities, equity, equity > 0))
+
+    # 성장률 (YoY): (당기 - 비교) / |비교|, 작년 성장률은 가속/둔화 판단용
+    for column, current, previous in GROWTH_COLUMNS:
+        base = _values(raw, previous)
+        out[column] = _ratio(_values(raw, current) - base, np.abs(base), base != 0)
+    return out
+
+
+def valuation_metrics(columns):
+    """
+    결과 컬럼 -> 가치평가 파생 컬럼 (추가 수집 없음)
+    - EV/EBITDA: (시가총액 + 부채총계 - 현금) / EBITDA, 부채는 재무제표 부채총계로 대신함
+    - PEG: PER / 순이익증가율(%), 둘 다 양수일 때만
+    - FCF수익률(%): FCF / 시가총액
+    - 순현금비율(%): (현금 - 부채총계) / 시가총액
+    """
+    market_cap = np.nan_to_num(_values(columns, '시가총액')) * EOK
+    cash = _values(columns, '현금및현금성자산')
+    liabilities = _values(columns, '부채총계')
+    ebitda = _values(columns, 'EBITDA')
+    per = _values(columns, 'PER')
+    growth = _values(columns, '순이익증가율(%)')
+    listed = market_cap > 0
+    return {
+        'EV/EBITDA': _ratio(market_cap + liabilities - cash, ebitda, listed & (ebitda > 0), scale=1.0),
+        'PEG': _ratio(per, growth, (per > 0) & (growth > 0), scale=1.0),
+        'FCF수익률(%)': _ratio(_values(columns, 'FCF'), market_cap, listed),
+        '순현금비율(%)': _ratio(cash - liabilities, market_cap, listed),
+    }
+
+
+def one_row(func, values):
+    """한 종목의 값 dict로 func를 계산해 {컬럼: 파이썬 숫자}로 반환 (빈 값은 NaN으로 계산)"""
+    arrays = {k: np.array([np.nan if v is None else v], dtype=float) for k, v in values.items()}
+    result = {}
+    for column, array in func(arrays).items():
+        value = float(np.asarray(array)[0])
+        if column in INTEGER_COLUMNS:
+            value = int(value) if np.isfinite(value) else 0
+        result[column] = value
+    return result
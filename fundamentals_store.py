@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+수집 결과 지표 시계열 저장소 (trade.db)
+- fundamental_history: (종목코드, 기준일, 지표) -> 값
+- fundamental_sources: 이미 반영한 결과 파일
+
+수집이 끝날 때마다 결과의 종목별 지표를 기준일(수집일)로 쌓아 둡니다.
+결과 엑셀이 드라이브로 옮겨진 뒤에도 한 종목의 지표 추이나 특정일의 전 종목 단면을
+다시 수집하거나 예전 시트를 내려받지 않고 조회할 수 있습니다.
+같은 날 여러 번 수집하면 마지막에 반영한 값이 남습니다.
+취소되거나 마감 시간으로 일부만 수집된 결과(is_complete=0)는 종목 구성이 달라 반영하지 않고,
+일부 필드만 수집한 결과는 반영한 지표 목록(fundamental_sources.metrics)을 함께 기록합니다.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+import database
+import migrations
+import result_store
+
+DB_FILE = database.DB_FILE
+
+CODE_COLUMN = '종목코드'
+
+# 보유 종목 분석에서만 붙는 개인 정보는 쌓지 않음
+EXCLUDED_COLUMNS = {CODE_COLUMN, '매입단가', '보유수량', '평가손익', '수익률(%)'}
+
+# 최신 단면에 붙이는 종목별 기준일 컬럼 (그 종목의 가장 최근 기준일)
+AS_OF_COLUMN = '기준일'
+
+# 스크리닝 결과에서 지표별 기준일 컬럼 이름 접미사 (예: 'PER 기준일')
+METRIC_AS_OF_SUFFIX = ' 기준일'
+
+# (반영 상태, 최신 단면 DataFrame, 지표별 기준일 DataFrame)
+_snapshot = (None, None, None)
+_snapshot_lock = threading.Lock()
+
+
+def get_connection():
+    """현재 스레드의 재사용 연결 (database.get_connection). 닫지 않습니다."""
+    conn = database.get_connection(DB_FILE)
+    migrations.migrate(conn, DB_FILE)
+    return conn
+
+
+def as_of_date(created_at=None):
+    """결과 생성 시각(ISO 문자열)을 기준일(YYYY-MM-DD)로"""
+    return (created_at or datetime.now().isoformat())[:10]
+
+
+def _db_value(value):
+    if hasattr(value, 'item'):
+        value = value.item()
+    return value
+
+
+def _metrics(df):
+    return [str(c) for c in df.columns if c not in EXCLUDED_COLUMNS]
+
+
+def _records(df, as_of):
+    """결과 DataFrame -> (code, as_of, metric, value) 목록. 빈 값은 제외"""
+    if CODE_COLUMN not in df.columns:
+        return []
+    metrics = _metrics(df)
+    df = df.assign(**{CODE_COLUMN: df[CODE_COLUMN].astype(str).str.zfill(6)})
+    long = df.melt(id_vars=[CODE_COLUMN], value_vars=metrics, var_name='metric', value_name='value')
+    long = long[long['value'].notna()].drop_duplicates([CODE_COLUMN, 'metric'], keep='last')
+    return [(code, as_of, metric, _db_value(value)) for code, metric, value in long.itertuples(index=False)]
+
+
+def ingest_frame(df, as_of, filename=None):
+    """결과 DataFrame의 종목별 지표를 기준일 as_of로 저장하고 저장한 값 개수를 반환합니다."""
+    rows = _records(df, as_of)
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO fundamental_history (code, as_of, metric, value) VALUES (?, ?, ?, ?)", rows
+        )
+        if filename:
+            conn.execute(
+                "INSERT OR REPLACE INTO fundamental_sources (filename, as_of, row_count, imported_at, metrics) VALUES (?, ?, ?, ?, ?)",
+                (filename, as_of, len(df), datetime.now().isoformat(), json.dumps(_metrics(df), ensure_ascii=False))
+            )
+    return len(rows)
+
+
+def ingest_result(path, created_at=None, filename=None):
+    """결과 파일(열 형식 사본 또는 엑셀)을 읽어 시계열에 반영"""
+    df = result_store.read_frame(path)
+    return ingest_frame(df, as_of_date(created_at), filename or os.path.basename(path))
+
+
+def backfill(results_dir):
+    """
+    등록된 완전한 결과 중 아직 반영하지 않은 것을 로컬 열 형식 사본에서 반영합니다. (오래된 결과부터)
+    사본이 없는 결과는 건너뜁니다. 반영한 결과 수를 반환
+    """
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT filename, created_at FROM analysis_results "
+        "WHERE is_complete = 1 AND filename NOT IN (SELECT filename FROM fundamental_sources) ORDER BY created_at"
+    ).fetchall()
+    count = 0
+    for filename, created_at in rows:
+        path = result_store.sidecar_path(os.path.join(results_dir, filename))
+        if not os.path.exists(path):
+            continue
+        try:
+            ingest_result(path, created_at, filename)
+            count += 1
+        except Exception as e:
+            print(f"지표 시계열 반영 실패 ({filename}): {e}")
+    if count:
+        print(f"지표 시계열 반영: 결과 {count}개")
+    return count
+
+
+def _metric_filter(metrics, params):
+    if not metrics:
+        return ""
+    params.extend(metrics)
+    return f" AND metric IN ({','.join('?' * len(metrics))})"
+
+
+def _ordered(wide, metrics):
+    if metrics:
+        wide = wide.reindex(columns=[m for m in metrics if m in wide.columns])
+    wide.columns.name = None
+    return wide
+
+
+def metric_history(code, metrics=None, start=None, end=None):
+    """한 종목의 지표 추이. index=기준일, 컬럼=지표인 DataFrame (기준일 오름차순)"""
+    params = [code]
+    query = "SELECT as_of, metric, value FROM fundamental_history WHERE code = ?"
+    if start:
+        query += " AND as_of >= ?"
+        params.append(start)
+    if end:
+        query += " AND as_of <= ?"
+        params.append(end)
+    query += _metric_filter(metrics, params)
+    df = pd.read_sql_query(query + " ORDER BY as_of", get_connection(), params=params)
+    if df.empty:
+        return pd.DataFrame()
+    return _ordered(df.pivot(index='as_of', columns='metric', values='value'), metrics)
+
+
+def resolve_date(as_of=None):
+    """as_of 이전(포함) 가장 최근 기준일. 저장된 값이 없으면 None"""
+    conn = get_connection()
+    if as_of:
+        row = conn.execute("SELECT MAX(as_of) FROM fundamental_history WHERE as_of <= ?", (as_of,)).fetchone()
+    else:
+        row = conn.execute("SELECT MAX(as_of) FROM fundamental_history").fetchone()
+    return row[0] if row else None
+
+
+def cross_section(as_of=None, metrics=None):
+    """
+    한 기준일의 전 종목 지표 단면. as_of가 없거나 수집이 없던 날이면 그 이전 가장 최근 기준일
+    반환: (기준일, index=종목코드인 DataFrame)
+    """
+    date = resolve_date(as_of)
+    if not date:
+        return None, pd.DataFrame()
+    params = [date]
+    query = "SELECT code, metric, value FROM fundamental_history WHERE as_of = ?" + _metric_filter(metrics, params)
+    df = pd.read_sql_query(query, get_connection(), params=params)
+    if df.empty:
+        return date, pd.DataFrame()
+    return date, _ordered(df.pivot(index='code', columns='metric', values='value'), metrics)
+
+
+def _typed(wide):
+    """값이 모두 숫자인 지표는 float 컬럼으로 (문자열 지표는 그대로)"""
+    for column in wide.columns:
+        numeric = pd.to_numeric(wide[column], errors='coerce')
+        if numeric.notna().sum() == wide[column].notna().sum():
+            wide[column] = numeric.astype(float)
+    return wide
+
+
+def _sources_state(conn):
+    return tuple(conn.execute("SELECT COUNT(*), MAX(imported_at) FROM fundamental_sources").fetchone())
+
+
+def latest_snapshot(with_dates=False):
+    """
+    종목·지표마다 가장 최근에 수집된 값을 모은 전 종목 단면 (index=종목코드, 기준일 컬럼 포함)
+    일부 필드만 수집한 결과가 나중에 들어와도 다른 지표는 이전 결과의 값이 남습니다.
+    with_dates=True면 (단면, 같은 모양의 지표별 기준일 DataFrame)을 반환해 오래된 값을 구분할 수 있습니다.
+    새 결과가 반영되기 전까지는 메모리에 만들어 둔 것을 그대로 돌려줍니다. (읽기 전용으로 사용)
+    """
+    global _snapshot
+    conn = get_connection()
+    state = _sources_state(conn)
+    if _snapshot[0] != state:
+        with _snapshot_lock:
+            if _snapshot[0] != state:
+                _snapshot = (state,) + _build_snapshot(conn)
+    return _snapshot[1:] if with_dates else _snapshot[1]
+
+
+def _build_snapshot(conn):
+    df = pd.read_sql_query('''
+        SELECT h.code, h.as_of, h.metric, h.value
+        FROM fundamental_history h
+        JOIN (SELECT code, metric, MAX(as_of) AS as_of FROM fundamental_history GROUP BY code, metric) l
+          ON h.code = l.code AND h.metric = l.metric AND h.as_of = l.as_of
+    ''', conn)
+    if df.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    wide = _typed(_ordered(df.pivot(index='code', columns='metric', values='value'), None))
+    dates = _ordered(df.pivot(index='code', columns='metric', values='as_of'), None).reindex(
+        index=wide.index, columns=wide.columns)
+    wide.insert(0, AS_OF_COLUMN, df.groupby('code')['as_of'].max())
+    wide.index.name = dates.index.name = CODE_COLUMN
+    return wide, dates
+
+
+def available_dates():
+    """반영한 결과 목록 [(기준일, 파일명, 종목 수, 지표 목록)] (최신순)"""
+    return [(as_of, filename, row_count, json.loads(metrics) if metrics else None)
+            for as_of, filename, row_count, metrics in get_connection().execute(
+                "SELECT as_of, filename, row_count, metrics FROM fundamental_sources ORDER BY as_of DESC, imported_at DESC"
+            )]
+
+
+def to_records(df, index_name):
+    """API 응답용: index를 index_name 컬럼으로 꺼내고 빈 값은 None으로"""
+    if df.empty:
+        return []
+    df = df.reset_index().rename(columns={df.index.name or 'index': index_name})
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict('records')
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+종목별 일별 이력 저장소 (trade.db)
+- price_history: 일별 시세 (sise_day.naver)
+- investor_flow: 외국인/기관 일별 순매매 (frgn.naver)
+
+처음 한 번은 네이버 페이지를 여러 장 거슬러 올라가며 채우고,
+이후에는 마지막 저장일 이후의 새 거래일만 추가합니다.
+지표/수급 합계는 이 테이블을 읽어 계산하므로 종목당 요청이 0~1회로 줄어듭니다.
+장 마감 전의 당일 행은 값이 바뀌므로 저장하지 않습니다.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pandas as pd
+import requests
+from lxml import html as lxml_html
+
+import database
+import migrations
+
+DB_FILE = database.DB_FILE
+
+SISE_DAY_URL = "https://finance.naver.com/item/sise_day.naver?code={ticker}&page={page}"
+FRGN_URL = "https://finance.naver.com/item/frgn.naver?code={ticker}&page={page}"
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# 처음 채울 때 확보할 거래일 수 (시세: MA120 + 여유분, 수급: 60일 합계)
+BACKFILL_DAYS = 130
+INVESTOR_BACKFILL_DAYS = 60
+MAX_BACKFILL_PAGES = 15
+
+# 수급 누적 기간 (일)
+FLOW_WINDOWS = (5, 20, 60)
+
+# 장 마감 시각 이후에는 당일 시세가 확정된 것으로 간주
+MARKET_CLOSE = (15, 40)
+
+DATE_PATTERN = re.compile(r'\d{4}\.\d{2}\.\d{2}$')
+
+# 이번 프로세스에서 이미 최신으로 맞춘 (테이블, 종목) -> 기준 거래일 (공휴일에 반복 요청 방지)
+_checked = {}
+
+
+def get_connection():
+    """현재 스레드의 재사용 연결 (database.get_connection). 닫지 않습니다."""
+    conn = database.get_connection(DB_FILE)
+    _ensure_schema(conn)
+    return conn
+
+
+def _ensure_schema(conn):
+    """이력 테이블은 migrations에서 생성 (data_collect처럼 trade.py 없이 실행될 때도 보장)"""
+    migrations.migrate(conn, DB_FILE)
+
+
+def latest_trading_day(now=None):
+    """시세가 확정된 가장 최근 거래일 (주말만 고려, 공휴일은 다음 갱신 시 1회 요청으로 보정)"""
+    now = now or datetime.now()
+    day = now.date()
+    if (now.hour, now.minute) < MARKET_CLOSE:
+        day -= timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day.isoformat()
+
+
+def _to_int(text):
+    text = text.strip().replace(',', '').replace('+', '')
+    return int(text) if text.lstrip('-').isdigit() else None
+
+
+def _to_float(text):
+    try:
+        return float(text.strip().replace(',', '').replace('%', ''))
+    except ValueError:
+        return None
+
+
+def _page_rows(res):
+    """네이버 일별 표 페이지에서 날짜로 시작하는 행의 셀 텍스트 목록"""
+    doc = lxml_html.fromstring(res.content, parser=lxml_html.HTMLParser(encoding='euc-kr'))
+    for tr in doc.xpath('//tr[@onmouseover]'):
+        tds = [''.join(t.strip() for t in td.itertext()) for td in tr.findall('td')]
+        if tds and DATE_PATTERN.match(tds[0]):
+            yield tds
+
+
+def fetch_price_page(ticker, page, session=None):
+    """일별 시세 한 페이지를 [(date, open, high, low, close, volume), ...] (최신순)으로 가져옵니다."""
+    getter = session.get if session else requests.get
+    res = getter(SISE_DAY_URL.format(ticker=ticker, page=page), headers=HEADERS, timeout=5)
+    rows = []
+    for tds in _page_rows(res):
+        if len(tds) < 7:
+            continue
+        # 컬럼: 날짜, 종가, 전일비, 시가, 고가, 저가, 거래량
+        close, open_, high, low, volume = (_to_int(tds[i]) for i in (1, 3, 4, 5, 6))
+        if close is None:
+            continue
+        rows.append((tds[0].replace('.', '-'), open_, high, low, close, volume))
+    return rows
+
+
+def fetch_investor_page(ticker, page, session=None):
+    """외국인/기관 매매 동향 한 페이지를 [(date, inst_net, foreign_net, foreign_shares, foreign_ratio), ...] (최신순)으로 가져옵니다."""
+    getter = session.get if session else requests.get
+    res = getter(FRGN_URL.format(ticker=ticker, page=page), headers=HEADERS, timeout=5)
+    rows = []
+    for tds in _page_rows(res):
+        if len(tds) < 9:
+            continue
+        # 컬럼: 날짜, 종가, 전일비, 등락률, 거래량, 기관 순매매, 외국인 순매매, 외국인 보유주수, 외국인 보유율
+        rows.append((tds[0].replace('.', '-'), _to_int(tds[5]) or 0, _to_int(tds[6]) or 0,
+                     _to_int(tds[7]), _to_float(tds[8])))
+    return rows
+
+
+def _sync_history(table, columns, fetch_page, backfill_days, ticker, session=None, now=None):
+    """
+    저장된 이력을 최신으로 맞춥니다. 추가된 행 수를 반환합니다.
+    - 이력이 없으면 backfill_days 거래일까지 여러 페이지를 채움
+    - 있으면 마지막 저장일이 나올 때까지만 앞 페이지를 읽음 (보통 1페이지)
+    - 마지막 저장일이 너무 오래되어 MAX_BACKFILL_PAGES 안에 닿지 않으면 중간이 비므로
+      저장된 이력을 지우고 읽은 페이지로 처음부터 다시 채움 (읽은 양이 backfill_days보다 적으면 다음에 재시도)
+    - 마지막 저장일이 이미 최근 확정 거래일이면 요청하지 않음
+    """
+    target = latest_trading_day(now)
+    if _checked.get((table, ticker)) == target:
+        return 0
+    conn = get_connection()
+    last_date = conn.execute(f"SELECT MAX(date) FROM {table} WHERE code = ?", (ticker,)).fetchone()[0]
+    if last_date and last_date >= target:
+        _checked[(table, ticker)] = target
+        return 0
+
+    new_rows = []
+    page_size = None
+    # 저장된 이력과 이어지는지 (마지막 저장일까지 읽었거나 종목의 전체 이력을 다 읽음)
+    connected = not last_date
+    for page in range(1, MAX_BACKFILL_PAGES + 1):
+        rows = fetch_page(ticker, page, session)
+        if not rows:
+            break
+        page_size = page_size or len(rows)
+        new_rows.extend(r for r in rows if r[0] <= target and (not last_date or r[0] > last_date))
+        if last_date and rows[-1][0] <= last_date:
+            connected = True
+            break
+        if not last_date and len(new_rows) >= backfill_days:
+            break
+        # 마지막 페이지 (상장 기간이 짧은 종목)
+        if len(rows) < page_size:
+            connected = True
+            break
+
+    if not connected and len(new_rows) < backfill_days:
+        print(f"{table} 이력을 마지막 저장일({last_date})까지 읽지 못했습니다. 다음에 다시 시도합니다. ({ticker})")
+        return 0
+
+    if new_rows:
+        placeholders = ', '.join('?' * (len(columns) + 1))
+        with conn:
+            if not connected:
+                conn.execute(f"DELETE FROM {table} WHERE code = ?", (ticker,))
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table} (code, {', '.join(columns)}) VALUES ({placeholders})",
+                [(ticker,) + r for r in new_rows]
+            )
+    _checked[(table, ticker)] = target
+    return len(new_rows)
+
+
+def update_price_history(ticker, session=None, now=None):
+    """일별 시세 이력을 최신으로 맞춥니다. 추가된 행 수를 반환"""
+    return _sync_history('price_history', ('date', 'open', 'high', 'low', 'close', 'volume'),
+                         fetch_price_page, BACKFILL_DAYS, ticker, session, now)
+
+
+def update_investor_flow(ticker, session=None, now=None):
+    """외국인/기관 일별 순매매 이력을 최신으로 맞춥니다. 추가된 행 수를 반환"""
+    return _sync_history('investor_flow', ('date', 'inst_net', 'foreign_net', 'foreign_shares', 'foreign_ratio'),
+                         fetch_investor_page, INVESTOR_BACKFILL_DAYS, ticker, session, now)
+
+
+def purge_codes(codes):
+    """상장폐지 등으로 마스터에서 빠진 종목의 이력과 지표 캐시를 삭제합니다."""
+    codes = list(codes)
+    if not codes:
+        return
+    conn = get_connection()
+    with conn:
+        for table in ('price_history', 'investor_flow', 'indicator_cache'):
+            conn.executemany(f"DELETE FROM {table} WHERE code = ?", [(c,) for c in codes])
+    for key in [k for k in _checked if k[1] in codes]:
+        _checked.pop(key, None)
+
+
+def load_price_history(ticker, days=None):
+    """저장된 일별 시세를 날짜 오름차순 DataFrame(index=date)으로 반환합니다."""
+    conn = get_connection()
+    query = "SELECT date, open, high, low, close, volume FROM price_history WHERE code = ? ORDER BY date DESC"
+    params = [ticker]
+    if days:
+        query += " LIMIT ?"
+        params.append(days)
+    df = pd.read_sql_query(query, conn, params=params)
+    return df.iloc[::-1].set_index('date')
+
+
+def load_price_histories(codes, days=None):
+    """여러 종목의 일별 시세를 한 번에 읽어 code, date, open, high, low, close, volume 컬럼의 DataFrame으로 반환합니다.
+    days를 지정하면 종목별 최근 days 거래일만 남깁니다."""
+    codes = list(codes)
+    conn = get_connection()
+    placeholders = ','.join('?' * len(codes))
+    df = pd.read_sql_query(
+        f"SELECT code, date, open, high, low, close, volume FROM price_history WHERE code IN ({placeholders}) ORDER BY code, date",
+        conn, params=codes
+    )
+    if days:
+        df = df.groupby('code', sort=False).tail(days)
+    return df.reset_index(drop=True)
+
+
+def get_price_history(ticker, days=None, session=None):
+    """이력을 갱신한 뒤 읽어옵니다. 갱신 실패 시 저장된 데이터만 반환"""
+    try:
+        update_price_history(ticker, session)
+    except Exception as e:
+        print(f"시세 이력 갱신 실패 ({ticker}): {e}")
+    return load_price_history(ticker, days)
+
+
+def load_investor_flows(codes, days=None):
+    """여러 종목의 일별 순매매 이력을 code, date, inst_net, foreign_net, foreign_shares, foreign_ratio 컬럼으로 반환합니다."""
+    codes = list(codes)
+    conn = get_connection()
+    placeholders = ','.join('?' * len(codes))
+    df = pd.read_sql_query(
+        f"SELECT code, date, inst_net, foreign_net, foreign_shares, foreign_ratio FROM investor_flow WHERE code IN ({placeholders}) ORDER BY code, date",
+        conn, params=codes
+    )
+    if days:
+        df = df.groupby('code', sort=False).tail(days)
+    return df.reset_index(drop=True)
+
+
+def empty_investor_flow():
+    data = {'foreign_ratio': 0.0}
+    for n in FLOW_WINDOWS:
+        data[f'foreign_{n}d_net'] = 0
+        data[f'inst_{n}d_net'] = 0
+    return data
+
+
+def summarize_investor_flows(flows):
+    """
+    load_investor_flows 결과로 종목별 최근 5/20/60일 외국인·기관 순매수 합계와 최신 외국인 보유율을 계산합니다.
+    종목별 최근 거래일을 같은 행에 맞춘 행렬의 누적합 차이로 모든 종목·기간을 한 번에 계산하며,
+    이력이 기간보다 짧으면 있는 만큼 합산합니다.
+    """
+    if flows.empty:
+        return {}
+    flows = flows.copy()
+    flows['pos'] = -flows.groupby('code').cumcount(ascending=False)
+    wide = flows.pivot(index='pos', columns='code')
+    result = pd.DataFrame(index=wide.columns.get_level_values('code').unique())
+    for col, prefix in (('foreign_net', 'foreign'), ('inst_net', 'inst')):
+        # 행 역순 누적합: totals.iloc[n-1] = 최근 n거래일 합계
+        totals = wide[col].fillna(0).iloc[::-1].cumsum()
+        for n in FLOW_WINDOWS:
+            result[f'{prefix}_{n}d_net'] = totals.iloc[min(n, len(totals)) - 1].astype(int)
+    ratios = wide['foreign_ratio'].iloc[-1].fillna(0)
+    return {code: dict({k: int(v) for k, v in row.items()}, foreign_ratio=float(ratios[code]))
+            for code, row in result.iterrows()}
+
+
+def get_investor_flows(codes, session=None, max_workers=5):
+    """이력을 갱신한 뒤 종목별 수급 합계를 {종목코드: dict}로 반환합니다. 갱신 실패 시 저장된 데이터만 사용"""
+    codes = list(dict.fromkeys(c for c in codes if c))
+    if not codes:
+        return {}
+
+    def refresh(code):
+        try:
+            update_investor_flow(code, session)
+        except Exception as e:
+            print(f"수급 이력 갱신 실패 ({code}): {e}")
+
+    if len(codes) == 1:
+        refresh(codes[0])
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(refresh, codes))
+    summary = summarize_investor_flows(load_investor_flows(codes, max(FLOW_WINDOWS)))
+    return {c: summary.get(c) or empty_investor_flow() for c in codes}
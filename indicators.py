@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+기술적 지표 계산 엔진
+
+history_store에 저장된 일별 시세로 여러 종목의 지표를 한 번에(종목=컬럼) 계산하고,
+결과는 거래일 단위로 indicator_cache 테이블에 저장합니다.
+같은 거래일 안에서는 다시 계산하거나 시세를 요청하지 않습니다.
+지표는 장 마감으로 확정된 종가 기준입니다.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from history_store import get_connection, latest_trading_day, update_price_history, load_price_histories
+
+# 이동평균선 기간 (일)
+MA_PERIODS = (5, 20, 60, 120)
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+BOLLINGER_PERIOD = 20
+BOLLINGER_K = 2
+VOLUME_PERIODS = (5, 20)
+
+# 계산에 필요한 최대 이력 길이 (RSI/ATR 평활 안정화를 위한 여유 포함)
+HISTORY_DAYS = max(MA_PERIODS) + 10
+
+
+def empty_indicators():
+    """이력이 없을 때 사용하는 기본값"""
+    data = {'rsi': 0, 'atr': 0, 'atr_pct': 0,
+            'bb_upper': 0, 'bb_middle': 0, 'bb_lower': 0, 'bb_pct_b': 0,
+            'volume_ratio': 0}
+    for n in MA_PERIODS:
+        data[f'ma{n}'] = 0
+        data[f'ma{n}_diff'] = 0
+    for n in VOLUME_PERIODS:
+        data[f'volume_ma{n}'] = 0
+    return data
+
+
+def _wilder(series_frame, period):
+    """Wilder 평활 (RSI/ATR 표준 방식), 기간보다 짧은 구간은 NaN"""
+    return series_frame.ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+
+
+def compute_indicators(history):
+    """
+    load_price_histories 형식의 DataFrame으로 종목별 최신 지표를 계산합니다.
+    종목마다 최근 거래일을 같은 행에 맞춘 (거래일 순번 x 종목) 행렬로 바꿔 모든 종목을 한 번에 계산하며,
+    이력이 기간보다 짧은 지표는 0으로 둡니다. {종목코드: 지표 dict}를 반환
+    """
+    if history.empty:
+        return {}
+    history = history.copy()
+    # 0 = 가장 최근 거래일이 되도록 종목별 역순 번호를 매겨 정렬 기준으로 사용
+    history['pos'] = -history.groupby('code').cumcount(ascending=False)
+    wide = history.pivot(index='pos', columns='code')
+    close = wide['close'].astype(float)
+    high = wide['high'].astype(float)
+    low = wide['low'].astype(float)
+    volume = wide['volume'].astype(float)
+    last_close = close.iloc[-1]
+
+    latest = {}
+    for n in MA_PERIODS:
+        ma = close.rolling(n).mean().iloc[-1]
+        latest[f'ma{n}'] = ma
+        latest[f'ma{n}_diff'] = (last_close - ma) / ma * 100
+
+    delta = close.diff()
+    avg_gain = _wilder(delta.clip(lower=0), RSI_PERIOD).iloc[-1]
+    avg_loss = _wilder(-delta.clip(upper=0), RSI_PERIOD).iloc[-1]
+    rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+    # 하락이 전혀 없었던 경우 RSI 100
+    latest['rsi'] = rsi.where(avg_loss != 0, 100.0).where(avg_gain.notna())
+
+    prev_close = close.shift(1)
+    true_range = np.maximum(high - low, np.maximum((high - prev_close).abs(), (low - prev_close).abs()))
+    atr = _wilder(true_range, ATR_PERIOD).iloc[-1]
+    latest['atr'] = atr
+    latest['atr_pct'] = atr / last_close * 100
+
+    middle = close.rolling(BOLLINGER_PERIOD).mean().iloc[-1]
+    std = close.rolling(BOLLINGER_PERIOD).std(ddof=0).iloc[-1]
+    upper, lower = middle + BOLLINGER_K * std, middle - BOLLINGER_K * std
+    latest['bb_upper'] = upper
+    latest['bb_middle'] = middle
+    latest['bb_lower'] = lower
+    latest['bb_pct_b'] = (last_close - lower) / (upper - lower) * 100
+
+    for n in VOLUME_PERIODS:
+        latest[f'volume_ma{n}'] = volume.rolling(n).mean().iloc[-1]
+    latest['volume_ratio'] = volume.iloc[-1] / latest[f'volume_ma{max(VOLUME_PERIODS)}']
+
+    table = pd.DataFrame(latest).replace([np.inf, -np.inf], np.nan).fillna(0).round(2)
+    return {code: {k: float(v) for k, v in row.items()} for code, row in table.iterrows()}
+
+
+def _load_cached(codes, trading_day):
+    conn = get_connection()
+    placeholders = ','.join('?' * len(codes))
+    rows = conn.execute(
+        f"SELECT code, data FROM indicator_cache WHERE trading_day = ? AND code IN ({placeholders})",
+        [trading_day] + list(codes)
+    ).fetchall()
+    return {code: json.loads(data) for code, data in rows}
+
+
+def _save_cached(results, trading_day):
+    conn = get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO indicator_cache (code, trading_day, data) VALUES (?, ?, ?)",
+            [(code, trading_day, json.dumps(data)) for code, data in results.items()]
+        )
+
+
+def _refresh_history(code):
+    try:
+        update_price_history(code)
+    except Exception as e:
+        print(f"시세 이력 갱신 실패 ({code}): {e}")
+
+
+def get_indicators(codes, max_workers=5):
+    """
+    여러 종목의 기술적 지표를 {종목코드: 지표 dict}로 반환합니다.
+    오늘 거래일 기준으로 캐시된 종목은 그대로 사용하고, 나머지만 시세 이력을 갱신한 뒤 한 번에 계산합니다.
+    이력 갱신에 실패해 시세가 거래일까지 없는 종목은 계산값을 반환하되 캐시하지 않습니다. (다음 호출에서 재시도)
+    """
+    codes = list(dict.fromkeys(c for c in codes if c))
+    if not codes:
+        return {}
+    trading_day = latest_trading_day()
+    results = _load_cached(codes, trading_day)
+    missing = [c for c in codes if c not in results]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(_refresh_history, missing))
+        history = load_price_histories(missing, HISTORY_DAYS)
+        computed = compute_indicators(history)
+        current = set(history.loc[history['date'] >= trading_day, 'code']) if not history.empty else set()
+        fresh = {code: data for code, data in computed.items() if code in current}
+        if fresh:
+            _save_cached(fresh, trading_day)
+        results.update(computed)
+    return {c: results.get(c) or empty_indicators() for c in codes}
+
+
+def get_indicators_for(code):
+    """단일 종목 지표 (이력이 없으면 기본값)"""
+    return get_indicators([code]).get(code) or empty_indicators()
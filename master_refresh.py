@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+종목 마스터(stocks_master) 갱신 서비스
+
+네이버 시가총액 순위 페이지(sise_market_sum)를 시장별로 병렬 수집한 뒤
+기존 마스터와 비교해 신규/이름·시장 변경/상장폐지/시가총액 변경분만 한 트랜잭션으로 반영합니다.
+반영 후 변경 내역을 구독자(검색 인덱스, 이력 저장소 등)에게 전달해 필요한 부분만 갱신하게 합니다.
+동시에 여러 갱신이 실행되지 않도록 한 번에 하나만 수행합니다.
+"""
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from lxml import html as lxml_html
+
+import database
+
+MARKET_SUM_URL = "https://finance.naver.com/sise/sise_market_sum.naver?sosok={sosok}&page={page}"
+MARKETS = {0: 'KOSPI', 1: 'KOSDAQ'}
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# 마지막 페이지를 알 수 없을 때의 상한
+MAX_PAGES = 80
+FETCH_WORKERS = 8
+
+_refresh_lock = threading.Lock()
+_listeners = []
+
+
+def subscribe(callback):
+    """마스터 변경 시 호출할 함수 등록. callback(changes)"""
+    _listeners.append(callback)
+
+
+def _emit(changes):
+    for callback in list(_listeners):
+        try:
+            callback(changes)
+        except Exception as e:
+            print(f"종목 마스터 변경 알림 처리 중 오류: {e}")
+
+
+def is_running():
+    return _refresh_lock.locked()
+
+
+def _parse_market_cap(text):
+    digits = text.replace(',', '').strip()
+    return int(digits) if digits.isdigit() else None
+
+
+def fetch_market_page(session, sosok, page):
+    """
+    시가총액 순위 한 페이지를 읽습니다.
+    반환: ([(code, name, market, market_cap(억)), ...], 마지막 페이지 번호 또는 None)
+    """
+    res = session.get(MARKET_SUM_URL.format(sosok=sosok, page=page), timeout=10)
+    doc = lxml_html.fromstring(res.content, parser=lxml_html.HTMLParser(encoding='euc-kr'))
+    rows = []
+    for a in doc.xpath('//table[contains(@class, "type_2")]//a[contains(@class, "tltle")]'):
+        code = a.get('href', '').split('code=')[-1]
+        tds = a.getparent().getparent().findall('td')
+        # 컬럼: N, 종목명, 현재가, 전일비, 등락률, 액면가, 시가총액, ...
+        market_cap = _parse_market_cap(tds[6].text_content()) if len(tds) > 6 else None
+        rows.append((code, a.text_content().strip(), MARKETS[sosok], market_cap))
+
+    last_page = None
+    last_link = doc.xpath('//td[contains(@class, "pgRR")]/a/@href')
+    if last_link:
+        match = re.search(r'page=(\d+)', last_link[0])
+        if match:
+            last_page = int(match.group(1))
+    return rows, last_page
+
+
+def fetch_master(session=None, workers=FETCH_WORKERS):
+    """
+    전체 시장 종목을 시가총액 순서대로 수집합니다.
+    각 시장의 첫 페이지로 마지막 페이지를 확인한 뒤 나머지 페이지를 병렬로 가져옵니다.
+    반환: (종목 목록, 모든 페이지를 빠짐없이 받았는지 여부)
+    """
+    session = session or requests.Session()
+    session.headers.update(HEADERS)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        first = {sosok: executor.submit(fetch_market_page, session, sosok, 1) for sosok in MARKETS}
+        pages = {}
+        complete = True
+        for sosok, future in first.items():
+            try:
+                rows, last_page = future.result()
+            except Exception as e:
+                print(f"{MARKETS[sosok]} 1페이지 수집 실패: {e}")
+                complete = False
+                continue
+            pages[(sosok, 1)] = rows
+            for page in range(2, min(last_page or MAX_PAGES, MAX_PAGES) + 1):
+                pages[(sosok, page)] = executor.submit(fetch_market_page, session, sosok, page)
+
+        for key, value in list(pages.items()):
+            if isinstance(value, list):
+                continue
+            try:
+                pages[key] = value.result()[0]
+                if not pages[key]:
+                    # 범위 안의 페이지가 비어 있으면 차단/오류 응답으로 보고 상장폐지 판단에서 제외
+                    complete = False
+            except Exception as e:
+                print(f"{MARKETS[key[0]]} {key[1]}페이지 수집 실패: {e}")
+                pages[key] = []
+                complete = False
+
+    stocks = []
+    seen = set()
+    for key in sorted(pages):
+        for row in pages[key]:
+            if row[0] not in seen:
+                seen.add(row[0])
+                stocks.append(row)
+    return stocks, complete and bool(stocks)
+
+
+def diff_master(existing, fetched, complete=True):
+    """
+    기존 마스터 {code: (name, market, market_cap)}와 수집 결과를 비교합니다.
+    일부 페이지가 빠진 수집(complete=False)에서는 상장폐지를 판단하지 않습니다.
+    """
+    added, renamed, cap_changed = [], [], []
+    fetched_codes = set()
+    for code, name, market, market_cap in fetched:
+        fetched_codes.add(code)
+        old = existing.get(code)
+        if old is None:
+            added.append((code, name, market, market_cap))
+        elif (old[0], old[1]) != (name, market):
+            renamed.append((code, name, market, market_cap))
+        elif old[2] != market_cap:
+            cap_changed.append((code, name, market, market_cap))
+    delisted = sorted(set(existing) - fetched_codes) if complete else []
+    return {'added': added, 'renamed': renamed, 'cap_changed': cap_changed, 'delisted': delisted}
+
+
+def apply_diff(db_file, diff, fetched):
+    """변경분만 한 트랜잭션으로 반영. 두 시장 통합 시가총액 순위(cap_rank)는 바뀐 종목만 갱신"""
+    by_cap = sorted(fetched, key=lambda row: -(row[3] or 0))
+    rank = {row[0]: i + 1 for i, row in enumerate(by_cap)}
+    conn = database.get_connection(db_file)
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO stocks_master (code, name, market, market_cap, cap_rank) VALUES (?, ?, ?, ?, ?)",
+            [row + (rank[row[0]],) for row in diff['added']]
+        )
+        conn.executemany(
+            "UPDATE stocks_master SET name = ?, market = ?, market_cap = ? WHERE code = ?",
+            [(name, market, market_cap, code) for code, name, market, market_cap in diff['renamed'] + diff['cap_changed']]
+        )
+        conn.executemany("DELETE FROM stocks_master WHERE code = ?", [(c,) for c in diff['delisted']])
+        conn.executemany(
+            "UPDATE stocks_master SET cap_rank = ? WHERE code = ? AND cap_rank IS NOT ?",
+            [(r, code, r) for code, r in rank.items()]
+        )
+
+
+def refresh_master(db_file, session=None):
+    """
+    종목 마스터를 갱신하고 변경 내역을 반환합니다.
+    이미 다른 갱신이 진행 중이면 None을 반환
+    """
+    if not _refresh_lock.acquire(blocking=False):
+        print("종목 마스터 업데이트가 이미 진행 중입니다.")
+        return None
+    try:
+        fetched, complete = fetch_master(session)
+        if not fetched:
+            print("종목 마스터 수집 결과가 없어 업데이트하지 않습니다.")
+            return None
+
+        conn = database.get_connection(db_file)
+        existing = {code: (name, market, market_cap) for code, name, market, market_cap in
+                    conn.execute("SELECT code, name, market, market_cap FROM stocks_master")}
+
+        diff = diff_master(existing, fetched, complete)
+        apply_diff(db_file, diff, fetched)
+
+        changes = {
+            'added': [row[0] for row in diff['added']],
+            'renamed': [row[0] for row in diff['renamed']],
+            'delisted': diff['delisted'],
+            'cap_changed': len(diff['cap_changed']),
+            'total': len(fetched),
+            'complete': complete,
+        }
+        print(f"종목 마스터 업데이트 완료: {len(fetched)}개 종목 (신규 {len(changes['added'])}, "
+              f"변경 {len(changes['renamed'])}, 상장폐지 {len(changes['delisted'])}, 시가총액 변경 {changes['cap_changed']})")
+        _emit(changes)
+        return changes
+    except Exception as e:
+        print(f"마스터 업데이트 중 오류: {e}")
+        return None
+    finally:
+        _refresh_lock.release()
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+trade.db 스키마 버전 관리
+
+schema_version 테이블에 적용한 버전을 기록하고, 시작 시 그보다 새로운 마이그레이션만 실행합니다.
+이미 최신이면 버전 한 번 조회로 끝납니다.
+버전 관리 도입 전에 만들어진 DB도 있으므로 각 마이그레이션은 여러 번 실행해도 안전하게 작성합니다.
+새 스키마 변경은 MIGRATIONS 끝에 (버전, 설명, 함수)로 추가합니다.
+파일 이름 변경처럼 되돌릴 수 없는 작업은 함수가 콜러블로 반환하면 커밋이 성공한 뒤에 실행됩니다.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(conn, table, column_def):
+    """컬럼이 없을 때만 추가"""
+    if column_def.split()[0] not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column_def}")
+
+
+def _create_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS my_stocks (
+            code TEXT PRIMARY KEY,
+            name TEXT,
+            added_at TEXT,
+            purchase_price REAL DEFAULT 0,
+            quantity INTEGER DEFAULT 0
+        )
+    ''')
+    _add_column(conn, 'my_stocks', 'purchase_price REAL DEFAULT 0')
+    _add_column(conn, 'my_stocks', 'quantity INTEGER DEFAULT 0')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS analysis_results (
+            filename TEXT PRIMARY KEY,
+            market TEXT,
+            stock_count TEXT,
+            created_at TEXT,
+            size INTEGER,
+            spreadsheet_id TEXT,
+            drive_link TEXT,
+            ai_result TEXT,
+            is_complete INTEGER DEFAULT 1
+        )
+    ''')
+    _add_column(conn, 'analysis_results', 'is_complete INTEGER DEFAULT 1')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stocks_master (
+            code TEXT PRIMARY KEY,
+            name TEXT,
+            market TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS portfolio_ai_cache (
+            cache_key TEXT PRIMARY KEY,
+            ai_result TEXT,
+            created_at TEXT
+        )
+    ''')
+
+
+def _add_master_market_cap(conn):
+    # 시가총액(억)과 두 시장 통합 시가총액 순위 (검색 결과 정렬용)
+    _add_column(conn, 'stocks_master', 'market_cap INTEGER')
+    _add_column(conn, 'stocks_master', 'cap_rank INTEGER')
+
+
+def _import_my_stocks_json(conn):
+    """예전 my_stocks.json 보유 종목 가져오기 (파일은 커밋 후 .bak으로 이름 변경)"""
+    json_file = os.path.join(APP_DIR, 'my_stocks.json')
+    if not os.path.exists(json_file):
+        return
+    with open(json_file, 'r', encoding='utf-8') as f:
+        stocks = json.load(f)
+    conn.executemany(
+        "INSERT OR IGNORE INTO my_stocks (code, name, added_at) VALUES (?, ?, ?)",
+        [(s['code'], s.get('name', ''), s.get('added_at', datetime.now().isoformat())) for s in stocks]
+    )
+
+    def backup():
+        os.rename(json_file, json_file + '.bak')
+        print("JSON 데이터를 SQLite로 마이그레이션 완료했습니다.")
+    return backup
+
+
+def _create_history_tables(conn):
+    # 일별 시세/수급 이력과 거래일별 지표 캐시 (history_store, indicators)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS price_history (
+            code TEXT,
+            date TEXT,
+            open INTEGER,
+            high INTEGER,
+            low INTEGER,
+            close INTEGER,
+            volume INTEGER,
+            PRIMARY KEY (code, date)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS investor_flow (
+            code TEXT,
+            date TEXT,
+            inst_net INTEGER,
+            foreign_net INTEGER,
+            foreign_shares INTEGER,
+            foreign_ratio REAL,
+            PRIMARY KEY (code, date)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS indicator_cache (
+            code TEXT PRIMARY KEY,
+            trading_day TEXT,
+            data TEXT
+        )
+    ''')
+
+
+def _create_app_state(conn):
+    # 결과 폴더 가져오기 진행 상태 등 앱 내부 상태 (key-value)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS app_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def _index_results_listing(conn):
+    # 결과 목록 키셋 페이지네이션 (created_at DESC, filename DESC) 및 시장 필터용 인덱스
+    conn.execute("UPDATE analysis_results SET created_at = '' WHERE created_at IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_results_created ON analysis_results (created_at, filename)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_results_market_created ON analysis_results (market, created_at, filename)")
+
+
+def _create_fundamental_history(conn):
+    # 수집 실행마다 종목별 지표를 쌓는 시계열 (fundamentals_store)
+    # value는 타입을 지정하지 않아 숫자와 문자열(데이터기준, 감사의견 등)을 모두 저장
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fundamental_history (
+            code TEXT,
+            as_of TEXT,
+            metric TEXT,
+            value,
+            PRIMARY KEY (code, as_of, metric)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fundamental_as_of ON fundamental_history (as_of, metric)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fundamental_sources (
+            filename TEXT PRIMARY KEY,
+            as_of TEXT,
+            row_count INTEGER,
+            imported_at TEXT
+        )
+    ''')
+
+
+def _create_ai_report_cache(conn):
+    # 결과 AI 리포트 로컬 캐시 (report_cache), 키는 분석 데이터와 프롬프트 버전의 해시
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ai_report_cache (
+            cache_key TEXT PRIMARY KEY,
+            filename TEXT,
+            content TEXT,
+            format TEXT,
+            source TEXT,
+            created_at TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_report_filename ON ai_report_cache (filename)")
+
+
+def _fundamental_sources_metrics(conn):
+    # 결과별로 반영한 지표 목록(JSON) 기록, 부분 결과(취소/마감)는 시계열에서 제외
+    _add_column(conn, 'fundamental_sources', 'metrics TEXT')
+    partial = "SELECT filename FROM analysis_results WHERE is_complete = 0"
+    # 부분 결과만 반영된 기준일의 값은 어느 결과에서 왔는지 구분할 수 없으므로 그 기준일을 통째로 제거
+    conn.execute(f'''
+        DELETE FROM fundamental_history WHERE as_of IN (
+            SELECT as_of FROM fundamental_sources GROUP BY as_of
+            HAVING SUM(filename NOT IN ({partial})) = 0
+        )
+    ''')
+    conn.execute(f"DELETE FROM fundamental_sources WHERE filename IN ({partial})")
+
+
+MIGRATIONS = [
+    (1, '기본 테이블 (my_stocks, analysis_results, stocks_master, portfolio_ai_cache)', _create_base_tables),
+    (2, '종목 마스터 시가총액/순위 컬럼', _add_master_market_cap),
+    (3, 'my_stocks.json 가져오기', _import_my_stocks_json),
+    (4, '시세/수급 이력, 지표 캐시 테이블', _create_history_tables),
+    (5, '앱 상태 테이블', _create_app_state),
+    (6, '결과 목록 인덱스', _index_results_listing),
+    (7, '종목 지표 시계열 테이블', _create_fundamental_history),
+    (8, 'AI 리포트 캐시 테이블', _create_ai_report_cache),
+    (9, '지표 시계열 결과별 지표 목록, 부분 결과 제외', _fundamental_sources_metrics),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def _apply(conn):
+    """쓰기 잠금(BEGIN IMMEDIATE) 안에서 버전을 다시 확인하고 남은 마이그레이션을 적용"""
+    applied = []
+    after_commit = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = current_version(conn)
+        for number, description, func in MIGRATIONS:
+            if number <= version:
+                continue
+            action = func(conn)
+            if callable(action):
+                after_commit.append(action)
+            conn.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                         (number, description, datetime.now().isoformat()))
+            applied.append(number)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for number in applied:
+        print(f"DB 스키마 마이그레이션 적용: v{number}")
+    for action in after_commit:
+        try:
+            action()
+        except Exception as e:
+            print(f"마이그레이션 후속 작업 실패: {e}")
+    return applied
+
+
+def migrate(conn, db_file=None):
+    """
+    적용되지 않은 마이그레이션을 순서대로 실행하고 적용한 버전 목록을 반환합니다.
+    db_file을 넘기면 같은 프로세스에서 한 번만 확인합니다.
+    여러 프로세스가 동시에 시작해도 쓰기 잠금(BEGIN IMMEDIATE) 안에서 버전을 다시 확인해 한 번만 적용됩니다.
+    호출한 쪽의 트랜잭션은 커밋하지 않습니다. 트랜잭션이 진행 중인 연결에 적용할 마이그레이션이 남아 있으면
+    RuntimeError (보통은 시작 시 init_db에서 먼저 적용되므로 생기지 않음)
+    """
+    if db_file and db_file in _migrated:
+        return []
+    with _migrate_lock:
+        if db_file and db_file in _migrated:
+            return []
+        applied = []
+        if current_version(conn) < LATEST_VERSION:
+            if conn.in_transaction:
+                raise RuntimeError("트랜잭션이 진행 중인 연결에는 마이그레이션을 적용할 수 없습니다. 먼저 커밋하세요.")
+            applied = _apply(conn)
+        if db_file:
+            _migrated.add(db_file)
+        return applied
+
+
+def get_state(conn, key, default=None):
+    row = conn.execute("SELECT value FROM app_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_state(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO app_state (key, value) VALUES (?, ?)", (key, str(value)))
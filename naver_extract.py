@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""
+네이버 금융 종목 메인 페이지(main.naver) 추출 엔진
+
+필드별 추출기를 레지스트리에 등록하고 페이지 객체에 바인딩합니다.
+각 필드는 처음 읽을 때 계산되고 같은 페이지에서는 다시 계산하지 않으므로,
+호출하는 쪽은 실제로 읽는 필드만큼만 비용을 냅니다.
+수집기(data_collect.py)와 웹 앱(get_all_naver_data.py, trade.py)이 같은 코드를 사용합니다.
+"""
+import re
+import requests
+from lxml import html as lxml_html
+
+MAIN_URL = "https://finance.naver.com/item/main.naver?code={ticker}"
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# 필드명 -> 추출기. 추출기 하나가 같은 테이블의 여러 필드를 한 번에 계산해 dict로 반환
+FIELD_EXTRACTORS = {}
+
+
+def extractor(*fields):
+    """추출기 등록 데코레이터. 반환 dict에 없는 필드는 '값 없음'으로 기록"""
+    def register(func):
+        for field in fields:
+            FIELD_EXTRACTORS[field] = func
+        return func
+    return register
+
+
+def _text(el):
+    """BeautifulSoup get_text(strip=True)와 같은 방식으로 텍스트 추출 (각 텍스트 조각을 strip 후 연결)"""
+    return ''.join(t.strip() for t in el.itertext())
+
+
+def _has_class(name):
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+
+def _row_cells(table):
+    """테이블의 각 행에서 (첫 th 텍스트, td 목록)을 꺼냅니다. th나 td가 없는 행은 제외"""
+    for row in table.iter('tr'):
+        th = row.find('.//th')
+        tds = row.findall('.//td')
+        if th is not None and tds:
+            yield _text(th), tds
+
+
+def _first_int(text):
+    nums = re.findall(r'[\d,]+', text)
+    return int(nums[0].replace(',', '')) if nums else None
+
+
+class NaverMainPage:
+    """
+    네이버 종목 메인 페이지. page.get('per')처럼 읽으면 해당 추출기만 실행됩니다.
+    - content: 응답 원본 바이트 (디코딩하지 않고 lxml에 바로 전달)
+    """
+
+    def __init__(self, content, encoding='euc-kr', ticker=''):
+        self.content = content
+        self.encoding = encoding or 'euc-kr'
+        self.ticker = ticker
+        self._doc = None
+        self._values = {}
+        self._done = set()
+
+    @classmethod
+    def fetch(cls, ticker, session=None, timeout=10):
+        """메인 페이지를 내려받아 페이지 객체를 만듭니다."""
+        getter = session.get if session else requests.get
+        kwargs = {'timeout': timeout}
+        if not session:
+            kwargs['headers'] = DEFAULT_HEADERS
+        res = getter(MAIN_URL.format(ticker=ticker), **kwargs)
+        return cls(res.content, res.encoding, ticker)
+
+    @property
+    def doc(self):
+        if self._doc is None:
+            self._doc = lxml_html.fromstring(self.content, parser=lxml_html.HTMLParser(encoding=self.encoding))
+        return self._doc
+
+    def xpath(self, path):
+        return self.doc.xpath(path)
+
+    def table(self, summary=None, css_class=None):
+        """summary 문구나 클래스로 문서에서 처음 일치하는 테이블"""
+        if summary:
+            found = self.xpath(f'//table[contains(@summary, "{summary}")]')
+        else:
+            found = self.xpath(f'//table[{_has_class(css_class)}]')
+        return found[0] if found else None
+
+    def get(self, field, default=None):
+        """필드 값 (처음 접근 시 계산 후 메모). 페이지에서 찾지 못하면 default"""
+        if field not in self._values:
+            func = FIELD_EXTRACTORS.get(field)
+            if func is None:
+                raise KeyError(field)
+            if func not in self._done:
+                self._done.add(func)
+                result = func(self)
+                self._values.update(result)
+                for name, f in FIELD_EXTRACTORS.items():
+                    if f is func:
+                        self._values.setdefault(name, None)
+        value = self._values[field]
+        return default if value is None else value
+
+    def __getitem__(self, field):
+        return self.get(field)
+
+    def fields(self, *names):
+        """여러 필드를 dict로 (찾지 못한 필드는 None)"""
+        return {name: self.get(name) for name in names}
+
+
+# ===================================================================
+# 기본 시세 (dl.blind)
+# ===================================================================
+_DD_PRICE_FIELDS = [
+    (4, '전일가', 'prev_price'),
+    (5, '시가', 'open_price'),
+    (6, '고가', 'high_price'),
+    (7, '상한가', 'upper_limit'),
+    (8, '저가', 'low_price'),
+    (9, '하한가', 'lower_limit'),
+    (10, '거래량', 'volume'),
+    (11, '거래대금', 'trading_value'),
+]
+
+
+@extractor('name', 'current_price', *[key for _, _, key in _DD_PRICE_FIELDS])
+def _extract_quote(page):
+    values = {}
+    blind_dl = page.xpath(f'//dl[{_has_class("blind")}]')
+    if not blind_dl:
+        return values
+    dds = [dd.text_content() for dd in blind_dl[0].iter('dd')]
+    if len(dds) < 12:
+        return values
+    try:
+        if '종목명' in dds[1]:
+            values['name'] = dds[1].replace('종목명', '').strip()
+        price = _first_int(dds[3])
+        if price is not None:
+            values['current_price'] = price
+        for idx, label, key in _DD_PRICE_FIELDS:
+            if label in dds[idx]:
+                num = _first_int(dds[idx])
+                if num is not None:
+                    values[key] = num
+    except Exception as e:
+        print(f"DD 파싱 오류: {e}")
+    return values
+
+
+@extractor('sector')
+def _extract_sector(page):
+    found = page.xpath(f'//div[{_has_class("section")} and {_has_class("trade_compare")}]//h4//em//a')
+    return {'sector': _text(found[0])} if found else {}
+
+
+# ===================================================================
+# 시가총액 / 외국인 / 투자의견 / PER 테이블 (aside_invest_info)
+# ===================================================================
+@extractor('market_cap', 'market_cap_rank', 'outstanding_shares')
+def _extract_market_cap(page):
+    values = {}
+    table = page.table(summary='시가총액 정보')
+    if table is None:
+        return values
+    for th_text, tds in _row_cells(table):
+        td_text = _text(tds[0])
+        if '시가총액' in th_text and '순위' not in th_text:
+            values['market_cap'] = td_text
+        elif '시가총액순위' in th_text:
+            values['market_cap_rank'] = td_text
+        elif '상장주식수' in th_text:
+            num = _first_int(td_text)
+            if num is not None:
+                values['outstanding_shares'] = num
+    return values
+
+
+@extractor('market_cap_eok')
+def _extract_market_cap_eok(page):
+    """시가총액(억원) 숫자. "425조 3,456" -> 4253456"""
+    found = page.xpath('//*[@id="_market_sum"]')
+    if not found:
+        return {}
+    text = _text(found[0]).replace(',', '')
+    jo = re.search(r'(\d+)조', text)
+    eok = re.search(r'(\d+)(?:억|$)', text.split('조')[-1])
+    total = (int(jo.group(1)) * 10000 if jo else 0) + (int(eok.group(1)) if eok else 0)
+    return {'market_cap_eok': total}
+
+
+@extractor('foreign_limit_shares', 'foreign_owned_shares', 'foreign_exhaustion_ratio', 'foreign_ownership_ratio')
+def _extract_foreign(page):
+    values = {}
+    table = page.table(summary='외국인한도주식수 정보')
+    if table is None:
+        return values
+    for th_text, tds in _row_cells(table):
+        td_text = _text(tds[0])
+        if '외국인한도주식수' in th_text and '(' not in th_text:
+            num = _first_int(td_text)
+            if num is not None:
+                values['foreign_limit_shares'] = num
+        elif '외국인보유주식수' in th_text:
+            num = _first_int(td_text)
+            if num is not None:
+                values['foreign_owned_shares'] = num
+        elif '외국인소진율' in th_text or '외국인(한도)소진율' in th_text:
+            percent = re.findall(r'[\d.]+', td_text.replace('%', ''))
+            if percent:
+                values['foreign_exhaustion_ratio'] = float(percent[0])
+
+    # 외국인 보유율 계산
+    outstanding = page.get('outstanding_shares', 0)
+    owned = values.get('foreign_owned_shares', 0)
+    if outstanding > 0 and owned > 0:
+        values['foreign_ownership_ratio'] = round((owned / outstanding) * 100, 2)
+    return values
+
+
+@extractor('opinion', 'opinion_score', 'target_price', 'high_52w', 'low_52w')
+def _extract_opinion(page):
+    values = {}
+    table = page.table(summary='투자의견 정보')
+    if table is None:
+        return values
+    for th_text, tds in _row_cells(table):
+        td_text = _text(tds[0])
+        if '투자의견' in th_text and '목표주가' in th_text:
+            # 형식: "4.00매수l166,385"
+            parts = td_text.split('l')
+            if len(parts) >= 2:
+                opinion_match = re.search(r'[가-힣]+', parts[0])
+                if opinion_match:
+                    values['opinion'] = opinion_match.group()
+                score_match = re.search(r'[\d.]+', parts[0])
+                if score_match:
+                    values['opinion_score'] = float(score_match.group())
+                target = _first_int(parts[1])
+                if target is not None:
+                    values['target_price'] = target
+        elif '52주최고' in th_text or '52주 최고' in th_text:
+            # 형식: "157,000l50,800"
+            nums = re.findall(r'[\d,]+', td_text)
+            if len(nums) >= 2:
+                values['high_52w'] = int(nums[0].replace(',', ''))
+                values['low_52w'] = int(nums[1].replace(',', ''))
+    return values
+
+
+# 부호 있는 숫자 (쉼표는 미리 제거)
+SIGNED_NUMBER = r'[-+]?\d*\.?\d+'
+
+
+def _split_ratio_pair(td_text):
+    """"14.33배l4,950원" 형식에서 (배수, 주당값) 추출. 적자 기업의 음수("-14.33배l-4,950원")도 부호 유지. 값이 없으면 None"""
+    nums = re.findall(SIGNED_NUMBER, td_text.replace(',', ''))
+    if len(nums) < 2:
+        return None, None
+    ratio = float(nums[0])
+    try:
+        per_share = int(nums[1])
+    except ValueError:
+        per_share = int(float(nums[1]))
+    return ratio, per_share
+
+
+@extractor('per', 'eps', 'estimated_per', 'estimated_eps', 'pbr', 'bps')
+def _extract_per_table(page):
+    values = {}
+    table = page.table(css_class='per_table')
+    if table is None:
+        return values
+    for th_text, tds in _row_cells(table):
+        if 'PER' in th_text and 'EPS' in th_text and '추정' not in th_text:
+            keys = ('per', 'eps')
+        elif '추정PER' in th_text or '추정 PER' in th_text:
+            keys = ('estimated_per', 'estimated_eps')
+        elif 'PBR' in th_text and 'BPS' in th_text:
+            keys = ('pbr', 'bps')
+        else:
+            continue
+        ratio, per_share = _split_ratio_pair(_text(tds[0]))
+        if ratio is not None:
+            values[keys[0]] = ratio
+        if per_share is not None:
+            values[keys[1]] = per_share
+    return values
+
+
+@extractor('sector_per', 'sector_change_rate', 'sector_pbr')
+def _extract_sector_per(page):
+    values = {}
+    table = page.table(summary='동일업종 PER 정보')
+    if table is None:
+        return values
+    for th_text, tds in _row_cells(table):
+        td_text = _text(tds[0])
+        if '동일업종 PER' in th_text:
+            nums = re.findall(SIGNED_NUMBER, td_text.replace(',', ''))
+            if nums:
+                values['sector_per'] = float(nums[0])
+        elif '업종 PBR' in th_text:
+            nums = re.findall(SIGNED_NUMBER, td_text.replace(',', ''))
+            if nums:
+                values['sector_pbr'] = float(nums[0])
+        elif '동일업종 등락률' in th_text:
+            percent = re.findall(r'[+-]?[\d.]+', td_text)
+            if percent:
+                values['sector_change_rate'] = float(percent[0])
+    return values
+
+
+@extractor('dividend_yield')
+def _extract_dividend(page):
+    found = page.xpath('//em[@id="_dvr"]')
+    if not found:
+        return {}
+    val = _text(found[0]).replace(',', '').replace('%', '')
+    if val and val != '-' and val != 'N/A':
+        try:
+            return {'dividend_yield': float(val)}
+        except ValueError:
+            pass
+    return {}
+
+
+# ===================================================================
+# 기업실적분석 (주요재무정보) 테이블
+# ===================================================================
+def _growth(vals, allow_negative):
+    """최근 2개 유효값(뒤에서 [-1] 최신, [-2] 전년)으로 성장률(%) 문자열 계산"""
+    if allow_negative:
+        valid_vals = [v for v in vals if v and v != '-' and v.replace('.', '').replace('-', '').isdigit()]
+    else:
+        valid_vals = [v for v in vals if v and v != '-' and v.replace('.', '').isdigit()]
+    if len(valid_vals) < 2:
+        return None
+    try:
+        current = float(valid_vals[-1])
+        previous = float(valid_vals[-2])
+        if allow_negative and previous != 0:
+            return str(round((current - previous) / abs(previous) * 100, 1))
+        if not allow_negative and previous > 0:
+            return str(round((current - previous) / previous * 100, 1))
+    except ValueError:
+        pass
+    return None
+
+
+def _last_valid(vals, skip_last=True):
+    """뒤에서부터 유효한 값 (기본은 마지막 컬럼 제외, skip_last=False면 마지막 컬럼부터)"""
+    for i in range(len(vals) - (2 if skip_last else 1), -1, -1):
+        if vals[i] and vals[i] != '-' and vals[i] != 'N/A':
+            return vals[i]
+    return None
+
+
+def _to_float(val):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+
+@extractor('revenue', 'revenue_growth', 'operating_profit', 'profit_growth', 'net_profit',
+           'roe', 'debt_ratio', 'debt_ratio_last', 'current_ratio', 'op_margin', 'net_margin', 'next_op')
+def _extract_financials(page):
+    values = {}
+    tables = page.xpath('//table[contains(@summary, "기업실적분석") or contains(@summary, "주요재무정보")]')
+    if not tables:
+        return values
+    table = tables[0]
+    # 컬럼 연도 헤더 (추정치는 '(E)' 포함)
+    header_rows = table.findall('.//thead/tr')
+    years = [_text(th) for th in header_rows[1].findall('th')] if len(header_rows) >= 2 else []
+
+    for th_text, tds in _row_cells(table):
+        vals = [_text(td).replace(',', '') for td in tds]
+        last_valid = _last_valid(vals)
+
+        if th_text == '매출액':
+            if last_valid:
+                values['revenue'] = last_valid
+            growth = _growth(vals, allow_negative=False)
+            if growth is not None:
+                values['revenue_growth'] = growth
+        elif th_text == '영업이익':
+            if last_valid:
+                values['operating_profit'] = last_valid
+            growth = _growth(vals, allow_negative=True)
+            if growth is not None:
+                values['profit_growth'] = growth
+            # 내년 예상 영업이익: 첫 추정치 컬럼
+            for i, y in enumerate(years[:len(vals)]):
+                if 'E' in y and vals[i] and vals[i] != '-':
+                    try:
+                        values['next_op'] = int(float(vals[i]))
+                        break
+                    except ValueError:
+                        pass
+        elif th_text == '당기순이익' or th_text == '순이익':
+            if last_valid:
+                values['net_profit'] = last_valid
+        elif '영업이익률' in th_text or '순이익률' in th_text:
+            # 최근 실적(추정치 제외) 값
+            key = 'op_margin' if '영업이익률' in th_text else 'net_margin'
+            for i in range(min(len(vals), len(years)) - 1, -1, -1):
+                if '(E)' not in years[i] and _to_float(vals[i]) is not None:
+                    values[key] = float(vals[i])
+                    break
+        else:
+            if '부채비율' in th_text:
+                # 수집기 부채비율 컬럼: 마지막 컬럼까지 포함한 가장 최근 값 (보유 종목 화면은 debt_ratio)
+                latest = _last_valid(vals, skip_last=False)
+                if _to_float(latest) is not None:
+                    values['debt_ratio_last'] = float(latest)
+            for label, key in (('ROE', 'roe'), ('부채비율', 'debt_ratio'), ('유동비율', 'current_ratio')):
+                if label in th_text:
+                    if _to_float(last_valid) is not None:
+                        values[key] = float(last_valid)
+                    break
+    return values
+
+
+@extractor('price_position_52w')
+def _extract_price_position(page):
+    """52주 범위 내 현재가 위치(%)"""
+    high, low = page.get('high_52w', 0), page.get('low_52w', 0)
+    if high > low > 0:
+        return {'price_position_52w': round((page.get('current_price', 0) - low) / (high - low) * 100, 1)}
+    return {}
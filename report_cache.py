@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+결과 AI 리포트 캐시
+
+1차: trade.db의 ai_report_cache (분석 데이터 + 프롬프트 버전 해시 -> 리포트)
+2차: 구글 드라이브의 기존 리포트 문서 (느리거나 연결되지 않아도 1차 캐시는 그대로 동작)
+드라이브에서 찾은 리포트는 1차 캐시에 저장해 다음부터는 드라이브를 조회하지 않습니다.
+"""
+import os
+from datetime import datetime
+
+import database
+import migrations
+
+DB_FILE = database.DB_FILE
+
+# 이보다 짧은 드라이브 문서는 비어 있는 것으로 보고 사용하지 않음
+MIN_REPORT_LENGTH = 100
+
+
+def get_connection():
+    conn = database.get_connection(DB_FILE)
+    migrations.migrate(conn, DB_FILE)
+    return conn
+
+
+def is_valid_report(text):
+    """AI 호출 실패 메시지가 아닌 정상 리포트인지 (실패 결과는 캐시하지 않음)"""
+    return bool(text) and "오류" not in text and "제한" not in text
+
+
+def get(cache_key):
+    """로컬 캐시 조회. {'result', 'format', 'source'} 또는 None"""
+    row = get_connection().execute(
+        "SELECT content, format, source FROM ai_report_cache WHERE cache_key = ?", (cache_key,)
+    ).fetchone()
+    if not row:
+        return None
+    return {'result': row['content'], 'format': row['format'], 'source': row['source']}
+
+
+def put(cache_key, filename, content, fmt='markdown', source='ai'):
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO ai_report_cache (cache_key, filename, content, format, source, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (cache_key, filename, content, fmt, source, datetime.now().isoformat())
+        )
+
+
+def remove_for(filename):
+    """결과 파일 삭제 시 해당 리포트 캐시 제거"""
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM ai_report_cache WHERE filename = ?", (filename,))
+
+
+def find_drive_report(filename):
+    """2차 캐시: 드라이브에 저장된 기존 리포트(HTML). 없거나 드라이브 오류면 None"""
+    try:
+        from drive_sync import find_ai_report, get_doc_content
+        existing_report = find_ai_report(os.path.splitext(filename)[0])
+        if existing_report:
+            content = get_doc_content(existing_report['id'])
+            if content and len(content.strip()) > MIN_REPORT_LENGTH:
+                return content
+    except Exception as e:
+        print(f"드라이브 리포트 확인 실패: {e}")
+    return None
+
+
+def lookup(cache_key, filename, use_drive=True):
+    """
+    로컬 캐시 -> (use_drive이면) 드라이브 순으로 기존 리포트를 찾습니다.
+    cache_key가 없으면(데이터를 읽지 못한 경우) 드라이브만 확인하고 로컬에는 저장하지 않습니다.
+    """
+    if cache_key:
+        cached = get(cache_key)
+        if cached:
+            return cached
+    if not use_drive:
+        return None
+    content = find_drive_report(filename)
+    if not content:
+        return None
+    if cache_key:
+        put(cache_key, filename, content, fmt='html', source='drive')
+    return {'result': content, 'format': 'html', 'source': 'drive'}
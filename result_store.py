@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+수집 결과 열 형식(Parquet) 사본
+
+data_collect.py가 결과 엑셀과 함께 같은 이름의 .parquet 사본을 남기고,
+화면/API, AI 분석, 증분 수집 등 내부에서는 엑셀 대신 이 사본을 메모리 맵으로 읽습니다.
+엑셀은 드라이브 업로드와 다운로드용 내보내기 형식으로만 사용합니다.
+사본이 없는 예전 결과는 처음 사용할 때 엑셀에서 한 번 변환해 둡니다.
+읽은 테이블은 파일 수정 시각 기준으로 몇 개만 메모리에 보관합니다.
+"""
+import math
+import os
+import threading
+from collections import OrderedDict
+
+SIDECAR_EXT = '.parquet'
+
+# 메모리에 보관할 결과 테이블 수
+MAX_OPEN_TABLES = 8
+
+# 필터 연산자 (컬럼:연산자:값)
+FILTER_OPS = ('eq', 'ne', 'lt', 'le', 'gt', 'ge', 'contains')
+
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+_convert_lock = threading.Lock()
+
+
+def sidecar_path(result_path):
+    """결과 파일(.xlsx) 경로에 대응하는 열 형식 사본 경로"""
+    return os.path.splitext(result_path)[0] + SIDECAR_EXT
+
+
+def open_table(path):
+    """Parquet 사본을 메모리 맵으로 읽습니다. 파일이 바뀌지 않았으면 이전에 읽은 테이블을 재사용"""
+    import pyarrow.parquet as pq
+
+    mtime = os.path.getmtime(path)
+    with _tables_lock:
+        cached = _tables.get(path)
+        if cached and cached[0] == mtime:
+            _tables.move_to_end(path)
+            return cached[1]
+    table = pq.read_table(path, memory_map=True)
+    with _tables_lock:
+        _tables[path] = (mtime, table)
+        _tables.move_to_end(path)
+        while len(_tables) > MAX_OPEN_TABLES:
+            _tables.popitem(last=False)
+    return table
+
+
+def read_frame(path):
+    """
+    결과 파일을 DataFrame으로 읽습니다. (.parquet 사본, 그 외는 엑셀/CSV)
+    사본의 숫자 컬럼은 float64로 저장되므로 값이 모두 정수인 컬럼은 정수형(Int64)으로 되돌립니다.
+    """
+    import pandas as pd
+
+    lower = path.lower()
+    if lower.endswith('.csv'):
+        return pd.read_csv(path, dtype={'종목코드': str}, encoding='utf-8-sig')
+    if not lower.endswith(SIDECAR_EXT):
+        return pd.read_excel(path, dtype={'종목코드': str})
+
+    df = open_table(path).to_pandas()
+    for column in df.columns:
+        values = df[column]
+        if values.dtype.kind == 'f' and values.notna().any():
+            present = values.dropna()
+            if (present == present.round()).all() and present.abs().max() < 2 ** 53:
+                df[column] = values.astype('Int64')
+    return df
+
+
+def convert_excel(source, path):
+    """
+    엑셀 결과(경로 또는 파일 객체)를 열 형식 사본으로 저장합니다.
+    타입은 ResultWriter와 같게 문자열 컬럼(TEXT_COLUMNS, 문자열 값 컬럼)과 float64로 나눕니다.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from result_writer import TEXT_COLUMNS
+
+    df = pd.read_excel(source, dtype={'종목코드': str})
+    fields, arrays = [], []
+    for column in df.columns:
+        values = df[column]
+        name = str(column)
+        if name in TEXT_COLUMNS or values.dtype == object:
+            fields.append(pa.field(name, pa.string()))
+            arrays.append(pa.array([None if pd.isna(v) else str(v) for v in values], type=pa.string()))
+        else:
+            fields.append(pa.field(name, pa.float64()))
+            arrays.append(pa.array(pd.to_numeric(values, errors='coerce').astype(float), type=pa.float64(), from_pandas=True))
+    table = pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+    with _convert_lock:
+        part_path = path + '.part'
+        pq.write_table(table, part_path)
+        os.replace(part_path, path)
+    return path
+
+
+def export_excel(path):
+    """사본을 다운로드용 엑셀(BytesIO)로 내보냅니다."""
+    import io
+    import pandas as pd
+
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer) as writer:
+        read_frame(path).to_excel(writer, sheet_name='Sheet1', index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def forget(path):
+    """삭제된 사본을 메모리에서도 제거"""
+    with _tables_lock:
+        _tables.pop(path, None)
+
+
+def parse_filter(spec):
+    """'PER:lt:10' -> ('PER', 'lt', '10'). 값에는 ':'가 들어갈 수 있음"""
+    parts = spec.split(':', 2)
+    if len(parts) != 3 or parts[1] not in FILTER_OPS:
+        raise ValueError(f"필터 형식은 컬럼:연산자:값 입니다 (연산자: {', '.join(FILTER_OPS)}): {spec}")
+    return tuple(parts)
+
+
+def _check_column(table, column):
+    if column not in table.column_names:
+        raise ValueError(f"없는 컬럼입니다: {column}")
+
+
+def _filter_mask(table, column, op, value):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    _check_column(table, column)
+    field = table.column(column)
+    if op == 'contains':
+        return pc.match_substring(field.cast(pa.string()), value)
+    if pa.types.is_string(field.type):
+        scalar = pa.scalar(value)
+    else:
+        scalar = pa.scalar(float(value), type=field.type)
+    compare = {'eq': pc.equal, 'ne': pc.not_equal, 'lt': pc.less, 'le': pc.less_equal,
+               'gt': pc.greater, 'ge': pc.greater_equal}[op]
+    return compare(field, scalar)
+
+
+def _json_value(value):
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    return value
+
+
+def query_rows(path, columns=None, filters=None, sort=None, descending=False, offset=0, limit=100):
+    """
+    결과 사본에서 조건에 맞는 행을 조회합니다.
+    - columns: 돌려줄 컬럼 목록 (없으면 전체)
+    - filters: (컬럼, 연산자, 값) 목록, 모두 만족하는 행만 (값이 비어 있는 행은 제외)
+    - sort: 정렬 컬럼 (빈 값은 항상 뒤로), descending: 내림차순 여부
+    반환: {'columns', 'total'(필터 후 전체 행 수), 'offset', 'limit', 'rows'}
+    잘못된 컬럼/연산자/값은 ValueError
+    """
+    import pyarrow.compute as pc
+
+    table = open_table(path)
+    columns = list(columns) if columns else table.column_names
+    for column in columns:
+        _check_column(table, column)
+
+    for column, op, value in filters or []:
+        mask = _filter_mask(table, column, op, value)
+        table = table.filter(pc.fill_null(mask, False))
+
+    total = table.num_rows
+    if sort:
+        _check_column(table, sort)
+        indices = pc.array_sort_indices(table.column(sort).combine_chunks(),
+                                        order='descending' if descending else 'ascending', null_placement='at_end')
+        page = table.take(indices[offset:offset + limit])
+    else:
+        page = table.slice(offset, limit)
+
+    rows = page.select(columns).to_pylist()
+    return {
+        'columns': columns,
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'rows': [{k: _json_value(v) for k, v in row.items()} for row in rows],
+    }
+
+
+def _records(df):
+    df = df.replace([float('inf'), float('-inf')], None)
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def diff_results(old_path, new_path, metrics=None, sort=None, descending=True, offset=0, limit=100):
+    """
+    두 결과 사본을 종목코드로 맞춰 비교합니다.
+    - 순위: 각 결과 안의 행 순서 (시가총액 순), 순위변화 = 이전 순위 - 현재 순위 (양수면 상승)
+    - 지표: 두 결과에 모두 있는 숫자 지표(또는 metrics)의 현재 값, '<지표>_이전', '<지표>_변화'
+    - sort: 비교 행 정렬 컬럼 (기본 현재 순위 오름차순), 빈 값은 뒤로
+    반환: {'metrics', 'total', 'offset', 'limit', 'rows', 'entered', 'exited'}
+    entered/exited는 새로 들어온/빠진 종목 (종목코드, 종목명, 순위)
+    """
+    import pandas as pd
+    from result_writer import TEXT_COLUMNS
+
+    old = open_table(old_path).to_pandas()
+    new = open_table(new_path).to_pandas()
+    for df in (old, new):
+        if '종목코드' not in df.columns:
+            raise ValueError("종목코드 컬럼이 없는 결과입니다.")
+        df['순위'] = range(1, len(df) + 1)
+        df.drop_duplicates('종목코드', keep='first', inplace=True)
+        df.set_index('종목코드', inplace=True)
+
+    numeric = [c for c in new.columns if c in old.columns and c != '순위' and c not in TEXT_COLUMNS
+               and pd.api.types.is_numeric_dtype(new[c]) and pd.api.types.is_numeric_dtype(old[c])]
+    if metrics:
+        unknown = [m for m in metrics if m not in numeric]
+        if unknown:
+            raise ValueError(f"두 결과에 모두 있는 숫자 지표가 아닙니다: {', '.join(unknown)}")
+        numeric = list(metrics)
+
+    def listed(frame):
+        columns = [c for c in ('종목명', '순위') if c in frame.columns]
+        return _records(frame[columns].reset_index())
+
+    entered = new.loc[new.index.difference(old.index, sort=False)].sort_values('순위')
+    exited = old.loc[old.index.difference(new.index, sort=False)].sort_values('순위')
+
+    joined = new.join(old[numeric + ['순위']], how='inner', rsuffix='_이전')
+    joined['순위변화'] = joined['순위_이전'] - joined['순위']
+    for metric in numeric:
+        joined[f'{metric}_변화'] = (joined[metric] - joined[f'{metric}_이전']).round(4)
+
+    columns = [c for c in ('종목명',) if c in joined.columns] + ['순위', '순위_이전', '순위변화']
+    for metric in numeric:
+        columns += [metric, f'{metric}_이전', f'{metric}_변화']
+    joined = joined[columns]
+
+    if sort:
+        if sort not in joined.columns:
+            raise ValueError(f"없는 컬럼입니다: {sort}")
+        joined = joined.sort_values(sort, ascending=not descending, na_position='last', kind='stable')
+    else:
+        joined = joined.sort_values('순위', kind='stable')
+
+    return {
+        'metrics': numeric,
+        'total': len(joined),
+        'offset': offset,
+        'limit': limit,
+        'rows': _records(joined.iloc[offset:offset + limit].reset_index()),
+        'entered': listed(entered),
+        'exited': listed(exited),
+    }
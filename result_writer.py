@@ -0,0 +1,277 @@
+import os
+import csv
+import json
+import math
+
+from collect_fields import with_derived_inputs
+
+# 문자열로 저장할 컬럼 (나머지는 숫자형으로 저장)
+TEXT_COLUMNS = {'종목코드', '종목명', '데이터기준', '회계감사의견', '내부통제의견', '업종'}
+
+# 기록 중인 파일 접미사 (close() 전까지)
+PART_EXT = '.part'
+
+# Parquet 파일에 한 번에 기록할 행 수
+PARQUET_BATCH_SIZE = 500
+
+# 보유 종목 분석에서만 붙는 필드
+MY_STOCK_FIELDS = ['현재가', '매입단가', '보유수량', '평가손익', '수익률(%)']
+
+
+def _cell_value(value):
+    """numpy 스칼라/NaN 등을 엑셀·CSV에 쓸 수 있는 기본 타입으로 변환"""
+    if value is None:
+        return None
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    return value
+
+
+def _to_float(value):
+    value = _cell_value(value)
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ResultWriter:
+    """
+    수집 결과를 종목이 완료되는 대로 디스크에 기록하는 스트리밍 저장기
+    - 엑셀: xlsxwriter constant_memory 모드 (없으면 openpyxl write_only 모드)
+    - 추가 형식: 'csv', 'parquet' (Parquet은 pyarrow 필요, 컬럼 타입 지정)
+    - add(index, row)로 순서 번호와 함께 넘기면 원래 종목 순서대로 기록
+    - columns: 컬럼 목록 또는 첫 행을 받아 컬럼 목록을 돌려주는 함수 (없으면 첫 행의 키 순서)
+    - 모든 파일은 '.part' 임시 파일에 기록 후 close() 시점에 최종 경로로 교체
+    """
+
+    def __init__(self, output_file, formats=None, columns=None):
+        self.output_file = output_file
+        self.formats = [f.strip().lower() for f in (formats or []) if f and f.strip().lower() in ('csv', 'parquet')]
+        self.columns = columns
+        self.row_count = 0
+        self._opened = False
+        self._next_index = 0
+        self._pending = {}
+        self._files = {}
+
+    def _path(self, ext):
+        return self.output_file if ext == 'xlsx' else os.path.splitext(self.output_file)[0] + '.' + ext
+
+    def _open(self, first_row=None):
+        if callable(self.columns):
+            self.columns = self.columns(first_row or {})
+        elif self.columns is None:
+            self.columns = list(first_row.keys()) if first_row else []
+        self.columns = list(self.columns)
+        self._opened = True
+
+        xlsx_part = self._path('xlsx') + PART_EXT
+        try:
+            import xlsxwriter
+            self._workbook = xlsxwriter.Workbook(xlsx_part, {'constant_memory': True})
+            self._sheet = self._workbook.add_worksheet('Sheet1')
+            self._sheet.write_row(0, 0, self.columns, self._workbook.add_format({'bold': True, 'border': 1, 'align': 'center'}))
+            self._engine = 'xlsxwriter'
+        except ImportError:
+            from openpyxl import Workbook
+            self._workbook = Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet('Sheet1')
+            self._sheet.append(self.columns)
+            self._engine = 'openpyxl'
+        self._files['xlsx'] = xlsx_part
+
+        if 'csv' in self.formats:
+            csv_part = self._path('csv') + PART_EXT
+            # 엑셀에서 한글이 깨지지 않도록 BOM 포함
+            self._csv_fp = open(csv_part, 'w', encoding='utf-8-sig', newline='')
+            self._csv = csv.writer(self._csv_fp)
+            self._csv.writerow(self.columns)
+            self._files['csv'] = csv_part
+
+        if 'parquet' in self.formats:
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                text_cols = TEXT_COLUMNS | {c for c in self.columns if isinstance((first_row or {}).get(c), str)}
+                self._schema = pa.schema([(c, pa.string() if c in text_cols else pa.float64()) for c in self.columns])
+                parquet_part = self._path('parquet') + PART_EXT
+                self._parquet = pq.ParquetWriter(parquet_part, self._schema)
+                self._parquet_rows = []
+                self._files['parquet'] = parquet_part
+            except ImportError:
+                print("pyarrow가 설치되어 있지 않아 Parquet 파일은 생성하지 않습니다.")
+
+    def _flush_parquet(self):
+        if not self._parquet_rows:
+            return
+        import pyarrow as pa
+        arrays = []
+        for i, field in enumerate(self._schema):
+            if field.type == pa.string():
+                values = [None if r[i] is None else str(r[i]) for r in self._parquet_rows]
+            else:
+                values = [_to_float(r[i]) for r in self._parquet_rows]
+            arrays.append(pa.array(values, type=field.type))
+        self._parquet.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+        self._parquet_rows = []
+
+    def write(self, row):
+        """행 하나를 즉시 기록"""
+        if not self._opened:
+            self._open(row)
+        values = [_cell_value(row.get(c)) for c in self.columns]
+        self.row_count += 1
+
+        if self._engine == 'xlsxwriter':
+            self._sheet.write_row(self.row_count, 0, values)
+        else:
+            self._sheet.append(values)
+
+        if 'csv' in self._files:
+            self._csv.writerow(['' if v is None else v for v in values])
+            self._csv_fp.flush()
+
+        if 'parquet' in self._files:
+            self._parquet_rows.append(values)
+            if len(self._parquet_rows) >= PARQUET_BATCH_SIZE:
+                self._flush_parquet()
+
+    def add(self, index, row):
+        """index 순서대로 기록. 실패한 종목은 row=None으로 넘겨 순서를 건너뜀"""
+        self._pending[index] = row
+        while self._next_index in self._pending:
+            ready = self._pending.pop(self._next_index)
+            self._next_index += 1
+            if ready:
+                self.write(ready)
+
+    def close(self):
+        """남은 행(중간에 빠진 종목 이후의 행)을 순서대로 기록하고 파일을 완성"""
+        for index in sorted(self._pending):
+            if self._pending[index]:
+                self.write(self._pending[index])
+        self._pending = {}
+        if not self._opened:
+            self._open()
+
+        if self._engine == 'xlsxwriter':
+            self._workbook.close()
+        else:
+            self._workbook.save(self._files['xlsx'])
+        if 'csv' in self._files:
+            self._csv_fp.close()
+        if 'parquet' in self._files:
+            self._flush_parquet()
+            self._parquet.close()
+
+        for ext, part_path in self._files.items():
+            os.replace(part_path, self._path(ext))
+        return self.row_count
+
+
+def remove_part_files(output_file):
+    """close()되지 못한 수집(취소/오류)이 남긴 임시 파일 삭제. 삭제한 경로 목록 반환"""
+    writer = ResultWriter(output_file)
+    removed = []
+    for ext in ('xlsx', 'csv', 'parquet'):
+        path = writer._path(ext) + PART_EXT
+        if os.path.exists(path):
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+
+# 실행 저널: 종목이 끝날 때마다 {'ticker', 'index'(수집 계획 순서), 'row'}를 한 줄씩 기록 (jsonl)
+# 수집 프로세스(data_collect.py)가 기록하고, 중단된 수집은 웹 서버가 이 저널로 부분 결과를 만듭니다.
+
+def _json_default(obj):
+    """numpy 스칼라(int64 등)를 JSON 직렬화 가능한 값으로 변환합니다."""
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return str(obj)
+
+
+def _read_journal(journal_path):
+    """저널 항목 목록 (같은 종목은 마지막 항목만)"""
+    entries = {}
+    if not journal_path or not os.path.exists(journal_path):
+        return []
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 강제 종료 시점에 잘린 마지막 줄은 무시
+                continue
+            if entry.get('ticker') and entry.get('row'):
+                entries[entry['ticker']] = entry
+    return list(entries.values())
+
+
+def load_run_journal(journal_path):
+    """실행 저널에서 이미 완료된 종목 결과를 읽어옵니다. (종목코드 -> 결과 dict)"""
+    return {entry['ticker']: entry['row'] for entry in _read_journal(journal_path)}
+
+
+def append_run_journal(journal_file, ticker, row, index=None):
+    """완료된 종목 결과를 수집 계획 순서(index)와 함께 저널에 한 줄 추가하고 디스크에 즉시 기록합니다."""
+    entry = {'ticker': ticker, 'index': index, 'row': row}
+    journal_file.write(json.dumps(entry, ensure_ascii=False, default=_json_default) + '\n')
+    journal_file.flush()
+    os.fsync(journal_file.fileno())
+
+
+def result_columns(first_row, selected_fields=None, has_my_fields=False):
+    """결과 파일의 컬럼 순서를 정합니다. (첫 행의 키 + 선택 필드 + 내 종목 필드)"""
+    if not selected_fields:
+        columns = list(first_row.keys())
+        if has_my_fields:
+            columns += [f for f in MY_STOCK_FIELDS if f not in columns]
+        return columns
+
+    selected_fields = list(selected_fields)
+    # 내 종목 분석인 경우 필수 필드 추가
+    if has_my_fields:
+        for f in MY_STOCK_FIELDS:
+            if f not in selected_fields:
+                selected_fields.insert(2, f)  # 종목명 뒤에 삽입
+
+    # 전년 동기 데이터가 컬럼에 있다면 자동으로 선택 필드에 추가
+    yoy_fields = ['전년동기매출액', '매출액증가율(%)', '전년동기영업이익', '영업이익증가율(%)', '전년동기순이익', '순이익증가율(%)']
+    for f in yoy_fields:
+        if f in first_row and f not in selected_fields:
+            selected_fields.append(f)
+
+    # 파생 지표(EV/EBITDA 등)를 골랐다면 계산에 쓴 컬럼도 포함 (증분 수집 시 재계산에 사용)
+    selected_fields = with_derived_inputs(selected_fields)
+
+    return [f for f in selected_fields if f in first_row or (has_my_fields and f in MY_STOCK_FIELDS)]
+
+
+def write_result_file(results, selected_fields, output_file, formats=None):
+    """수집 결과 리스트를 선택된 필드 기준으로 엑셀(및 CSV/Parquet) 파일에 저장합니다. 저장된 행 수를 반환합니다."""
+    has_my_fields = any('현재가' in r for r in results)
+    writer = ResultWriter(output_file, formats, lambda row: result_columns(row, selected_fields, has_my_fields))
+    for r in results:
+        writer.write(r)
+    return writer.close()
+
+
+def write_result_from_journal(journal_path, output_file, selected_fields=None, formats=None):
+    """
+    중단된 실행의 저널로부터 부분 결과 파일을 만듭니다. 저장된 종목 수를 반환합니다.
+    행은 완료 순서가 아니라 수집 계획 순서(시가총액 순)로 기록 (순서 번호가 없는 예전 저널 항목은 뒤에 기록 순서대로)
+    """
+    entries = _read_journal(journal_path)
+    if not entries:
+        return 0
+    entries.sort(key=lambda e: (e.get('index') is None, e.get('index') or 0))
+    return write_result_file([e['row'] for e in entries], selected_fields, output_file, formats)
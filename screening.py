@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+종목 스크리닝 엔진
+
+지표 시계열 저장소의 최신 전 종목 단면(fundamentals_store.latest_snapshot)에
+조건식/정렬식을 컬럼 단위(벡터)로 한 번에 계산해 적용합니다. 수집이나 파일 읽기는 하지 않습니다.
+
+식 문법 (파이썬 식의 일부만 허용)
+- 지표 이름: PER, ROE, 업종평균PER ... 괄호·공백·% 등이 들어간 이름은 `ROE(%)`처럼 백틱으로 감쌉니다.
+- 비교: < <= > >= == != (0 < PER < 10 처럼 이어 쓰기 가능), 산술: + - * / ** % (** 지수는 절댓값 10 이하의 숫자만)
+- 논리: and, or, not (& | ~ 도 가능)
+- 함수: abs(x), isnull(x), notnull(x)
+값이 비어 있는 종목은 비교 결과가 거짓이 되어 조건에서 빠지고, 정렬 시에는 항상 뒤로 갑니다.
+문법 검사와 컴파일은 식 문자열별로 한 번만 하고 결과를 재사용합니다.
+"""
+import ast
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import fundamentals_store
+
+# 컴파일해 두는 식 개수
+EXPRESSION_CACHE_SIZE = 256
+
+# 식 최대 길이, ** 지수 최대 절댓값 (거대한 거듭제곱 계산으로 요청 스레드가 멈추지 않게)
+MAX_EXPRESSION_LENGTH = 500
+MAX_EXPONENT = 10
+
+BACKTICK_PATTERN = re.compile(r'`([^`]+)`')
+
+FUNCTIONS = {
+    'abs': np.abs,
+    'isnull': pd.isna,
+    'notnull': pd.notna,
+}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load, ast.Constant,
+    ast.And, ast.Or, ast.Not, ast.Invert, ast.USub, ast.UAdd,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.BitAnd, ast.BitOr,
+    ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq,
+)
+
+
+class ExpressionError(ValueError):
+    """잘못된 스크리닝 식"""
+    pass
+
+
+def _small_exponent(node):
+    """** 지수로 허용하는 값: 절댓값 MAX_EXPONENT 이하의 숫자 상수 (부호 포함)"""
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        node = node.operand
+    return (isinstance(node, ast.Constant) and isinstance(node.value, (int, float))
+            and not isinstance(node.value, bool) and abs(node.value) <= MAX_EXPONENT)
+
+
+class _Vectorize(ast.NodeTransformer):
+    """
+    and/or/not과 이어 쓴 비교를 컬럼 단위 연산(& | ~)으로 바꿈
+    정수 상수는 실수로 바꿔 상수끼리의 계산도 큰 정수 대신 실수 범위(넘치면 오류)에서 끝나게 함
+    """
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, int) and not isinstance(node.value, bool):
+            return ast.copy_location(ast.Constant(value=float(node.value)), node)
+        return node
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = ast.BinOp(left=result, op=op, right=value)
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(op=ast.Invert(), operand=node.operand)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        parts = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            parts.append(ast.Compare(left=left, ops=[op], comparators=[right]))
+            left = right
+        result = parts[0]
+        for part in parts[1:]:
+            result = ast.BinOp(left=result, op=ast.BitAnd(), right=part)
+        return result
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_expression(text):
+    """
+    식을 검사·컴파일합니다. 반환: (코드 객체, {식 안의 이름: 지표 이름})
+    허용되지 않는 문법이면 ExpressionError
+    """
+    names = {}
+
+    def quote(match):
+        alias = f'_c{len(names)}'
+        names[alias] = match.group(1)
+        return alias
+
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionError(f"식은 {MAX_EXPRESSION_LENGTH}자까지 입력할 수 있습니다.")
+    source = BACKTICK_PATTERN.sub(quote, text.strip())
+    if not source:
+        raise ExpressionError("식이 비어 있습니다.")
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError as e:
+        raise ExpressionError(f"식 문법 오류: {text} ({e.msg})")
+
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ExpressionError(f"사용할 수 없는 문법입니다: {type(node).__name__}")
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow) and not _small_exponent(node.right):
+            raise ExpressionError(f"** 지수는 절댓값 {MAX_EXPONENT} 이하의 숫자만 사용할 수 있습니다.")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+                raise ExpressionError(f"사용할 수 있는 함수: {', '.join(FUNCTIONS)}")
+        elif isinstance(node, ast.Name) and node.id not in FUNCTIONS and node.id not in names:
+            names[node.id] = node.id
+        elif isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, str)):
+            raise ExpressionError(f"사용할 수 없는 값입니다: {node.value!r}")
+
+    tree = ast.fix_missing_locations(_Vectorize().visit(tree))
+    return compile(tree, '<screen>', 'eval'), names
+
+
+def evaluate(frame, text):
+    """DataFrame의 컬럼으로 식을 계산한 Series (index는 frame과 같음)"""
+    code, names = compile_expression(text)
+    missing = [metric for metric in names.values() if metric not in frame.columns]
+    if missing:
+        raise ExpressionError(f"없는 지표입니다: {', '.join(missing)}")
+    namespace = dict(FUNCTIONS)
+    namespace.update({alias: frame[metric] for alias, metric in names.items()})
+    try:
+        with np.errstate(all='ignore'):
+            result = eval(code, {'__builtins__': {}}, namespace)
+    except TypeError as e:
+        raise ExpressionError(f"식을 계산할 수 없습니다 (문자열 지표와 숫자 연산 등): {e}")
+    except (OverflowError, ZeroDivisionError) as e:
+        raise ExpressionError(f"식을 계산할 수 없습니다: {e}")
+    if not isinstance(result, pd.Series):
+        result = pd.Series(result, index=frame.index)
+    return result
+
+
+def screen(where=None, sort=None, descending=True, columns=None, limit=50, offset=0, snapshot=None):
+    """
+    최신 단면에서 조건식(where)을 만족하는 종목을 정렬식(sort) 순서로 반환합니다.
+    반환: (전체 일치 종목 수, index=종목코드인 DataFrame 한 페이지)
+    columns가 없으면 식에 쓰인 지표와 종목명/기준일만 포함
+    저장소 단면을 쓸 때는 포함된 지표마다 그 값의 기준일 컬럼('<지표> 기준일')을 바로 뒤에 붙입니다.
+    """
+    if snapshot is None:
+        frame, dates = fundamentals_store.latest_snapshot(with_dates=True)
+    else:
+        frame, dates = snapshot, None
+    if frame.empty:
+        return 0, frame
+
+    used = []
+    if where:
+        mask = evaluate(frame, where)
+        if not pd.api.types.is_bool_dtype(mask.dtype):
+            raise ExpressionError(f"조건식은 참/거짓이어야 합니다: {where}")
+        frame = frame[mask.fillna(False).astype(bool).to_numpy()]
+        used += compile_expression(where)[1].values()
+
+    if sort:
+        key = pd.to_numeric(evaluate(frame, sort), errors='coerce').replace([np.inf, -np.inf], np.nan)
+        order = key.sort_values(ascending=not descending, na_position='last', kind='stable').index
+        frame = frame.loc[order].assign(**{'정렬값': key.loc[order].round(4)})
+        used += list(compile_expression(sort)[1].values()) + ['정렬값']
+
+    if columns:
+        missing = [c for c in columns if c not in frame.columns]
+        if missing:
+            raise ExpressionError(f"없는 지표입니다: {', '.join(missing)}")
+    else:
+        base = [c for c in ('종목명', fundamentals_store.AS_OF_COLUMN) if c in frame.columns]
+        columns = list(dict.fromkeys(base + used))
+    page = frame.iloc[offset:offset + limit][columns]
+    if dates is not None:
+        page = _with_metric_dates(page, dates)
+    return len(frame), page
+
+
+def _with_metric_dates(page, dates):
+    """지표 컬럼마다 바로 뒤에 그 값의 기준일 컬럼을 붙임 (종목마다 지표별 최신 수집일이 다를 수 있음)"""
+    parts = {}
+    for column in page.columns:
+        parts[column] = page[column]
+        if column in dates.columns and column != '종목명':
+            parts[f"{column}{fundamentals_store.METRIC_AS_OF_SUFFIX}"] = dates.loc[page.index, column]
+    return pd.DataFrame(parts, index=page.index)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+종목 검색 인덱스 (메모리)
+
+stocks_master를 한 번 읽어 아래 색인을 만들고, 자동완성 요청은 DB 없이 처리합니다.
+- 종목명 n-gram(1~3글자) 포스팅: 부분 일치 후보를 교집합으로 좁힌 뒤 확인
+- 초성 인덱스: 'ㅅㅅㅈㅈ' -> 삼성전자 (초성 문자열에 같은 n-gram 색인 적용)
+- 종목코드 접두어: 정렬된 코드 목록에서 이분 탐색
+결과는 일치 정도(정확 > 접두어 > 부분) 다음 시가총액 순위로 정렬합니다.
+종목 마스터가 바뀌면 rebuild_index()로 새 인덱스를 만들어 통째로 교체합니다.
+"""
+import bisect
+import threading
+
+import database
+
+# 한글 음절의 초성 (유니코드 순서)
+CHOSEONG = 'ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ'
+HANGUL_BASE = 0xAC00
+HANGUL_LAST = 0xD7A3
+JAMO_PER_CHOSEONG = 21 * 28
+
+MAX_GRAM = 3
+
+
+def to_choseong(text):
+    """한글 음절은 초성으로, 나머지 글자는 그대로 바꾼 문자열"""
+    chars = []
+    for ch in text:
+        code = ord(ch)
+        if HANGUL_BASE <= code <= HANGUL_LAST:
+            chars.append(CHOSEONG[(code - HANGUL_BASE) // JAMO_PER_CHOSEONG])
+        else:
+            chars.append(ch)
+    return ''.join(chars)
+
+
+def is_choseong_query(query):
+    """초성이 섞인 검색어인지 ('ㅅㅅㅈㅈ', '삼성ㅈㅈ')"""
+    return any(ch in CHOSEONG for ch in query)
+
+
+def _normalize(text):
+    return ''.join(text.split()).lower()
+
+
+def _grams(text):
+    """1~MAX_GRAM 글자 n-gram 집합"""
+    grams = set()
+    for n in range(1, MAX_GRAM + 1):
+        for i in range(len(text) - n + 1):
+            grams.add(text[i:i + n])
+    return grams
+
+
+class _GramIndex:
+    """문자열 목록에 대한 n-gram 포스팅 (부분 문자열 검색용)"""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.postings = {}
+        for doc_id, text in enumerate(texts):
+            for gram in _grams(text):
+                self.postings.setdefault(gram, set()).add(doc_id)
+
+    def find(self, query):
+        """query를 포함하는 문서 id 집합"""
+        if len(query) <= MAX_GRAM:
+            return self.postings.get(query, set())
+        # 겹치는 MAX_GRAM 조각들의 교집합 후 실제 포함 여부 확인
+        parts = sorted((self.postings.get(query[i:i + MAX_GRAM], set())
+                        for i in range(len(query) - MAX_GRAM + 1)), key=len)
+        candidates = set(parts[0])
+        for part in parts[1:]:
+            candidates &= part
+            if not candidates:
+                break
+        return {d for d in candidates if query in self.texts[d]}
+
+
+class StockSearchIndex:
+    """rows: (code, name, market) 목록, 시가총액 순위 순서"""
+
+    def __init__(self, rows):
+        self.stocks = [{'code': code, 'name': name, 'market': market} for code, name, market in rows]
+        names = [_normalize(s['name'] or '') for s in self.stocks]
+        self.names = names
+        self.name_index = _GramIndex(names)
+        self.choseong_index = _GramIndex([to_choseong(n) for n in names])
+        self.codes = sorted((s['code'], i) for i, s in enumerate(self.stocks))
+
+    def __len__(self):
+        return len(self.stocks)
+
+    def _code_prefix(self, prefix):
+        start = bisect.bisect_left(self.codes, (prefix,))
+        ids = []
+        for code, doc_id in self.codes[start:]:
+            if not code.startswith(prefix):
+                break
+            ids.append(doc_id)
+        return ids
+
+    def search(self, query, limit=10):
+        query = _normalize(query)
+        if not query:
+            return []
+        scored = {}
+
+        def add(doc_ids, text_of, q, base):
+            for d in doc_ids:
+                text = text_of(d)
+                score = base + (0 if text == q else 1 if text.startswith(q) else 2)
+                if d not in scored or score < scored[d]:
+                    scored[d] = score
+
+        if query.isdigit():
+            add(self._code_prefix(query), lambda d: self.stocks[d]['code'], query, 0)
+        add(self.name_index.find(query), lambda d: self.names[d], query, 0)
+        if is_choseong_query(query):
+            q = to_choseong(query)
+            add(self.choseong_index.find(q), lambda d: self.choseong_index.texts[d], q, 3)
+
+        # 점수가 같으면 시가총액 순위(원래 순서) 우선
+        ranked = sorted(scored, key=lambda d: (scored[d], d))[:limit]
+        return [{'code': self.stocks[d]['code'], 'name': self.stocks[d]['name']} for d in ranked]
+
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def load_rows(db_file):
+    """stocks_master를 시가총액 순위 순서로 읽습니다. (순위가 없는 종목은 저장된 순서로 뒤에)"""
+    conn = database.get_connection(db_file)
+    return conn.execute("SELECT code, name, market FROM stocks_master ORDER BY cap_rank IS NULL, cap_rank, rowid").fetchall()
+
+
+def rebuild_index(db_file, only_if_missing=False):
+    """
+    종목 마스터로 새 인덱스를 만들어 교체합니다. 검색 중인 요청은 이전 인덱스를 그대로 사용
+    only_if_missing이면 다른 스레드가 먼저 만든 인덱스가 있을 때 그대로 사용
+    """
+    global _index
+    with _build_lock:
+        if only_if_missing and _index is not None and len(_index):
+            return _index
+        index = StockSearchIndex(load_rows(db_file))
+        _index = index
+    print(f"종목 검색 인덱스 생성: {len(index)}개 종목")
+    return index
+
+
+def search(db_file, query, limit=10):
+    index = _index
+    if index is None or not len(index):
+        index = rebuild_index(db_file, only_if_missing=True)
+    return index.search(query, limit)
+
+
+def on_master_change(db_file):
+    """master_refresh 변경 알림용 콜백. 종목 구성·이름·순위가 바뀐 경우에만 다시 만듦"""
+    def handle(changes):
+        if changes['added'] or changes['renamed'] or changes['delisted'] or changes['cap_changed']:
+            rebuild_index(db_file)
+    return handle
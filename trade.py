@@ -8,9 +8,10 @@ if os.name == 'nt':
     sys.stdout.reconfigure(encoding='utf-8')
     sys.stderr.reconfigure(encoding='utf-8')
 
-from flask import Flask, render_template, jsonify, send_file, request, g
+from flask import Flask, render_template, jsonify, send_file, request, g, Response, stream_with_context
 import threading
 import uuid
+import time
 from datetime import datetime
 import subprocess
 import json
@@ -19,9 +20,23 @@ import sqlite3
 import requests
 from bs4 import BeautifulSoup
 import re
+import base64
 from concurrent.futures import ThreadPoolExecutor
-from ai_analysis import analyze_stock_data, analyze_portfolio
+from ai_analysis import analyze_stock_data, analyze_portfolio, load_stock_summary, stock_report_key
 from get_all_naver_data import get_all_naver_data
+from naver_extract import NaverMainPage
+from indicators import get_indicators, empty_indicators
+from history_store import get_investor_flows
+from collect_fields import FIELD_GROUPS, SOURCE_LABELS, DART_ONLY_FIELDS
+import database
+import migrations
+import search_index
+import master_refresh
+import history_store
+import result_store
+import fundamentals_store
+import screening
+import report_cache
 
 app = Flask(__name__)
 
@@ -33,183 +48,103 @@ RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
 if not os.path.exists(RESULTS_DIR):
     os.makedirs(RESULTS_DIR)
 
+# 수집 실행 저널 디렉토리 (중단된 수집 이어하기용)
+JOURNAL_DIR = os.path.join(RESULTS_DIR, 'journals')
+if not os.path.exists(JOURNAL_DIR):
+    os.makedirs(JOURNAL_DIR)
+
 # 데이터베이스 파일
-DB_FILE = os.path.join(os.path.dirname(__file__), 'trade.db')
+DB_FILE = database.DB_FILE
 
 def get_db():
-    """요청별 DB 연결 관리"""
+    """요청별 DB 연결 (스레드별 재사용 연결, WAL)"""
     if 'db' not in g:
-        g.db = sqlite3.connect(DB_FILE)
-        g.db.row_factory = sqlite3.Row
+        g.db = database.get_connection(DB_FILE)
     return g.db
 
 @app.teardown_appcontext
 def close_db(e=None):
-    """요청 종료 시 DB 연결 닫기"""
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
-
-def init_db():
-    """데이터베이스 초기화 및 테이블 생성"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # 내 종목 테이블
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS my_stocks (
-            code TEXT PRIMARY KEY,
-            name TEXT,
-            added_at TEXT,
-            purchase_price REAL DEFAULT 0,
-            quantity INTEGER DEFAULT 0
-        )
-    ''')
-    
-    # 기존 테이블에 컬럼이 없는 경우 추가 (스키마 업데이트)
-    try:
-        cursor.execute("ALTER TABLE my_stocks ADD COLUMN purchase_price REAL DEFAULT 0")
-    except sqlite3.OperationalError:
-        pass # 이미 존재함
-        
-    try:
-        cursor.execute("ALTER TABLE my_stocks ADD COLUMN quantity INTEGER DEFAULT 0")
-    except sqlite3.OperationalError:
-        pass # 이미 존재함
-    
-    # 분석 결과 테이블
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS analysis_results (
-            filename TEXT PRIMARY KEY,
-            market TEXT,
-            stock_count TEXT,
-            created_at TEXT,
-            size INTEGER,
-            spreadsheet_id TEXT,
-            drive_link TEXT,
-            ai_result TEXT
-        )
-    ''')
-    
-    # 종목 마스터 테이블 (검색용)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS stocks_master (
-            code TEXT PRIMARY KEY,
-            name TEXT,
-            market TEXT
-        )
-    ''')
-    # 포트폴리오 AI 분석 캐시 테이블
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS portfolio_ai_cache (
-            cache_key TEXT PRIMARY KEY,
-            ai_result TEXT,
-            created_at TEXT
-        )
-    ''')
-    
-    conn.commit()
-    
-    # 기존 JSON 데이터 마이그레이션 (한 번만 실행)
-    json_file = os.path.join(os.path.dirname(__file__), 'my_stocks.json')
-    if os.path.exists(json_file):
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                stocks = json.load(f)
-                for s in stocks:
-                    cursor.execute(
-                        "INSERT OR IGNORE INTO my_stocks (code, name, added_at) VALUES (?, ?, ?)",
-                        (s['code'], s.get('name', ''), s.get('added_at', datetime.now().isoformat()))
-                    )
-            conn.commit()
-            os.rename(json_file, json_file + '.bak')
-            print("JSON 데이터를 SQLite로 마이그레이션 완료했습니다.")
-        except Exception as e:
-            print(f"마이그레이션 중 오류: {e}")
+    """요청 종료 시 남은 트랜잭션 정리 (연결은 스레드에서 계속 재사용)"""
+    database.release(g.pop('db', None))
 
-    # 기존 분석 결과 파일들 마이그레이션
+def import_result_metadata(conn, force=False):
+    """
+    결과 폴더의 메타데이터(.json, 드라이브 동기화로 생성)를 analysis_results에 등록합니다.
+    마지막 확인 이후 폴더가 바뀌지 않았으면 폴더를 읽지 않고, 바뀌었으면 그 이후 수정된 파일만 확인합니다.
+    """
     try:
-        for filename in os.listdir(RESULTS_DIR):
-            if filename.endswith('.json') and not filename.endswith('_ai.json') and not filename.endswith('.bak'):
-                xlsx_name = filename.replace('.json', '.xlsx')
-                json_path = os.path.join(RESULTS_DIR, filename)
-                
-                # 이미 DB에 있는지 확인
-                cursor.execute("SELECT filename FROM analysis_results WHERE filename = ?", (xlsx_name,))
-                if not cursor.fetchone():
-                    try:
-                        with open(json_path, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            
-                            # 파일명 파싱
-                            parts = xlsx_name.replace('.xlsx', '').split('_')
-                            market_val = parts[0].upper() if len(parts) > 0 else 'UNKNOWN'
-                            count_val = parts[1] if len(parts) > 1 else '0'
-                            
-                            cursor.execute('''
-                                INSERT OR IGNORE INTO analysis_results 
-                                (filename, market, stock_count, created_at, size, spreadsheet_id, drive_link)
-                                VALUES (?, ?, ?, ?, ?, ?, ?)
-                            ''', (
-                                xlsx_name,
-                                market_val,
-                                count_val,
-                                data.get('created_at', datetime.now().isoformat()),
-                                data.get('size', 0),
-                                data.get('spreadsheet_id'),
-                                data.get('drive_link')
-                            ))
-                    except Exception as e:
-                        print(f"파일 마이그레이션 중 오류 ({filename}): {e}")
+        last_scan = float(migrations.get_state(conn, 'results_scan_mtime', 0))
+        dir_mtime = os.stat(RESULTS_DIR).st_mtime
+        if not force and dir_mtime <= last_scan:
+            return 0
+
+        known = {row[0] for row in conn.execute("SELECT filename FROM analysis_results")}
+        newest = dir_mtime
+        imported = 0
+        for entry in os.scandir(RESULTS_DIR):
+            filename = entry.name
+            if not entry.is_file() or not filename.endswith('.json') or filename.endswith('_ai.json'):
+                continue
+            mtime = entry.stat().st_mtime
+            newest = max(newest, mtime)
+            xlsx_name = filename.replace('.json', '.xlsx')
+            if xlsx_name in known or (not force and mtime <= last_scan):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+
+                # 파일명 파싱
+                parts = xlsx_name.replace('.xlsx', '').split('_')
+                market_val = parts[0].upper() if len(parts) > 0 else 'UNKNOWN'
+                count_val = parts[1] if len(parts) > 1 else '0'
+
+                conn.execute('''
+                    INSERT OR IGNORE INTO analysis_results
+                    (filename, market, stock_count, created_at, size, spreadsheet_id, drive_link)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    xlsx_name,
+                    market_val,
+                    count_val,
+                    data.get('created_at', datetime.now().isoformat()),
+                    data.get('size', 0),
+                    data.get('spreadsheet_id'),
+                    data.get('drive_link')
+                ))
+                imported += 1
+            except Exception as e:
+                print(f"파일 마이그레이션 중 오류 ({filename}): {e}")
+        migrations.set_state(conn, 'results_scan_mtime', newest)
         conn.commit()
+        return imported
     except Exception as e:
-        print(f"결과 목록 마이그레이션 중 오류: {e}")
-            
+        conn.rollback()
+        print(f"결과 목록 가져오기 중 오류: {e}")
+        return 0
+
+def init_db():
+    """DB 스키마를 최신 버전으로 맞추고 시작 시 필요한 작업 실행 (이미 최신이면 조회 몇 번으로 끝남)"""
+    conn = database.get_connection(DB_FILE)
+    migrations.migrate(conn, DB_FILE)
+
+    # 드라이브 동기화 등으로 새로 생긴 결과 메타데이터만 등록
+    import_result_metadata(conn)
+
     # 종목 마스터가 비어있으면 업데이트 트리거
-    cursor.execute("SELECT COUNT(*) FROM stocks_master")
-    if cursor.fetchone()[0] == 0:
+    if conn.execute("SELECT 1 FROM stocks_master LIMIT 1").fetchone() is None:
         print("종목 마스터가 비어있습니다. 백그라운드 업데이트를 시작합니다...")
-        def background_update():
-            try:
-                import requests
-                from bs4 import BeautifulSoup
-                import sqlite3 as sqlite
-                
-                all_stocks = []
-                session = requests.Session()
-                for sosok in [0, 1]:
-                    market_name = 'KOSPI' if sosok == 0 else 'KOSDAQ'
-                    page = 1
-                    while True:
-                        url = f"https://finance.naver.com/sise/sise_market_sum.naver?sosok={sosok}&page={page}"
-                        res = session.get(url)
-                        soup = BeautifulSoup(res.text, 'html.parser')
-                        table = soup.find('table', {'class': 'type_2'})
-                        if not table: break
-                        
-                        found = False
-                        for a in table.find_all('a', {'class': 'tltle'}):
-                            code = a.get('href').split('code=')[1]
-                            name = a.text.strip()
-                            all_stocks.append((code, name, market_name))
-                            found = True
-                        
-                        if not found or page > 40: break
-                        page += 1
-                
-                if all_stocks:
-                    conn_bg = sqlite.connect(DB_FILE)
-                    cursor_bg = conn_bg.cursor()
-                    cursor_bg.executemany("INSERT OR REPLACE INTO stocks_master (code, name, market) VALUES (?, ?, ?)", all_stocks)
-                    conn_bg.commit()
-                    conn_bg.close()
-                    print(f"종목 마스터 초기 업데이트 완료: {len(all_stocks)}개 종목")
-            except Exception as e:
-                print(f"초기 마스터 업데이트 중 오류: {e}")
+        threading.Thread(target=master_refresh.refresh_master, args=(DB_FILE,), daemon=True).start()
+    else:
+        # 종목 검색 인덱스는 백그라운드에서 생성 (시작 지연 방지, 완료 전 검색은 그 자리에서 생성)
+        threading.Thread(target=search_index.rebuild_index, args=(DB_FILE, True), daemon=True).start()
 
-        threading.Thread(target=background_update, daemon=True).start()
-    
-    conn.close()
+    # 지표 시계열에 아직 반영하지 않은 로컬 결과 사본 반영
+    threading.Thread(target=fundamentals_store.backfill, args=(RESULTS_DIR,), daemon=True).start()
+
+# 종목 마스터 변경 시 검색 인덱스와 상장폐지 종목 이력을 갱신
+master_refresh.subscribe(search_index.on_master_change(DB_FILE))
+master_refresh.subscribe(lambda changes: history_store.purge_codes(changes['delisted']))
 
 # DB 초기화 실행
 init_db()
@@ -229,11 +164,186 @@ def cleanup_old_results(max_files=20):
             for i in range(len(files) - max_files):
                 os.remove(files[i][0])
                 print(f"자동 삭제됨: {files[i][0]}")
+
+        # 열 형식 사본은 엑셀을 드라이브에 올린 뒤에도 남으므로 따로 개수 제한
+        sidecars = sorted(
+            (os.path.join(RESULTS_DIR, f) for f in os.listdir(RESULTS_DIR) if f.endswith(result_store.SIDECAR_EXT)),
+            key=os.path.getctime
+        )
+        for path in sidecars[:max(0, len(sidecars) - max_files)]:
+            os.remove(path)
+            result_store.forget(path)
+
+        # 오래된 수집 저널 정리 (이어하기 대상이 아닌 것들)
+        journals = sorted(
+            (os.path.join(JOURNAL_DIR, f) for f in os.listdir(JOURNAL_DIR) if f.endswith('.jsonl')),
+            key=os.path.getctime
+        )
+        for path in journals[:max(0, len(journals) - max_files)]:
+            os.remove(path)
+
+        # 중단된 수집이 남긴 임시 파일(.part) 정리 (수집 중인 결과의 파일은 제외)
+        from result_writer import PART_EXT
+        active = {os.path.splitext(t['resume_file'])[0] for t in list(tasks.values())
+                  if t.get('resume_file') and t.get('status') == 'running'}
+        for filename in os.listdir(RESULTS_DIR):
+            if filename.endswith(PART_EXT) and os.path.splitext(filename[:-len(PART_EXT)])[0] not in active:
+                os.remove(os.path.join(RESULTS_DIR, filename))
+                print(f"임시 파일 삭제됨: {filename}")
     except Exception as e:
         print(f"파일 정리 중 오류: {e}")
 
-def run_data_collection(task_id, stock_count=100, fields=None, market='KOSPI'):
-    """백그라운드에서 데이터 수집 실행"""
+def get_journal_path(result_filename):
+    """결과 파일명에 대응하는 수집 저널 경로"""
+    return os.path.join(JOURNAL_DIR, os.path.splitext(result_filename)[0] + '.jsonl')
+
+def save_collection_result(task_id, result_path, result_filename, market, stock_count, is_complete=True):
+    """수집 결과 파일을 드라이브에 업로드하고 DB에 등록 (is_complete=False면 부분 수집 결과)"""
+    drive_link = None
+    spreadsheet_id = None
+    size = os.path.getsize(result_path) if os.path.exists(result_path) else 0
+
+    # 같은 파일명으로 이미 등록된 결과(이어하기 전의 부분 결과)가 있으면 드라이브 사본 교체
+    old_spreadsheet_id = None
+    try:
+        conn = database.get_connection(DB_FILE)
+        row = conn.execute("SELECT spreadsheet_id FROM analysis_results WHERE filename = ?", (result_filename,)).fetchone()
+        if row:
+            old_spreadsheet_id = row[0]
+    except Exception as db_err:
+        print(f"DB 조회 실패: {db_err}")
+
+    try:
+        from drive_sync import upload_to_drive, delete_from_drive
+        drive_data = upload_to_drive(result_path)
+        if drive_data:
+            tasks[task_id]['message'] += f' (구글 드라이브 업로드 완료)'
+            drive_link = drive_data['link']
+            spreadsheet_id = drive_data['id']
+            tasks[task_id]['drive_link'] = drive_link
+            os.remove(result_path)
+            if old_spreadsheet_id and old_spreadsheet_id != spreadsheet_id:
+                delete_from_drive(old_spreadsheet_id)
+    except Exception as drive_err:
+        print(f"드라이브 업로드 실패: {drive_err}")
+
+    created_at = datetime.now().isoformat()
+    try:
+        conn = database.get_connection(DB_FILE)
+        cursor = conn.cursor()
+        parts = result_filename.replace('.xlsx', '').split('_')
+        market_val = parts[0].upper() if len(parts) > 0 else market
+        count_val = parts[1] if len(parts) > 1 else str(stock_count)
+
+        cursor.execute('''
+            INSERT OR REPLACE INTO analysis_results
+            (filename, market, stock_count, created_at, size, spreadsheet_id, drive_link, is_complete)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            result_filename,
+            market_val,
+            count_val,
+            created_at,
+            size,
+            spreadsheet_id,
+            drive_link,
+            1 if is_complete else 0
+        ))
+        conn.commit()
+    except Exception as db_err:
+        conn.rollback()
+        print(f"DB 저장 실패: {db_err}")
+
+    # 종목별 지표를 시계열 저장소에 누적 (엑셀이 드라이브로 옮겨진 뒤에도 조회 가능, 부분 결과는 제외)
+    sidecar = result_store.sidecar_path(result_path)
+    if is_complete and os.path.exists(sidecar):
+        try:
+            fundamentals_store.ingest_result(sidecar, created_at, result_filename)
+        except Exception as hist_err:
+            print(f"지표 시계열 저장 실패: {hist_err}")
+
+    cleanup_old_results()
+
+def get_priority_codes():
+    """마감 시간 수집 시 먼저 수집할 보유 종목 코드 목록"""
+    try:
+        rows = database.get_connection(DB_FILE).execute("SELECT code FROM my_stocks").fetchall()
+        return [r[0] for r in rows]
+    except Exception:
+        return []
+
+def read_collection_meta(result_path):
+    """data_collect.py가 남긴 수집 완전성 정보를 읽고 파일은 정리"""
+    meta_path = os.path.splitext(result_path)[0] + '.meta.json'
+    if not os.path.exists(meta_path):
+        return {}
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+    finally:
+        os.remove(meta_path)
+
+def ensure_result_sidecar(filename, spreadsheet_id=None):
+    """
+    결과의 열 형식 사본(.parquet) 경로. 없으면 None
+    사본이 없는 예전 결과는 로컬 엑셀이나 드라이브 사본에서 한 번 변환해 저장해 둡니다.
+    """
+    file_path = os.path.join(RESULTS_DIR, os.path.basename(filename))
+    path = result_store.sidecar_path(file_path)
+    if os.path.exists(path):
+        return path
+    try:
+        source = file_path if os.path.exists(file_path) else None
+        if source is None:
+            if spreadsheet_id is None:
+                row = database.get_connection(DB_FILE).execute(
+                    "SELECT spreadsheet_id FROM analysis_results WHERE filename = ?", (filename,)
+                ).fetchone()
+                spreadsheet_id = row[0] if row else None
+            if spreadsheet_id:
+                from drive_sync import download_from_drive
+                content = download_from_drive(spreadsheet_id)
+                if content:
+                    import io
+                    source = io.BytesIO(content)
+        if source is None:
+            return None
+        result_store.convert_excel(source, path)
+        print(f"결과 사본 생성: {os.path.basename(path)}")
+        return path
+    except Exception as e:
+        print(f"결과 사본 생성 실패 ({filename}): {e}")
+        return None
+
+def prepare_base_result(market, stock_count):
+    """증분 수집 기준으로 쓸 같은 시장/종목 수의 최근 완전 수집 결과 (열 형식 사본 경로, 생성 시각)"""
+    count_label = 'all' if stock_count == 0 else f'top{stock_count}'
+    prefix = f'{market.lower()}_{count_label}_'
+    try:
+        rows = database.get_connection(DB_FILE).execute(
+            "SELECT filename, created_at, spreadsheet_id FROM analysis_results WHERE COALESCE(is_complete, 1) = 1 ORDER BY created_at DESC"
+        ).fetchall()
+    except Exception as db_err:
+        print(f"DB 조회 실패: {db_err}")
+        return None, None
+
+    for filename, created_at, spreadsheet_id in rows:
+        if not filename.startswith(prefix):
+            continue
+        path = ensure_result_sidecar(filename, spreadsheet_id)
+        if path:
+            return path, created_at
+        break
+    return None, None
+
+def run_data_collection(task_id, stock_count=100, fields=None, market='KOSPI', resume_file=None, deadline=None, incremental=False):
+    """
+    백그라운드에서 데이터 수집 실행
+    - deadline: 제한 시간(초), 지나면 완료된 종목만 저장
+    - incremental: 같은 시장/종목 수의 최근 결과를 기준으로 보고서가 바뀐 종목만 재무 데이터 재수집
+    """
     try:
         tasks[task_id]['status'] = 'running'
         tasks[task_id]['progress'] = 0
@@ -245,15 +355,36 @@ def run_data_collection(task_id, stock_count=100, fields=None, market='KOSPI'):
         if 'uwsgi' in python_cmd.lower():
             python_cmd = 'python'
 
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        count_label = 'all' if stock_count == 0 else f'top{stock_count}'
-        result_filename = f'{market.lower()}_{count_label}_{timestamp}.xlsx'
+        if resume_file:
+            # 중단된 수집을 같은 파일명으로 이어서 진행
+            result_filename = resume_file
+        else:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            count_label = 'all' if stock_count == 0 else f'top{stock_count}'
+            result_filename = f'{market.lower()}_{count_label}_{timestamp}.xlsx'
         result_path = os.path.join(RESULTS_DIR, result_filename)
+        journal_path = get_journal_path(result_filename)
+        tasks[task_id]['resume_file'] = result_filename
 
-        cmd = [python_cmd, script_path, '--count', str(stock_count), '--market', market, '--output', result_path]
+        # 결과 조회용 열 형식 사본(.parquet)도 함께 저장
+        cmd = [python_cmd, script_path, '--count', str(stock_count), '--market', market, '--output', result_path,
+               '--journal', journal_path, '--formats', 'parquet']
 
         if fields:
             cmd.extend(['--fields', ','.join(fields)])
+        if resume_file:
+            cmd.append('--resume')
+        if deadline:
+            cmd.extend(['--deadline', str(deadline)])
+            priority_codes = get_priority_codes()
+            if priority_codes:
+                cmd.extend(['--priority', ','.join(priority_codes)])
+        if incremental:
+            base_path, base_created_at = prepare_base_result(market, stock_count)
+            if base_path:
+                cmd.extend(['--base', base_path, '--base-date', base_created_at or ''])
+            else:
+                tasks[task_id]['logs'].append('증분 수집 기준 결과가 없어 전체 수집합니다.')
 
         process = subprocess.Popen(
             cmd,
@@ -295,55 +426,31 @@ def run_data_collection(task_id, stock_count=100, fields=None, market='KOSPI'):
             del tasks[task_id]['process']
 
         if tasks[task_id].get('status') == 'cancelled':
+            # 취소된 경우에도 저널에 기록된 종목까지는 부분 결과 파일로 저장
+            try:
+                from result_writer import write_result_from_journal
+                saved = write_result_from_journal(journal_path, result_path, fields, ['parquet'])
+                if saved:
+                    tasks[task_id]['message'] = f'수집이 취소되었습니다. 완료된 {saved}개 종목을 부분 결과로 저장했습니다.'
+                    tasks[task_id]['result_file'] = result_filename
+                    save_collection_result(task_id, result_path, result_filename, market, stock_count, is_complete=False)
+            except Exception as partial_err:
+                print(f"부분 결과 저장 실패: {partial_err}")
             return
 
         if process.returncode == 0:
+            meta = read_collection_meta(result_path)
             if os.path.exists(result_path):
+                is_complete = meta.get('complete', True)
                 tasks[task_id]['status'] = 'completed'
                 tasks[task_id]['progress'] = 100
-                tasks[task_id]['message'] = '데이터 수집 완료!'
+                tasks[task_id]['complete'] = is_complete
+                if is_complete:
+                    tasks[task_id]['message'] = '데이터 수집 완료!'
+                else:
+                    tasks[task_id]['message'] = f"제한 시간 내 {meta.get('collected', 0)}/{meta.get('total', 0)}개 종목 수집 완료 (부분 결과)"
                 tasks[task_id]['result_file'] = result_filename
-                
-                drive_link = None
-                spreadsheet_id = None
-                try:
-                    from drive_sync import upload_to_drive
-                    drive_data = upload_to_drive(result_path)
-                    if drive_data:
-                        tasks[task_id]['message'] += f' (구글 드라이브 업로드 완료)'
-                        drive_link = drive_data['link']
-                        spreadsheet_id = drive_data['id']
-                        tasks[task_id]['drive_link'] = drive_link
-                        os.remove(result_path)
-                except Exception as drive_err:
-                    print(f"드라이브 업로드 실패: {drive_err}")
-
-                try:
-                    conn = sqlite3.connect(DB_FILE)
-                    cursor = conn.cursor()
-                    parts = result_filename.replace('.xlsx', '').split('_')
-                    market_val = parts[0].upper() if len(parts) > 0 else market
-                    count_val = parts[1] if len(parts) > 1 else str(stock_count)
-                    
-                    cursor.execute('''
-                        INSERT OR REPLACE INTO analysis_results 
-                        (filename, market, stock_count, created_at, size, spreadsheet_id, drive_link)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        result_filename,
-                        market_val,
-                        count_val,
-                        datetime.now().isoformat(),
-                        os.path.getsize(result_path) if os.path.exists(result_path) else 0,
-                        spreadsheet_id,
-                        drive_link
-                    ))
-                    conn.commit()
-                    conn.close()
-                except Exception as db_err:
-                    print(f"DB 저장 실패: {db_err}")
-                
-                cleanup_old_results()
+                save_collection_result(task_id, result_path, result_filename, market, stock_count, is_complete)
             else:
                 tasks[task_id]['status'] = 'error'
                 tasks[task_id]['message'] = '결과 파일을 찾을 수 없습니다.'
@@ -355,13 +462,22 @@ def run_data_collection(task_id, stock_count=100, fields=None, market='KOSPI'):
     except Exception as e:
         tasks[task_id]['status'] = 'error'
         tasks[task_id]['message'] = f'오류 발생: {str(e)}'
+    finally:
+        # 취소/오류로 수집 프로세스가 파일을 닫지 못했으면 임시 파일(.part)이 남으므로 정리
+        if tasks[task_id].get('resume_file') and 'process' not in tasks[task_id]:
+            from result_writer import remove_part_files
+            try:
+                remove_part_files(os.path.join(RESULTS_DIR, tasks[task_id]['resume_file']))
+            except OSError as part_err:
+                print(f"임시 파일 정리 실패: {part_err}")
 
 def check_is_local():
     return os.name == 'nt' or 'PYTHONANYWHERE_DOMAIN' not in os.environ
 
 @app.route('/')
 def index():
-    return render_template('index.html', is_local=check_is_local())
+    return render_template('index.html', is_local=check_is_local(), field_groups=FIELD_GROUPS,
+                           source_labels=SOURCE_LABELS, dart_fields=DART_ONLY_FIELDS)
 
 @app.route('/api/collect', methods=['POST'])
 def start_collection():
@@ -373,6 +489,18 @@ def start_collection():
     fields = data.get('fields', [])
     market = data.get('market', 'KOSPI')
     tickers = data.get('tickers', [])
+    resume_file = data.get('resume')
+    incremental = bool(data.get('incremental'))
+    try:
+        deadline = max(0, int(data.get('deadline') or 0))
+    except (TypeError, ValueError):
+        deadline = 0
+
+    # 이어하기: 해당 결과 파일의 저널이 남아 있는 경우에만 허용
+    if resume_file:
+        resume_file = os.path.basename(resume_file)
+        if not os.path.exists(get_journal_path(resume_file)):
+            return jsonify({'success': False, 'message': '이어서 수집할 작업 기록이 없습니다.'}), 404
 
     task_id = str(uuid.uuid4())
     tasks[task_id] = {
@@ -382,10 +510,12 @@ def start_collection():
         'stock_count': stock_count,
         'market': market,
         'tickers': tickers,
+        'deadline': deadline,
+        'incremental': incremental,
         'created_at': datetime.now().isoformat()
     }
 
-    thread = threading.Thread(target=run_data_collection, args=(task_id, stock_count, fields, market))
+    thread = threading.Thread(target=run_data_collection, args=(task_id, stock_count, fields, market, resume_file, deadline, incremental))
     thread.start()
 
     return jsonify({
@@ -398,7 +528,7 @@ def start_collection():
 def get_status(task_id):
     if task_id not in tasks:
         return jsonify({'error': '작업을 찾을 수 없습니다.'}), 404
-    task_info = {k: v for k, v in tasks[task_id].items() if k != 'process'}
+    task_info = {k: v for k, v in tasks[task_id].items() if k not in ('process', 'chunks')}
     return jsonify(task_info)
 
 @app.route('/api/cancel/<task_id>', methods=['POST'])
@@ -497,258 +627,20 @@ def get_portfolio_details(ticker):
          'foreign_20d_net': all_data.get('foreign_20d_net', 0),
          'inst_5d_net': all_data.get('inst_5d_net', 0),
          'inst_20d_net': all_data.get('inst_20d_net', 0),
-         'ma5': all_data.get('ma5', 0),
-         'ma20': all_data.get('ma20', 0),
+         'foreign_60d_net': all_data.get('foreign_60d_net', 0),
+         'inst_60d_net': all_data.get('inst_60d_net', 0),
      })
 
-    return data
-
+    # 기술적 지표 (RSI, 이동평균선, 볼린저밴드, ATR, 거래량 평균)
+    data.update({key: all_data.get(key, 0) for key in empty_indicators()})
 
-# ===== 기존 get_portfolio_details 함수는 주석 처리 (백업용) =====
-def get_portfolio_details_old(ticker):
-    """[DEPRECATED] 기존 함수 - get_all_naver_data로 대체됨"""
-    # 1. 메인 페이지 데이터 (가격, 목표주가, 재무지표)
-    main_url = f"https://finance.naver.com/item/main.naver?code={ticker}"
-    # 2. 투자자별 매매동향 (수급)
-    investor_url = f"https://finance.naver.com/item/frgn.naver?code={ticker}"
-    
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
-    data = {
-        'code': ticker,
-        'current_price': 0,
-        'market_cap': 'N/A',
-        'opinion': 'N/A',
-        'target_price': 0,
-        'high_52w': 0,
-        'low_52w': 0,
-        'per': 0,
-        'pbr': 0,
-        'dividend_yield': 0,
-        'revenue_growth': 'N/A',
-        'profit_growth': 'N/A',
-        'foreign_net_buy': 0,
-        'inst_net_buy': 0,
-        'rsi': 0
-    }
-    
-    try:
-        # --- 메인 페이지 파싱 ---
-        response = requests.get(main_url, headers=headers, timeout=5)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # 현재가
-        new_totalinfo = soup.find('div', class_='new_totalinfo')
-        if new_totalinfo:
-            blind = new_totalinfo.find('dl', class_='blind')
-            if blind:
-                dd_list = blind.find_all('dd')
-                if len(dd_list) >= 4:
-                    price_text = dd_list[3].text.split()[1].replace(',', '')
-                    data['current_price'] = int(price_text)
-                
-        # 시가총액 (첫 번째 테이블에서 찾기)
-        first_tbody = soup.find('table', class_='tb_type1')
-        if first_tbody:
-            tbody = first_tbody.find('tbody')
-            if tbody:
-                for tr in tbody.find_all('tr'):
-                    th = tr.find('th')
-                    if th and '시가총액' in th.get_text():
-                        td = tr.find('td')
-                        if td:
-                            data['market_cap'] = td.get_text(strip=True)
-
-        # 투자의견/목표주가 (전체 페이지에서 검색 - HTML 구조 변경에 대응)
-        # 새로운 네이버 금융 구조: <th>투자의견l목표주가</th> <td><span>매수</span><em>166,385</em></td>
-        for tr in soup.find_all('tr'):
-            th = tr.find('th')
-            if th and '투자의견' in th.get_text() and '목표주가' in th.get_text():
-                td = tr.find('td')
-                if td:
-                    # 투자의견 (span 태그에서)
-                    opinion_span = td.find('span', class_='f_up') or td.find('span')
-                    if opinion_span:
-                        opinion_text = opinion_span.get_text(strip=True)
-                        # 숫자 제거 (예: "4.00매수" -> "매수")
-                        data['opinion'] = re.sub(r'^[\d.]+', '', opinion_text).strip()
-
-                    # 목표주가 (em 태그에서)
-                    ems = td.find_all('em')
-                    for em in ems:
-                        text = em.get_text(strip=True).replace(',', '')
-                        # 숫자만 있는 em 태그 찾기 (목표주가)
-                        if text.isdigit() and len(text) >= 4:  # 최소 4자리 (만원 이상)
-                            data['target_price'] = int(text)
-                            break
-                break
-
-        # 재무 지표 (성장성 포함)
-        section = soup.find('div', class_='section cop_analysis')
-        if section:
-            # 클래스가 tb_type1과 tb_num을 포함하는 테이블 찾기 (HTML 구조 변경 대응)
-            table = section.find('table', class_=lambda c: c and 'tb_type1' in c and 'tb_num' in c)
-            if table:
-                trs = table.find_all('tr')
-                
-                # 수집할 데이터 맵
-                finance_data = {
-                    '매출액': [],
-                    '영업이익': [],
-                    '매출액증가율': 'N/A',
-                    '영업이익증가율': 'N/A'
-                }
-                
-                for tr in trs:
-                    th = tr.find('th')
-                    if not th: continue
-                    th_text = th.get_text(strip=True)
-                    tds = tr.find_all('td')
-                    if not tds: continue
-                    
-                    # -2: 최근 확정 연도 실적, -1: 올해 전망치(보통)
-                    # 만약 전망치가 있으면 -2를 쓰고, 없으면 -1을 쓰는 유연함이 필요하지만 
-                    # 우선 -2를 기준으로 하되 N/A인 경우 앞쪽으로 탐색
-                    
-                    def get_last_valid_val(td_list):
-                        # 뒤에서부터 (전망치 제외하고) 유효한 값 찾기
-                        for i in range(len(td_list)-2, -1, -1):
-                            val = td_list[i].get_text(strip=True).replace(',', '')
-                            if val and val != '-' and val != 'N/A':
-                                return val
-                        return None
-
-                    if '매출액증가율' in th_text:
-                        val = get_last_valid_val(tds)
-                        if val: finance_data['매출액증가율'] = val
-                    elif '영업이익증가율' in th_text:
-                        val = get_last_valid_val(tds)
-                        if val: finance_data['영업이익증가율'] = val
-                    elif th_text == '매출액':
-                        finance_data['매출액'] = [t.get_text(strip=True).replace(',', '') for t in tds]
-                    elif th_text == '영업이익':
-                        finance_data['영업이익'] = [t.get_text(strip=True).replace(',', '') for t in tds]
-
-                # 직접 계산 (성장성 지표가 명시적으로 없는 경우)
-                if finance_data['매출액증가율'] == 'N/A' and len(finance_data['매출액']) >= 3:
-                    try:
-                        # 최근 2년 데이터 비교 (보통 인덱스 1, 2 또는 2, 3)
-                        # thead에서 확정 연도 위치를 파악하는 것이 정확하나 간이로 진행
-                        curr = float(finance_data['매출액'][-2]) # 최근 확정
-                        prev = float(finance_data['매출액'][-3]) # 전년
-                        if prev > 0:
-                            growth = round((curr - prev) / prev * 100, 1)
-                            finance_data['매출액증가율'] = str(growth)
-                    except: pass
-                
-                if finance_data['영업이익증가율'] == 'N/A' and len(finance_data['영업이익']) >= 3:
-                    try:
-                        curr = float(finance_data['영업이익'][-2])
-                        prev = float(finance_data['영업이익'][-3])
-                        if prev > 0:
-                            growth = round((curr - prev) / prev * 100, 1)
-                            finance_data['영업이익증가율'] = str(growth)
-                    except: pass
-                
-                data['revenue_growth'] = finance_data['매출액증가율']
-                data['profit_growth'] = finance_data['영업이익증가율']
-
-        # 52주 고점/저점 및 PER/PBR (전체 페이지에서 검색 - 구조 변경 대응)
-        all_trs = soup.find_all('tr')
-        for tr in all_trs:
-            tr_text = tr.get_text()
-            # 52주 고/저
-            if '52주' in tr_text and ('최고' in tr_text or '고가' in tr_text):
-                ems = tr.find_all('em')
-                if len(ems) >= 2:
-                    try:
-                        high_text = ems[0].get_text(strip=True).replace(',', '')
-                        low_text = ems[1].get_text(strip=True).replace(',', '')
-                        if high_text.isdigit():
-                            data['high_52w'] = int(high_text)
-                        if low_text.isdigit():
-                            data['low_52w'] = int(low_text)
-                    except:
-                        pass
+    return data
 
-            # PER (ID 기반 검색이 더 안정적)
-            if 'PER' in tr_text and '배당' not in tr_text:
-                per_em = tr.find('em', id='_per')
-                if per_em:
-                    val = per_em.get_text(strip=True).replace(',', '')
-                    if val and val != '-' and val != 'N/A':
-                        try:
-                            data['per'] = float(val)
-                        except:
-                            pass
-
-            # PBR
-            if 'PBR' in tr_text:
-                pbr_em = tr.find('em', id='_pbr')
-                if pbr_em:
-                    val = pbr_em.get_text(strip=True).replace(',', '')
-                    if val and val != '-' and val != 'N/A':
-                        try:
-                            data['pbr'] = float(val)
-                        except:
-                            pass
-
-            # 배당수익률
-            if '배당수익률' in tr_text:
-                d_em = tr.find('em', id='_dvr')
-                if d_em:
-                    val = d_em.get_text(strip=True).replace(',', '').replace('%', '')
-                    if val and val != '-' and val != 'N/A':
-                        try:
-                            data['dividend_yield'] = float(val)
-                        except:
-                            pass
-
-        # --- 수급 현황 (일별 매매동향) 파싱 ---
-        frgn_response = requests.get(investor_url, headers=headers, timeout=5)
-        frgn_soup = BeautifulSoup(frgn_response.text, 'html.parser')
-        frgn_table = frgn_soup.find('table', class_='type2')
-        if frgn_table:
-            rows = frgn_table.find_all('tr')
-            f_total = 0
-            i_total = 0
-            count = 0
-            for r in rows:
-                if count >= 5: break # 최근 5일치 합산
-                tds = r.find_all('td')
-                # 날짜가 있는 데이터 행인지 확인 (클래스 tc 가 보통 날짜를 포함함)
-                if len(tds) >= 7 and '.' in tds[0].get_text():
-                    try:
-                        # 숫자와 부호만 추출
-                        i_text = re.sub(r'[^0-9\-]', '', tds[5].get_text(strip=True))
-                        f_text = re.sub(r'[^0-9\-]', '', tds[6].get_text(strip=True))
-                        if i_text: i_total += int(i_text)
-                        if f_text: f_total += int(f_text)
-                        count += 1
-                    except: continue
-            data['foreign_net_buy'] = f_total
-            data['inst_net_buy'] = i_total
-
-        # --- 기술적 지표 (RSI) 약식 계산 또는 외부 연동 ---
-        if data['high_52w'] > data['low_52w']:
-            data['rsi'] = round((data['current_price'] - data['low_52w']) / (data['high_52w'] - data['low_52w']) * 100, 1)
-
-        return data
-    except Exception as e:
-        print(f"Error collecting data for {ticker}: {e}")
-        return data
 
 def get_current_price(ticker):
-    """네이버 금융에서 현재가를 가져옵니다."""
+    """네이버 금융에서 현재가를 가져옵니다. (현재가 필드만 추출)"""
     try:
-        url = f"https://finance.naver.com/item/main.naver?code={ticker}"
-        res = requests.get(url, timeout=5)
-        soup = BeautifulSoup(res.text, 'html.parser')
-        price_area = soup.select_one('.no_today .no_up .blind, .no_today .no_down .blind, .no_today .no_steady .blind')
-        if price_area:
-            return int(price_area.text.strip().replace(',', ''))
+        return NaverMainPage.fetch(ticker, timeout=5).get('current_price', 0)
     except:
         pass
     return 0
@@ -772,6 +664,11 @@ def get_my_stocks_status():
         cursor.execute("SELECT code, name, purchase_price, quantity FROM my_stocks")
         stocks = [dict(row) for row in cursor.fetchall()]
         
+        # 기술적 지표와 수급 이력은 보유 종목 전체를 한 번에 갱신 (종목별 상세 수집 시 저장된 값 사용)
+        codes = [s['code'] for s in stocks]
+        get_indicators(codes)
+        get_investor_flows(codes)
+
         # 상세 데이터 수집 (병렬 처리)
         with ThreadPoolExecutor(max_workers=5) as executor:
             details = list(executor.map(lambda s: get_portfolio_details(s['code']), stocks))
@@ -817,14 +714,14 @@ def get_my_stocks_status():
                 'foreign_20d_net': detail.get('foreign_20d_net', 0),
                 'inst_5d_net': detail.get('inst_5d_net', 0),
                 'inst_20d_net': detail.get('inst_20d_net', 0),
+                'foreign_60d_net': detail.get('foreign_60d_net', 0),
+                'inst_60d_net': detail.get('inst_60d_net', 0),
                 'foreign_ownership_ratio': detail.get('foreign_ownership_ratio', 0),
-                'rsi_pos': detail.get('rsi', 0), # 52주 고저점 대비 위치
+                'rsi_pos': detail.get('price_position_52w', 0), # 52주 고저점 대비 위치
+                'price_position_52w': detail.get('price_position_52w', 0),
                 'news': detail.get('news', []),
-                'ma5': detail.get('ma5', 0),
-                'ma20': detail.get('ma20', 0),
-                'ma5_diff': detail.get('ma5_diff', 0),
-                'ma20_diff': detail.get('ma20_diff', 0)
             })
+            results[-1].update({key: detail.get(key, 0) for key in empty_indicators()})
             
         return jsonify(results)
     except Exception as e:
@@ -891,68 +788,213 @@ def search_stock():
         return jsonify([])
     
     try:
-        db = get_db()
-        cursor = db.cursor()
-        # 이름으로 검색 (부분 일치)
-        cursor.execute("SELECT code, name FROM stocks_master WHERE name LIKE ? LIMIT 10", (f'%{query}%',))
-        results = [dict(row) for row in cursor.fetchall()]
-        return jsonify(results)
+        # 메모리 인덱스에서 종목명(부분 일치), 초성, 종목코드 접두어로 검색
+        return jsonify(search_index.search(DB_FILE, query))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/update_master', methods=['POST'])
 def update_master():
-    """종목 마스터 리스트 업데이트 (백그라운드)"""
-    def run_update():
-        try:
-            import requests
-            from bs4 import BeautifulSoup
-            
-            all_stocks = []
-            session = requests.Session()
-            # KOSPI (sosok=0), KOSDAQ (sosok=1)
-            for sosok in [0, 1]:
-                market_name = 'KOSPI' if sosok == 0 else 'KOSDAQ'
-                page = 1
-                while True:
-                    url = f"https://finance.naver.com/sise/sise_market_sum.naver?sosok={sosok}&page={page}"
-                    res = session.get(url)
-                    soup = BeautifulSoup(res.text, 'html.parser')
-                    table = soup.find('table', {'class': 'type_2'})
-                    if not table: break
-                    
-                    found = False
-                    for a in table.find_all('a', {'class': 'tltle'}):
-                        code = a.get('href').split('code=')[1]
-                        name = a.text.strip()
-                        all_stocks.append((code, name, market_name))
-                        found = True
-                    
-                    if not found or page > 40: break # 대략 40페이지까지
-                    page += 1
-            
-            if all_stocks:
-                conn = sqlite3.connect(DB_FILE)
-                cursor = conn.cursor()
-                cursor.executemany("INSERT OR REPLACE INTO stocks_master (code, name, market) VALUES (?, ?, ?)", all_stocks)
-                conn.commit()
-                conn.close()
-                print(f"종목 마스터 업데이트 완료: {len(all_stocks)}개 종목")
-        except Exception as e:
-            print(f"마스터 업데이트 중 오류: {e}")
-
-    threading.Thread(target=run_update).start()
+    """종목 마스터 리스트 업데이트 (백그라운드, 변경분만 반영)"""
+    if master_refresh.is_running():
+        return jsonify({'success': False, 'message': '이미 업데이트가 진행 중입니다.'})
+    threading.Thread(target=master_refresh.refresh_master, args=(DB_FILE,), daemon=True).start()
     return jsonify({'success': True, 'message': '업데이트가 시작되었습니다.'})
 
 
+# 결과 목록 컬럼 (AI 리포트는 본문 대신 로컬 리포트 캐시에 있는지 여부만 has_ai로)
+RESULT_LIST_COLUMNS = ['filename', 'market', 'stock_count', 'created_at', 'size', 'spreadsheet_id', 'drive_link', 'is_complete']
+RESULT_PAGE_SIZE = 20
+RESULT_PAGE_MAX = 200
+
+def _encode_cursor(created_at, filename):
+    return base64.urlsafe_b64encode(json.dumps([created_at, filename]).encode()).decode()
+
+def _decode_cursor(cursor_text):
+    created_at, filename = json.loads(base64.urlsafe_b64decode(cursor_text.encode()))
+    return created_at, filename
+
 @app.route('/api/results', methods=['GET'])
 def get_results():
+    """
+    수집 결과 목록 (최신순, 키셋 페이지네이션)
+    - limit: 페이지 크기 (기본 20, 최대 200)
+    - cursor: 이전 응답의 next_cursor
+    - market / exclude_market: 쉼표로 구분한 시장 포함/제외
+    - from / to: 생성일 범위 (YYYY-MM-DD, 양끝 포함)
+    - has_ai: 로컬 AI 리포트 캐시(ai_report_cache)에 리포트가 있는지 (본문은 /api/ai_report_check)
+    """
     try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT * FROM analysis_results ORDER BY created_at DESC")
-        results = [dict(row) for row in cursor.fetchall()]
-        return jsonify(results)
+        args = request.args
+        limit = min(max(int(args.get('limit', RESULT_PAGE_SIZE)), 1), RESULT_PAGE_MAX)
+
+        where, params = [], []
+        if args.get('market'):
+            markets = [m.strip().upper() for m in args['market'].split(',') if m.strip()]
+            where.append(f"market IN ({','.join('?' * len(markets))})")
+            params.extend(markets)
+        if args.get('exclude_market'):
+            markets = [m.strip().upper() for m in args['exclude_market'].split(',') if m.strip()]
+            where.append(f"market NOT IN ({','.join('?' * len(markets))})")
+            params.extend(markets)
+        if args.get('from'):
+            where.append("created_at >= ?")
+            params.append(args['from'])
+        if args.get('to'):
+            # created_at은 ISO 형식이므로 날짜 뒤에 '~'(시각 문자보다 큼)를 붙여 그날 전체 포함
+            where.append("created_at <= ?")
+            params.append(args['to'] + '~')
+        if args.get('cursor'):
+            where.append("(created_at, filename) < (?, ?)")
+            params.extend(_decode_cursor(args['cursor']))
+
+        query = (f"SELECT {', '.join(RESULT_LIST_COLUMNS)}, "
+                 "EXISTS (SELECT 1 FROM ai_report_cache c WHERE c.filename = analysis_results.filename) AS has_ai "
+                 "FROM analysis_results")
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY created_at DESC, filename DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = [dict(row) for row in get_db().execute(query, params).fetchall()]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1]['created_at'], rows[-1]['filename'])
+        return jsonify({'items': rows, 'next_cursor': next_cursor})
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'잘못된 요청 파라미터: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _split_arg(value):
+    return [v.strip() for v in (value or '').split(',') if v.strip()]
+
+RESULT_ROWS_PAGE_SIZE = 100
+RESULT_ROWS_PAGE_MAX = 1000
+
+@app.route('/api/results/diff', methods=['GET'])
+def diff_result_sets():
+    """
+    두 수집 결과 비교 (종목코드 기준, 열 형식 사본 사용)
+    - base / target: 이전 결과 파일명, 비교할 결과 파일명
+    - metrics: 쉼표로 구분한 비교 지표 (기본: 두 결과에 모두 있는 숫자 지표 전체)
+    - sort / order: 정렬 컬럼 (예: 순위변화, PER_변화), desc(기본) 또는 asc. 기본은 현재 순위 순
+    - offset / limit: 페이지 위치와 크기 (기본 100, 최대 1000)
+    """
+    try:
+        args = request.args
+        if not args.get('base') or not args.get('target'):
+            raise ValueError("base와 target 파일명이 필요합니다.")
+        paths = []
+        for name in (args['base'], args['target']):
+            path = ensure_result_sidecar(name)
+            if not path:
+                return jsonify({'error': f'파일을 찾을 수 없습니다: {name}'}), 404
+            paths.append(path)
+        order = args.get('order', 'desc').lower()
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"order는 asc 또는 desc 입니다: {order}")
+        offset = max(int(args.get('offset', 0)), 0)
+        limit = min(max(int(args.get('limit', RESULT_ROWS_PAGE_SIZE)), 1), RESULT_ROWS_PAGE_MAX)
+        result = result_store.diff_results(paths[0], paths[1], _split_arg(args.get('metrics')),
+                                           args.get('sort') or None, order == 'desc', offset, limit)
+        return jsonify(result)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'잘못된 요청 파라미터: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/results/<filename>/rows', methods=['GET'])
+def get_result_rows(filename):
+    """
+    수집 결과 행 조회 (열 형식 사본 기준, 엑셀을 내려받지 않음)
+    - columns: 쉼표로 구분한 컬럼 목록 (기본 전체)
+    - filter: 컬럼:연산자:값 (eq, ne, lt, le, gt, ge, contains), 여러 번 지정하면 모두 만족
+    - sort / order: 정렬 컬럼, asc(기본) 또는 desc
+    - offset / limit: 페이지 위치와 크기 (기본 100, 최대 1000)
+    """
+    try:
+        path = ensure_result_sidecar(filename)
+        if not path:
+            return jsonify({'error': '파일을 찾을 수 없습니다.'}), 404
+
+        args = request.args
+        columns = [c.strip() for c in args.get('columns', '').split(',') if c.strip()]
+        filters = [result_store.parse_filter(spec) for spec in args.getlist('filter') if spec]
+        order = args.get('order', 'asc').lower()
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"order는 asc 또는 desc 입니다: {order}")
+        offset = max(int(args.get('offset', 0)), 0)
+        limit = min(max(int(args.get('limit', RESULT_ROWS_PAGE_SIZE)), 1), RESULT_ROWS_PAGE_MAX)
+
+        result = result_store.query_rows(path, columns, filters, args.get('sort') or None, order == 'desc', offset, limit)
+        return jsonify(result)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'잘못된 요청 파라미터: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/fundamentals/<code>', methods=['GET'])
+def get_fundamental_history(code):
+    """
+    한 종목의 수집 지표 추이 (수집 실행마다 쌓인 시계열)
+    - metrics: 쉼표로 구분한 지표 (기본 전체)
+    - from / to: 기준일 범위 (YYYY-MM-DD, 양끝 포함)
+    """
+    try:
+        args = request.args
+        metrics = _split_arg(args.get('metrics'))
+        history = fundamentals_store.metric_history(code, metrics, args.get('from'), args.get('to'))
+        return jsonify({'code': code, 'history': fundamentals_store.to_records(history, 'as_of')})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/fundamentals', methods=['GET'])
+def get_fundamental_cross_section():
+    """
+    한 기준일의 전 종목 지표 단면
+    - date: 기준일 (YYYY-MM-DD, 기본 최근, 수집이 없던 날이면 그 이전 가장 최근 기준일)
+    - metrics: 쉼표로 구분한 지표 (기본 전체)
+    """
+    try:
+        args = request.args
+        as_of, table = fundamentals_store.cross_section(args.get('date'), _split_arg(args.get('metrics')))
+        return jsonify({
+            'as_of': as_of,
+            'rows': fundamentals_store.to_records(table, '종목코드'),
+            'dates': [{'as_of': d, 'filename': f, 'row_count': n, 'metrics': m}
+                      for d, f, n, m in fundamentals_store.available_dates()],
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+SCREEN_PAGE_SIZE = 50
+SCREEN_PAGE_MAX = 1000
+
+@app.route('/api/screen', methods=['GET'])
+def screen_stocks():
+    """
+    최신 전 종목 단면 스크리닝 (수집 없이 저장된 지표로 계산)
+    - where: 조건식 (예: PER < 업종평균PER and ROE > 15 and 부채비율 < 100)
+    - sort / order: 정렬식 (예: `FCF수익률(%)`), desc(기본) 또는 asc
+    - columns: 쉼표로 구분한 응답 컬럼 (기본: 종목명, 기준일, 식에 쓰인 지표). 지표마다 '<지표> 기준일'이 함께 붙음
+    - offset / limit: 페이지 위치와 크기 (기본 50, 최대 1000)
+    식 문법은 screening.py 참고
+    """
+    try:
+        args = request.args
+        order = args.get('order', 'desc').lower()
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"order는 asc 또는 desc 입니다: {order}")
+        offset = max(int(args.get('offset', 0)), 0)
+        limit = min(max(int(args.get('limit', SCREEN_PAGE_SIZE)), 1), SCREEN_PAGE_MAX)
+        total, page = screening.screen(args.get('where') or None, args.get('sort') or None, order == 'desc',
+                                       _split_arg(args.get('columns')), limit, offset)
+        return jsonify({'total': total, 'offset': offset, 'limit': limit,
+                        'rows': fundamentals_store.to_records(page, '종목코드')})
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'잘못된 요청 파라미터: {e}'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -961,6 +1003,14 @@ def download_file(filename):
     file_path = os.path.join(RESULTS_DIR, filename)
     if os.path.exists(file_path):
         return send_file(file_path, as_attachment=True)
+
+    # 드라이브에 올린 뒤 로컬 엑셀이 없으면 열 형식 사본에서 엑셀을 만들어 내려줌
+    sidecar = result_store.sidecar_path(file_path)
+    if filename.lower().endswith('.xlsx') and os.path.exists(sidecar):
+        try:
+            return send_file(result_store.export_excel(sidecar), as_attachment=True, download_name=filename)
+        except Exception as e:
+            print(f"엑셀 내보내기 실패: {e}")
     
     # 드라이브에서 다운로드 시도
     try:
@@ -985,23 +1035,163 @@ def delete_result(filename):
         cursor.execute("DELETE FROM analysis_results WHERE filename = ?", (filename,))
         db.commit()
         file_path = os.path.join(RESULTS_DIR, filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        for path in (file_path, result_store.sidecar_path(file_path)):
+            if os.path.exists(path):
+                os.remove(path)
+        result_store.forget(result_store.sidecar_path(file_path))
+        report_cache.remove_for(filename)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def load_report_input(filename):
+    """결과 AI 분석 입력 (데이터 경로, 분석 데이터, 리포트 캐시 키). 데이터가 없으면 모두 None"""
+    file_path = ensure_result_sidecar(filename)
+    if not file_path:
+        return None, None, None
+    data_summary = load_stock_summary(file_path)
+    return file_path, data_summary, stock_report_key(data_summary)
+
+# AI 분석 작업: Gemini 호출(재시도 대기 포함)은 요청 스레드가 아닌 작업 스레드에서 실행하고
+# 화면은 /api/ai_stream/<task_id>(SSE)로 생성 중인 리포트를 받거나 /api/status/<task_id>로 결과를 확인합니다.
+# (수집 작업과 같은 tasks 사용)
+AI_JOB_WORKERS = 2
+# 끝난 AI 작업 상태 보관 시간(초), 결과는 리포트 캐시에 남음
+AI_TASK_TTL = 3600
+# SSE로 새 응답 조각을 확인하는 간격(초)
+AI_STREAM_INTERVAL = 0.2
+ai_executor = ThreadPoolExecutor(max_workers=AI_JOB_WORKERS, thread_name_prefix='ai-job')
+ai_jobs = {}  # 작업 키 -> task_id (같은 분석을 여러 번 눌러도 한 번만 실행)
+ai_jobs_lock = threading.Lock()
+
+def prune_ai_tasks():
+    """보관 시간이 지난 끝난 AI 작업 제거 (ai_jobs_lock 안에서 호출)"""
+    now = time.time()
+    for task_id, task in list(tasks.items()):
+        if task.get('kind') == 'ai' and now - task.get('finished_at', now) > AI_TASK_TTL:
+            tasks.pop(task_id, None)
+    for job_key, task_id in list(ai_jobs.items()):
+        if task_id not in tasks:
+            ai_jobs.pop(job_key, None)
+
+def run_ai_job(task_id, func, args):
+    task = tasks[task_id]
+    task['status'] = 'running'
+    task['message'] = 'AI가 분석 중입니다...'
+    try:
+        task.update(func(*args, on_chunk=task['chunks'].append))
+        task['status'] = 'completed'
+        task['progress'] = 100
+        task['message'] = 'AI 분석 완료'
+    except Exception as e:
+        task['status'] = 'error'
+        task['message'] = str(e)
+    task['finished_at'] = time.time()
+
+def start_ai_job(job_key, func, *args):
+    """
+    AI 분석 작업을 등록하고 task_id를 반환합니다.
+    func(*args, on_chunk=...)는 생성 중인 응답 조각을 on_chunk로 넘기고(task['chunks'])
+    끝나면 {'result', 'format', 'cached'}를 반환해 작업 상태에 그대로 합쳐집니다.
+    같은 job_key 작업이 아직 진행 중이면 새로 만들지 않고 그 task_id를 반환
+    """
+    with ai_jobs_lock:
+        prune_ai_tasks()
+        task_id = ai_jobs.get(job_key)
+        if task_id in tasks and tasks[task_id]['status'] in ('pending', 'running'):
+            return task_id
+        task_id = str(uuid.uuid4())
+        tasks[task_id] = {
+            'kind': 'ai',
+            'status': 'pending',
+            'progress': 0,
+            'message': 'AI 분석 대기 중...',
+            'chunks': [],
+            'created_at': datetime.now().isoformat()
+        }
+        ai_jobs[job_key] = task_id
+    ai_executor.submit(run_ai_job, task_id, func, args)
+    return task_id
+
+def stock_report_job(filename, on_chunk=None):
+    """결과 AI 리포트 작업: 로컬 캐시에 없을 때만 분석하고 유효한 결과는 캐시/드라이브에 저장"""
+    # 1. 원본 데이터 확인 (열 형식 사본, 없으면 로컬 엑셀/드라이브에서 한 번 변환)
+    file_path, data_summary, cache_key = load_report_input(filename)
+    if not file_path:
+        raise FileNotFoundError('파일을 찾을 수 없습니다.')
+
+    # 2. 같은 데이터/프롬프트로 만든 리포트가 로컬 캐시에 있으면 사용
+    # (드라이브 리포트는 화면에서 먼저 호출하는 ai_report_check에서 확인)
+    cached = report_cache.get(cache_key)
+    if cached:
+        return {'cached': True, **cached}
+
+    # 3. AI 분석 수행
+    result_text = analyze_stock_data(file_path, data_summary, on_chunk)
+
+    # 4. 유효한 결과만 로컬 캐시에 저장하고 구글 문서로도 저장 (드라이브 실패는 무시)
+    if report_cache.is_valid_report(result_text):
+        report_cache.put(cache_key, filename, result_text)
+        try:
+            from drive_sync import create_google_doc
+            create_google_doc(f"AI 분석 리포트 - {os.path.splitext(filename)[0]}", result_text)
+        except Exception as drive_err:
+            print(f"AI 리포트 드라이브 저장 실패: {drive_err}")
+    return {'result': result_text, 'format': 'markdown', 'cached': False}
+
+def portfolio_report_job(portfolio_data, cache_key, on_chunk=None):
+    """포트폴리오 AI 진단 작업: 유효한 결과는 오늘자 캐시에 저장"""
+    result_text = analyze_portfolio(portfolio_data, on_chunk)
+    if report_cache.is_valid_report(result_text):
+        conn = database.get_connection(DB_FILE)
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO portfolio_ai_cache (cache_key, ai_result, created_at) VALUES (?, ?, ?)",
+                         (cache_key, result_text, datetime.now().isoformat()))
+    return {'result': result_text, 'format': 'markdown', 'cached': False}
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/ai_stream/<task_id>', methods=['GET'])
+def ai_stream(task_id):
+    """
+    AI 분석 작업의 응답을 생성되는 대로 SSE로 전달합니다.
+    - chunk: {'text'} 새 응답 조각 (연결 전에 생성된 조각부터 모두 보냄)
+    - done: {'result', 'format', 'cached'} 전체 리포트 (캐시/드라이브에 저장하는 것과 같은 텍스트)
+    - failed: {'message'}
+    """
+    task = tasks.get(task_id)
+    if not task or task.get('kind') != 'ai':
+        return jsonify({'error': '작업을 찾을 수 없습니다.'}), 404
+
+    def events():
+        sent = 0
+        while True:
+            # 상태를 먼저 읽어야 완료 직전에 추가된 조각을 빠뜨리지 않음
+            status = task['status']
+            chunks = task['chunks']
+            while sent < len(chunks):
+                yield sse_event('chunk', {'text': chunks[sent]})
+                sent += 1
+            if status == 'completed':
+                yield sse_event('done', {'result': task.get('result'), 'format': task.get('format'), 'cached': task.get('cached')})
+                return
+            if status == 'error':
+                yield sse_event('failed', {'message': task.get('message')})
+                return
+            time.sleep(AI_STREAM_INTERVAL)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/ai_report_check/<filename>', methods=['GET'])
 def ai_report_check(filename):
-    """기존 AI 리포트가 있는지 확인만 (캐시 체크용)"""
+    """기존 AI 리포트가 있는지 확인만 (로컬 캐시 -> 드라이브 순)"""
     try:
-        from drive_sync import find_ai_report, get_doc_content
-        base_name = os.path.splitext(filename)[0]
-        existing_report = find_ai_report(base_name)
-        if existing_report:
-            cached_content = get_doc_content(existing_report['id'])
-            if cached_content and len(cached_content.strip()) > 100:
-                return jsonify({'success': True, 'result': cached_content, 'cached': True})
+        _, _, cache_key = load_report_input(filename)
+        cached = report_cache.lookup(cache_key, filename)
+        if cached:
+            return jsonify({'success': True, 'cached': True, **cached})
         return jsonify({'success': True, 'cached': False})
     except Exception as e:
         return jsonify({'success': False, 'cached': False, 'message': str(e)})
@@ -1033,46 +1223,11 @@ def save_report_to_drive():
 
 @app.route('/api/ai_analyze/<filename>', methods=['POST'])
 def ai_analyze(filename):
+    """결과 AI 분석 작업 시작. 리포트는 /api/ai_stream/<task_id> 또는 /api/status/<task_id>"""
     try:
-        from drive_sync import find_ai_report, get_doc_content, create_google_doc, download_from_drive
-
-        # 파일명에서 확장자 제거 (AI 리포트 검색용)
-        base_name = os.path.splitext(filename)[0]
-
-        # 1. 구글 드라이브에서 기존 AI 리포트 확인 (혹시 직접 호출된 경우 대비)
-        existing_report = find_ai_report(base_name)
-        if existing_report:
-            cached_content = get_doc_content(existing_report['id'])
-            if cached_content and len(cached_content.strip()) > 100:
-                return jsonify({'success': True, 'result': cached_content, 'cached': True})
-
-        # 2. 원본 데이터 파일 확인
-        file_path = os.path.join(RESULTS_DIR, filename)
-        if not os.path.exists(file_path):
-            # 드라이브에서 임시 다운로드 시도
-            db = get_db()
-            cursor = db.cursor()
-            cursor.execute("SELECT spreadsheet_id FROM analysis_results WHERE filename = ?", (filename,))
-            row_id = cursor.fetchone()
-            if row_id and row_id['spreadsheet_id']:
-                content = download_from_drive(row_id['spreadsheet_id'])
-                if content:
-                    with open(file_path, 'wb') as f:
-                        f.write(content)
-                else:
-                    return jsonify({'success': False, 'message': '파일을 찾을 수 없습니다.'}), 404
-            else:
-                return jsonify({'success': False, 'message': '파일을 찾을 수 없습니다.'}), 404
-
-        # 3. AI 분석 수행
-        result_text = analyze_stock_data(file_path)
-
-        # 4. 결과를 구글 문서로 저장 (유효한 경우만)
-        if "오류" not in result_text and "제한" not in result_text:
-            report_title = f"AI 분석 리포트 - {base_name}"
-            create_google_doc(report_title, result_text)
-
-        return jsonify({'success': True, 'result': result_text, 'cached': False})
+        filename = os.path.basename(filename)
+        task_id = start_ai_job(f'result:{filename}', stock_report_job, filename)
+        return jsonify({'success': True, 'cached': False, 'task_id': task_id}), 202
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -1108,16 +1263,9 @@ def ai_analyze_portfolio():
             if row and row['ai_result']:
                 return jsonify({'success': True, 'result': row['ai_result'], 'cached': True})
             
-        # 4. AI 분석 수행
-        result_text = analyze_portfolio(portfolio_data)
-        
-        # 5. 결과 저장 (유효한 경우만)
-        if "오류" not in result_text and "제한" not in result_text:
-            cursor.execute("INSERT OR REPLACE INTO portfolio_ai_cache (cache_key, ai_result, created_at) VALUES (?, ?, ?)", 
-                           (cache_key, result_text, datetime.now().isoformat()))
-            db.commit()
-            
-        return jsonify({'success': True, 'result': result_text, 'cached': False})
+        # 4. AI 분석 작업 시작 (결과는 작업이 끝날 때 캐시에 저장)
+        task_id = start_ai_job(f'portfolio:{cache_key}', portfolio_report_job, portfolio_data, cache_key)
+        return jsonify({'success': True, 'cached': False, 'task_id': task_id}), 202
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -1190,8 +1338,8 @@ def sync_data():
     try:
         from drive_sync import sync_results_with_drive
         added, removed = sync_results_with_drive(RESULTS_DIR)
-        # DB 동기화 로직 (단순화)
-        init_db() 
+        # 새로 생긴 메타데이터만 DB에 등록
+        import_result_metadata(get_db())
         return jsonify({'success': True, 'added': added, 'removed': removed})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500